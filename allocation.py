@@ -0,0 +1,81 @@
+import numpy as np
+
+# N-asset versions of the SPY/TLT sizing helpers in run.py. Every function
+# takes one column (or entry) per asset so the universe can grow without
+# adding code per ticker.
+
+def volatility(prices, volumes):
+    """std of VWAP-normalized prices, per asset
+    Args:
+        prices (:obj:`ndarray`): (bars x assets) mean prices
+        volumes (:obj:`ndarray`): (bars x assets) volumes
+    Returns:
+        (:obj:`ndarray`) volatility of each asset, same as `calcAlloc`
+    """
+    vwap = (prices*volumes).sum(axis=0)/volumes.sum(axis=0)
+    return np.std(prices/vwap, axis=0)
+
+def inverseVolatilityWeights(prices, volumes):
+    """risk parity weights, each asset gets a share proportional to 1/volatility
+    Note:
+        for two assets this is exactly `calcAlloc`'s 1-(spyVol/totalVol)
+    Args:
+        prices (:obj:`ndarray`): (bars x assets) mean prices
+        volumes (:obj:`ndarray`): (bars x assets) volumes
+    Returns:
+        (:obj:`ndarray`) weights summing to 1
+    """
+    inverse = 1/volatility(prices, volumes)
+    return inverse/inverse.sum()
+
+def allocationPercentages(shares, prices):
+    """share of the purchase cost spent on each asset"""
+    cost = shares*prices
+    total = cost.sum()
+    if total == 0:
+        return np.zeros(len(cost))
+    return cost/total
+
+def allocationLoss(targets, achieved):
+    """euclidean distance between target and achieved allocation"""
+    return float(np.sqrt(((np.asarray(targets)-np.asarray(achieved))**2).sum()))
+
+def recommendShares(portfolioValue, weights, buyPrices):
+    """integer share counts whose allocation is closest to `weights`
+    Starts from the floor of each target (what `recommendInitialTarget`
+    does), then spends the leftover cash one share at a time on whichever
+    affordable asset lowers `allocationLoss` the most, so the result is never
+    worse than the floor and never leaves more cash idle. Leftover cash is less
+    than the sum of the prices, so there are at most about one step per asset,
+    and each step scores every candidate at once.
+    Args:
+        portfolioValue (float): cash available for the positions
+        weights (:obj:`ndarray`): target allocation per asset, summing to 1
+        buyPrices (:obj:`ndarray`): price paid per share
+    Returns:
+        (:obj:`ndarray`) integer shares per asset
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    buyPrices = np.asarray(buyPrices, dtype=np.float64)
+    shares = np.floor(weights*portfolioValue/buyPrices)
+    cash = portfolioValue-(shares*buyPrices).sum()
+    loss = allocationLoss(weights, allocationPercentages(shares, buyPrices))
+
+    while True:
+        affordable = buyPrices <= cash
+        if not affordable.any():
+            break
+        # allocation after adding one share of each asset, one candidate per row
+        candidates = shares+np.eye(len(shares))
+        costs = candidates*buyPrices
+        percentages = costs/costs.sum(axis=1)[:, None]
+        losses = np.sqrt(((percentages-weights)**2).sum(axis=1))
+        losses[~affordable] = np.inf
+        best = int(np.argmin(losses))
+        if losses[best] >= loss:
+            break
+        shares[best] += 1
+        cash -= buyPrices[best]
+        loss = losses[best]
+
+    return shares.astype(np.int64)
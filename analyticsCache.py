@@ -0,0 +1,136 @@
+import datetime
+import glob
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pymongo import ASCENDING, MongoClient
+
+from bucketStore import BucketStore
+
+analytics_collections = ('percentageMove', 'tracking', 'rawPrices')
+
+def sync(db, root='analytics', collections=analytics_collections, batch=50000, buckets=True):
+    """append Mongo rows newer than the last sync to monthly Parquet partitions
+
+    Each run writes one new part file per month it touches, under
+    root/<collection>/month=YYYY-MM/, and records the last exported timestamp in
+    root/<collection>/_state.json, so only new rows are read from Mongo.
+    Args:
+        db (:obj:`pymongo.database.Database`): database holding the collections
+        root (str): directory for the Parquet dataset
+        collections (tuple): series to export
+        batch (int): cursor batch size
+        buckets (bool): read the day buckets `TickStore` writes, False for the
+            per-tick collections from before the migration
+    Returns:
+        (dict): collection -> rows exported
+    """
+    store = BucketStore(db) if buckets else None
+    exported = {}
+    for collection in collections:
+        directory = os.path.join(root, collection)
+        os.makedirs(directory, exist_ok=True)
+        statePath = os.path.join(directory, '_state.json')
+        last = None
+        if os.path.exists(statePath):
+            with open(statePath) as f:
+                last = datetime.datetime.strptime(json.load(f)['last'], '%Y-%m-%dT%H:%M:%S.%f')
+
+        if store is not None:
+            columns, count = read_buckets(store, collection, last)
+        else:
+            columns, count = read_collection(db[collection], last, batch)
+        exported[collection] = count
+        if count == 0:
+            continue
+
+        table = pa.table(columns)
+        months = pd.DatetimeIndex(columns['timestamp']).strftime('%Y-%m')
+        stamp = columns['timestamp'][-1].strftime('%Y%m%dT%H%M%S%f')
+        for month in sorted(set(months)):
+            rows = (months == month).nonzero()[0]
+            partition = os.path.join(directory, 'month='+month)
+            os.makedirs(partition, exist_ok=True)
+            pq.write_table(table.take(pa.array(rows)), os.path.join(partition, 'part-'+stamp+'.parquet'))
+
+        with open(statePath, 'w') as f:
+            json.dump({'last': columns['timestamp'][-1].strftime('%Y-%m-%dT%H:%M:%S.%f')}, f)
+    return exported
+
+def read_buckets(store, series, last):
+    timestamps, values = store.read(series, start=last)
+    if last is not None:
+        # read's start is inclusive
+        newer = timestamps > np.datetime64(last, 'ms')
+        timestamps = timestamps[newer]
+        values = {field: column[newer] for field, column in values.items()}
+    columns = {'timestamp': timestamps.astype('datetime64[us]').astype(datetime.datetime).tolist()}
+    columns.update(values)
+    return columns, len(timestamps)
+
+def read_collection(collection, last, batch):
+    query = {} if last is None else {'timestamp': {'$gt': last}}
+    cursor = collection.find(query, projection={'_id': False}, sort=[('timestamp', ASCENDING)]).batch_size(batch)
+    columns = {}
+    count = 0
+    for document in cursor:
+        # build columns directly instead of keeping a dict per row
+        for field, value in document.items():
+            columns.setdefault(field, [None]*count).append(value)
+        count += 1
+        for column in columns.values():
+            if len(column) < count:
+                column.append(None)
+    return columns, count
+
+class ColumnarCache:
+    """loads the Parquet export into DataFrames, reading only files it hasn't seen
+
+    Keep one instance around (e.g. in the notebook) and call `load` after each
+    `sync`, only the new part files are read and appended.
+    """
+
+    def __init__(self, root='analytics'):
+        self.root = root
+        self.frames = {}
+        self.seen = {}
+
+    def load(self, collection):
+        """
+        Args:
+            collection (str): exported collection name
+        Returns:
+            (:obj:`pandas.DataFrame`) indexed by timestamp, ascending
+        """
+        paths = sorted(glob.glob(os.path.join(self.root, collection, 'month=*', 'part-*.parquet')))
+        seen = self.seen.setdefault(collection, set())
+        newPaths = [path for path in paths if path not in seen]
+        if newPaths:
+            frames = [pq.read_table(path).to_pandas() for path in newPaths]
+            if collection in self.frames:
+                frames.insert(0, self.frames[collection].reset_index())
+            self.frames[collection] = pd.concat(frames, ignore_index=True).set_index('timestamp').sort_index(kind='mergesort')
+            seen.update(newPaths)
+        return self.frames.get(collection, pd.DataFrame())
+
+if __name__ == '__main__':
+    # python analyticsCache.py [root] [--legacy], exports new rows of every series, --legacy
+    # reads the per-tick collections instead of the buckets
+    try:
+        import config
+        print('using local config file')
+        mongodb_uri = config.mongodb_uri
+    except:
+        print('using environment variable')
+        mongodb_uri = os.getenv('MONGODB_URI')
+
+    client = MongoClient(mongodb_uri)
+    args = [arg for arg in sys.argv[1:] if arg != '--legacy']
+    root = args[0] if args else 'analytics'
+    for collection, count in sync(client.get_database(), root, buckets='--legacy' not in sys.argv).items():
+        print(collection, 'rows exported:', count)
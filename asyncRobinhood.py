@@ -0,0 +1,261 @@
+import asyncio
+import os
+import threading
+import time
+
+import aiohttp
+import numpy as np
+
+from robinhood import (
+    Robinhood, Quote, AccountSnapshot, parse_historicals, instrument_cache, rebase_endpoints,
+    retry_statuses, endpoint_name, backoff_delay, record_latency, summarize_latency
+)
+
+class AsyncRobinhood:
+    """asyncio twin of `Robinhood` for the endpoints the gather pipeline fans out
+
+    Shares the endpoint table, parsing, instrument cache and retry policy of
+    the sync client. Use as `async with AsyncRobinhood() as rh:` so the
+    aiohttp session is opened and closed on the running loop. Sync code that
+    keeps a client across calls, like `ClientPool`, uses `run` instead, which
+    drives the client's own loop and keeps the session's connections open
+    until `shutdown`. A token from a sync `Robinhood.login` can be reused
+    with `use_token`.
+    """
+    endpoints = Robinhood.endpoints
+
+    orderOutcomeDictionary = Robinhood.orderOutcomeDictionary
+
+    def __init__(
+            self,
+            instrument_cache=instrument_cache,
+            base_url=None,
+            pool_size=10,
+            connect_timeout=3.05,
+            read_timeout=10.0,
+            max_retries=3,
+            backoff=0.25,
+            max_backoff=5.0
+        ):
+        self.instrument_cache = instrument_cache
+        base_url = base_url or os.getenv('ROBINHOOD_API_URL')
+        if base_url:
+            self.endpoints = rebase_endpoints(self.endpoints, base_url)
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.latency = {}
+        self.latencyLock = threading.Lock()
+        self.headers = dict(Robinhood.default_headers)
+        self.auth_token = None
+        self.session = None
+        self.snapshot = None
+        self.loop = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=self.timeout
+            )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def run(self, coroutine):
+        """run `coroutine` to completion on the client's own loop, opening the session on first use"""
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+        if self.session is None:
+            self.loop.run_until_complete(self.open())
+        return self.loop.run_until_complete(coroutine)
+
+    def shutdown(self):
+        """close the session and the loop `run` created"""
+        if self.loop is not None:
+            self.loop.run_until_complete(self.close())
+            self.loop.close()
+            self.loop = None
+
+    def use_token(self, auth_token):
+        """authenticate with a token from an earlier login"""
+        self.auth_token = auth_token
+        self.headers['Authorization'] = 'Token ' + auth_token
+
+    async def request(self, method, url, raise_for_status=False, **kwargs):
+        """send with the same retry rules as `Transport.request`
+        Args:
+            raise_for_status (bool): raise `aiohttp.ClientResponseError` on 4xx/5xx
+        Returns:
+            (int): response status
+            (:obj:`dict`): decoded JSON body, None if the body isn't JSON
+        """
+        idempotent = method == 'GET'
+        name = endpoint_name(self.endpoints, url)
+        attempt = 0
+        start = time.time()
+        while True:
+            try:
+                async with self.session.request(method, url, headers=self.headers, **kwargs) as res:
+                    status = res.status
+                    retryable = status == 429 or (idempotent and status in retry_statuses)
+                    if not retryable or attempt >= self.max_retries:
+                        try:
+                            data = await res.json(content_type=None)
+                        except ValueError:
+                            data = None
+                        record_latency(self.latency, self.latencyLock, name, start, attempt, error=status >= 400)
+                        if raise_for_status:
+                            res.raise_for_status()
+                        return status, data
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                # POSTs only retry when the connection was never made
+                retryable = idempotent or isinstance(e, aiohttp.ClientConnectorError)
+                if not retryable or attempt >= self.max_retries:
+                    record_latency(self.latency, self.latencyLock, name, start, attempt, error=True)
+                    raise
+            await asyncio.sleep(backoff_delay(attempt, self.backoff, self.max_backoff))
+            attempt += 1
+
+    def latency_stats(self):
+        """per-endpoint request counters, see `Transport.latency_stats`"""
+        return summarize_latency(self.latency, self.latencyLock)
+
+    async def get_json(self, url, params=None):
+        _, data = await self.request('GET', url, raise_for_status=True, params=params)
+        return data
+
+    async def get_url(self, url):
+        """flat wrapper for fetching URL directly"""
+        return await self.get_json(url)
+
+    ##############################
+    #GET DATA
+    ##############################
+
+    async def quote_data(self, stock=''):
+        """fetch stock quote, see `Robinhood.quote_data`"""
+        if stock.find(',') == -1:
+            url = str(self.endpoints['quotes']) + str(stock) + "/"
+        else:
+            url = str(self.endpoints['quotes']) + "?symbols=" + str(stock)
+        try:
+            return await self.get_json(url)
+        except aiohttp.ClientResponseError:
+            raise NameError('Invalid Symbol: ' + stock) #TODO: custom exception
+
+    async def quotes(self, stocks):
+        """fetch bid/ask/mid prices for several stocks in one request, see `Robinhood.quotes`"""
+        symbols = ','.join(stock.upper() for stock in stocks)
+        try:
+            data = await self.get_json(str(self.endpoints['quotes']) + "?symbols=" + symbols)
+        except aiohttp.ClientResponseError:
+            raise NameError('Invalid Symbol: ' + symbols) #TODO: custom exception
+
+        quotes = {}
+        for stock, result in zip(stocks, data['results']):
+            if result is None:
+                raise NameError('Invalid Symbol: ' + stock)
+            bid = float(result['bid_price'])
+            ask = float(result['ask_price'])
+            quotes[result['symbol']] = Quote(result['symbol'], bid, ask, (ask+bid)/2)
+        return quotes
+
+    async def get_historical_quote(
+            self,
+            stock,
+            interval,
+            span,
+            dtype=np.float64,
+            timestamps=False
+        ):
+        """fetch historical data for stock, see `Robinhood.get_historical_quote`"""
+        params = {
+            'symbols': stock,
+            'interval': interval,
+            'span': span,
+            'bounds': 'regular'
+        }
+        data = await self.get_json(self.endpoints['historicals'], params=params)
+        barTimes, numpyHistoricals = parse_historicals(data['results'][0]['historicals'], dtype)
+        if timestamps:
+            return barTimes, numpyHistoricals
+        return numpyHistoricals
+
+    async def instrument_symbol(self, url):
+        """ticker for an instrument url, fetched only on a cache miss
+        Note:
+            the cache may read or write Mongo, so it runs in the loop's executor
+        """
+        loop = asyncio.get_event_loop()
+        symbol = await loop.run_in_executor(None, self.instrument_cache.symbol, url)
+        if symbol is None:
+            symbol = (await self.get_url(url))['symbol']
+            await loop.run_in_executor(None, self.instrument_cache.store, symbol, url)
+        return symbol
+
+    ##############################
+    # ACCOUNT, PORTFOLIOS AND POSITIONS
+    ##############################
+
+    async def get_account(self):
+        """fetch account information"""
+        return (await self.get_json(self.endpoints['accounts']))['results'][0]
+
+    async def portfolios(self):
+        """Returns the user's portfolio data."""
+        return (await self.get_json(self.endpoints['portfolios']))['results'][0]
+
+    async def securities_owned(self):
+        """positions with more than zero shares, see `Robinhood.securities_owned`"""
+        return await self.get_json(self.endpoints['positions']+'?nonzero=true')
+
+    async def account_snapshot(self, refresh=False):
+        """account, portfolio and positions, fetched concurrently once per run"""
+        if self.snapshot is None or refresh:
+            account, portfolio, positions = await asyncio.gather(
+                self.get_account(),
+                self.portfolios(),
+                self.securities_owned()
+            )
+            self.snapshot = AccountSnapshot(account, portfolio, positions['results'])
+        return self.snapshot
+
+    ##############################
+    #PLACE ORDER
+    ##############################
+
+    async def check_order_status(self, url):
+        return (await self.order_status(url))[0]
+
+    async def order_status(self, url):
+        """fetch an order and map its state to an outcome, see `Robinhood.order_status`"""
+        orderResponse = await self.get_url(url)
+        return self.orderOutcomeDictionary[orderResponse['state']], orderResponse
+
+    async def place_immediate_market_order(self,instrument,symbol,time_in_force,quantity,side,price=0.0):
+        payload = {
+            'account': (await self.account_snapshot()).account_url,
+            'instrument': instrument,
+            'quantity': quantity,
+            'side': side,
+            'symbol': symbol,
+            'time_in_force': time_in_force,
+            'trigger': 'immediate',
+            'type': 'market'
+        }
+        if side == 'buy':
+            payload['price']=price
+        _, data = await self.request('POST', self.endpoints['orders'], data=payload)
+        return data
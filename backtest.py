@@ -0,0 +1,369 @@
+import math
+import multiprocessing
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+from pymongo import ASCENDING, MongoClient
+
+import allocation
+import performanceMetrics
+
+# bars for several symbols on a shared time axis, `values` is (bars x symbols x columns) with the
+# `Robinhood.get_historical_quote` columns: open_price, low_price, high_price, close_price, mean_price, volume
+Bars = namedtuple('Bars', ['times', 'symbols', 'values'])
+
+BacktestResult = namedtuple('BacktestResult', [
+    'times',      # datetime64 bar times
+    'equity',     # portfolio value at every bar close
+    'decisions',  # bar index of every rebalance decision
+    'fills',      # bar index its orders filled at
+    'weights',    # target allocation at each decision
+    'shares',     # shares held after each rebalance
+    'losses',     # allocationLoss of the sized shares against the target
+    'trades',     # orders filled
+    'costs'       # spread, slippage and commission paid
+])
+
+close = 3
+mean = 4
+volume = 5
+
+def loadBars(collection, symbols=('SPY', 'TLT'), interval='5minute', start=None, end=None):
+    """bars persisted by `BarStore`, on the times every symbol has a bar
+    Args:
+        collection (:obj:`pymongo.collection.Collection`): the bars collection
+        symbols (tuple): tickers, in allocation order
+        interval (str): bar interval
+        start (:obj:`datetime.datetime`): inclusive start, None for all
+        end (:obj:`datetime.datetime`): exclusive end, None for all
+    Returns:
+        (:obj:`Bars`)
+    """
+    times = []
+    values = []
+    for symbol in symbols:
+        query = {'symbol': symbol, 'interval': interval}
+        if start is not None or end is not None:
+            query['begins_at'] = {}
+            if start is not None:
+                query['begins_at']['$gte'] = start
+            if end is not None:
+                query['begins_at']['$lt'] = end
+        documents = list(collection.find(query, projection={'_id': False, 'begins_at': True, 'bar': True}, sort=[('begins_at', ASCENDING)]))
+        times.append(np.array([document['begins_at'] for document in documents], dtype='datetime64[s]'))
+        values.append(np.array([document['bar'] for document in documents], dtype=np.float64).reshape(-1, 6))
+    return align(symbols, times, values)
+
+def align(symbols, times, values):
+    """keep only the times every symbol has a bar for"""
+    common = times[0]
+    for symbolTimes in times[1:]:
+        common = np.intersect1d(common, symbolTimes)
+    stacked = np.stack([
+        symbolValues[np.searchsorted(symbolTimes, common)]
+        for symbolTimes, symbolValues in zip(times, values)
+    ], axis=1)
+    return Bars(common, tuple(symbols), stacked)
+
+def saveBars(path, bars):
+    np.savez(path, times=bars.times, symbols=np.array(bars.symbols), values=bars.values)
+
+def loadBarsFile(path):
+    data = np.load(path)
+    return Bars(data['times'], tuple(data['symbols'].tolist()), data['values'])
+
+def resample(bars, interval):
+    """merge bars into longer ones, e.g. 5minute bars into 30 minute bars
+    Args:
+        bars (:obj:`Bars`)
+        interval (:obj:`numpy.timedelta64`): new bar length, a multiple of the old one
+    Returns:
+        (:obj:`Bars`) with the mean price recomputed from the merged open/low/high/close
+    """
+    seconds = int(interval/np.timedelta64(1, 's'))
+    keys = bars.times.astype('datetime64[s]').astype(np.int64)//seconds
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    ends = np.append(starts[1:], len(keys))-1
+    values = np.empty((len(starts),)+bars.values.shape[1:])
+    values[:, :, 0] = bars.values[starts, :, 0]
+    values[:, :, 1] = np.minimum.reduceat(bars.values[:, :, 1], starts, axis=0)
+    values[:, :, 2] = np.maximum.reduceat(bars.values[:, :, 2], starts, axis=0)
+    values[:, :, close] = bars.values[ends, :, close]
+    values[:, :, mean] = values[:, :, 0:4].sum(axis=2)/4
+    values[:, :, volume] = np.add.reduceat(bars.values[:, :, volume], starts, axis=0)
+    return Bars((keys[starts]*seconds).astype('datetime64[s]'), bars.symbols, values)
+
+def targetWeights(bars, window=np.timedelta64(7, 'D'), steepness=None, center=.5):
+    """`calcAlloc` evaluated at every bar at once
+    Inverse volatility of VWAP-normalized mean prices over the bars in
+    [t-window, t], the same window `RollingAllocator` keeps, from cumulative
+    sums so the whole history costs O(bars).
+    Args:
+        bars (:obj:`Bars`)
+        window (:obj:`numpy.timedelta64`): lookback, calcAlloc fetches a week
+        steepness (float): if set, the sigmoid from trader.py on the first
+            symbol's raw allocation (live uses 20), two symbols only
+        center (float): sigmoid midpoint
+    Returns:
+        (:obj:`ndarray`) (bars x symbols) weights, NaN until the window has 2 bars
+    """
+    prices = bars.values[:, :, mean]
+    volumes = bars.values[:, :, volume]
+    starts = np.searchsorted(bars.times, bars.times-window, side='left')
+    ends = np.arange(1, len(bars.times)+1)
+    _, stds = performanceMetrics.rollingMeanStd(prices, starts, ddof=0)
+    zeros = np.zeros((1, prices.shape[1]))
+    priceVolume = np.concatenate([zeros, np.cumsum(prices*volumes, axis=0)])
+    totalVolume = np.concatenate([zeros, np.cumsum(volumes, axis=0)])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        vwap = (priceVolume[ends]-priceVolume[starts])/(totalVolume[ends]-totalVolume[starts])
+        inverse = vwap/stds
+        weights = inverse/inverse.sum(axis=1, keepdims=True)
+    weights[~np.isfinite(weights).all(axis=1)] = np.nan
+
+    if steepness is not None:
+        if weights.shape[1] != 2:
+            raise ValueError('the sigmoid allocation needs exactly two symbols')
+        first = 1/(1+np.exp(-steepness*(weights[:, 0]-center)))
+        weights = np.stack([first, 1-first], axis=1)
+    return np.clip(weights, 0, 1)
+
+class SimulatedBroker:
+    """fills market orders against a synthetic quote around each bar's close
+
+    The quote is the close +/- half the spread. Buys pay the ask and sells
+    get the bid, each moved against the order by `slippage`. Orders fill
+    `delay` bars after the decision so the sizing never sees its fill price,
+    and are rejected with probability `reject_rate` from a seeded generator,
+    so the same broker settings always give the same run.
+    """
+
+    def __init__(self, spread=0.0002, slippage=0.0, commission=0.0, reject_rate=0.0, delay=1, seed=0):
+        """
+        Args:
+            spread (float): bid/ask spread as a fraction of the price
+            slippage (float): extra price impact as a fraction of the price
+            commission (float): flat fee per filled order
+            reject_rate (float): probability an order isn't filled
+            delay (int): bars between the decision and the fill
+            seed (int): seed for the rejections
+        """
+        self.spread = spread
+        self.slippage = slippage
+        self.commission = commission
+        self.reject_rate = reject_rate
+        self.delay = delay
+        self.random = np.random.RandomState(seed)
+
+    def quote(self, price):
+        """(bid, ask) around a price"""
+        return price*(1-self.spread/2), price*(1+self.spread/2)
+
+    def fill(self, side, price):
+        """price an order fills at, None if it was rejected"""
+        if self.reject_rate and self.random.random_sample() < self.reject_rate:
+            return None
+        bid, ask = self.quote(price)
+        if side == 'buy':
+            return ask*(1+self.slippage)
+        return bid*(1-self.slippage)
+
+def sizeShares(sizer, portfolioValue, weights, buyPrices):
+    """target shares with one of run.py's sizing rules
+    Args:
+        sizer (str): 'shares' for `allocation.recommendShares` (what run_trader
+            uses), 'initial' for `recommendInitialTarget` or 'target' for
+            `recommendTarget`, the last two for two symbols only
+    """
+    if sizer == 'shares':
+        return allocation.recommendShares(portfolioValue, weights, buyPrices)
+    from run import recommendInitialTarget, recommendTarget
+    if sizer == 'initial':
+        return np.array(recommendInitialTarget(portfolioValue, weights[0], weights[1], buyPrices[0], buyPrices[1]))
+    try:
+        return np.array(recommendTarget(portfolioValue, weights[0], weights[1], buyPrices[0], buyPrices[1]))
+    except (ZeroDivisionError, OverflowError):
+        # all in on the first symbol, the ratio is unbounded
+        return np.array(recommendInitialTarget(portfolioValue, weights[0], weights[1], buyPrices[0], buyPrices[1]))
+
+def rebalanceIndices(times, every=None):
+    """bars a rebalance is decided at, the first bar of each day or every `every` bars"""
+    if every is not None:
+        return np.arange(0, len(times), every)
+    days = times.astype('datetime64[D]')
+    return np.flatnonzero(np.concatenate([[True], days[1:] != days[:-1]]))
+
+def run(
+        bars,
+        window=np.timedelta64(7, 'D'),
+        steepness=None,
+        center=.5,
+        sizer='shares',
+        broker=None,
+        every=None,
+        threshold=0.0,
+        cash=10000.0,
+        weights=None
+    ):
+    """replay bars through the allocation and sizing of `run_trader`
+
+    Target weights for every bar come from `targetWeights` in one pass. Only
+    the rebalances, which depend on the cash and shares left by the previous
+    one, run in a Python loop, then the equity curve is valued for every bar
+    at once.
+    Args:
+        bars (:obj:`Bars`)
+        window (:obj:`numpy.timedelta64`): volatility lookback
+        steepness (float): sigmoid steepness, None for the raw allocation
+        center (float): sigmoid midpoint
+        sizer (str): see `sizeShares`
+        broker (:obj:`SimulatedBroker`): fill model, a default one if None
+        every (int): bars between rebalances, None for daily
+        threshold (float): skip a rebalance while the held allocation is
+            within this `allocationLoss` of the target
+        cash (float): starting cash
+        weights (:obj:`ndarray`): precomputed `targetWeights`, e.g. shared by a sweep
+    Returns:
+        (:obj:`BacktestResult`)
+    """
+    if broker is None:
+        broker = SimulatedBroker()
+    if weights is None:
+        weights = targetWeights(bars, window, steepness, center)
+    closes = bars.values[:, :, close]
+    startCash = cash
+    symbolCount = len(bars.symbols)
+    shares = np.zeros(symbolCount)
+    trades = 0
+    costs = 0.0
+
+    decisions, fills, targets, held, losses, cashes = [], [], [], [], [], []
+    for decision in rebalanceIndices(bars.times, every):
+        fillAt = decision+broker.delay
+        target = weights[decision]
+        if fillAt >= len(bars.times) or np.isnan(target).any():
+            continue
+        prices = closes[decision]
+        portfolioValue = cash+(shares*prices).sum()
+        if threshold and shares.any():
+            if allocation.allocationLoss(target, allocation.allocationPercentages(shares, prices)) < threshold:
+                continue
+
+        # run_trader sizes against a buy price a full spread above the ask
+        bids, asks = broker.quote(prices)
+        buyPrices = asks+(asks-bids)
+        targetShares = sizeShares(sizer, portfolioValue, target, buyPrices)
+        loss = allocation.allocationLoss(target, allocation.allocationPercentages(targetShares, buyPrices))
+
+        # sells first, buys are limited to the cash they leave
+        required = targetShares-shares
+        fillPrices = closes[fillAt]
+        for side, symbols in (('sell', np.flatnonzero(required < 0)), ('buy', np.flatnonzero(required > 0))):
+            for symbol in symbols:
+                price = broker.fill(side, fillPrices[symbol])
+                if price is None:
+                    continue
+                quantity = abs(required[symbol])
+                if side == 'buy':
+                    quantity = min(quantity, math.floor((cash-broker.commission)/price))
+                    if quantity <= 0:
+                        continue
+                    cash -= quantity*price
+                    shares[symbol] += quantity
+                else:
+                    cash += quantity*price
+                    shares[symbol] -= quantity
+                cash -= broker.commission
+                costs += quantity*abs(price-fillPrices[symbol])+broker.commission
+                trades += 1
+
+        decisions.append(decision)
+        fills.append(fillAt)
+        targets.append(target)
+        held.append(shares.copy())
+        losses.append(loss)
+        cashes.append(cash)
+
+    # shares and cash in force at each bar, from the last fill at or before it
+    fills = np.array(fills, dtype=np.int64)
+    held = np.array(held).reshape(-1, symbolCount)
+    state = np.searchsorted(fills, np.arange(len(bars.times)), side='right')
+    heldShares = np.vstack([np.zeros((1, symbolCount)), held])[state]
+    heldCash = np.concatenate([[startCash], cashes])[state]
+    return BacktestResult(
+        bars.times,
+        heldCash+(heldShares*closes).sum(axis=1),
+        np.array(decisions, dtype=np.int64),
+        fills,
+        np.array(targets).reshape(-1, symbolCount),
+        held,
+        np.array(losses),
+        trades,
+        costs
+    )
+
+def summary(result):
+    """headline metrics of a run
+    Note:
+        Sharpe is of the per bar returns annualized by the bars per year, without a risk free rate
+    Returns:
+        (dict): 'sharpe', 'totalReturn', 'maxDrawdown', 'meanLoss', 'rebalances', 'trades', 'costs'
+    """
+    returns = (result.equity[1:]/result.equity[:-1]-1).reshape(-1, 1)
+    return {
+        'sharpe': float(performanceMetrics.sharpe(returns, performanceMetrics.periodsPerYear(result.times))[0]),
+        'totalReturn': float(result.equity[-1]/result.equity[0]-1),
+        'maxDrawdown': float(performanceMetrics.maxDrawdown(returns)[0]),
+        'meanLoss': float(result.losses.mean()) if len(result.losses) else float('nan'),
+        'rebalances': len(result.decisions),
+        'trades': result.trades,
+        'costs': float(result.costs)
+    }
+
+# bars of the sweep, set once per worker process instead of pickled per task
+sweepBars = None
+
+def initSweep(bars):
+    global sweepBars
+    sweepBars = bars
+
+def runSweepPoint(point):
+    options, brokerOptions = point
+    # a fresh broker per point so every run sees the same rejections
+    result = run(sweepBars, broker=SimulatedBroker(**brokerOptions), **options)
+    return options, summary(result)
+
+def sweep(bars, grid, brokerOptions={}, processes=None):
+    """run `run` for every option set on a process pool
+    Args:
+        bars (:obj:`Bars`)
+        grid (list): dicts of `run` keyword arguments, e.g. [{'steepness': 20}, ...]
+        brokerOptions (dict): `SimulatedBroker` arguments for every run
+        processes (int): pool size, the cpu count if None
+    Returns:
+        (list): (options, `summary`) per grid point, in grid order
+    """
+    with multiprocessing.Pool(processes, initSweep, (bars,)) as pool:
+        return pool.map(runSweepPoint, [(options, brokerOptions) for options in grid])
+
+if __name__ == '__main__':
+    # python backtest.py [bars.npz] [steepness ...], reads the bars collection without a file
+    if len(sys.argv) > 1 and sys.argv[1].endswith('.npz'):
+        bars = loadBarsFile(sys.argv[1])
+        steepnesses = sys.argv[2:]
+    else:
+        try:
+            import config
+            print('using local config file')
+            mongodb_uri = config.mongodb_uri
+        except:
+            print('using environment variable')
+            mongodb_uri = os.getenv('MONGODB_URI')
+        bars = loadBars(MongoClient(mongodb_uri).get_database().bars)
+        steepnesses = sys.argv[1:]
+
+    grid = [{'steepness': None}]+[{'steepness': float(steepness)} for steepness in steepnesses]
+    for options, metrics in sweep(bars, grid):
+        print(options, metrics)
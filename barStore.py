@@ -0,0 +1,196 @@
+import asyncio
+import threading
+
+import numpy as np
+from pymongo import ASCENDING, DESCENDING, ReplaceOne
+
+class BarStore:
+    """per-symbol OHLCV history that only appends bars newer than the last stored one
+
+    Bars live in a preallocated in-memory array per symbol so `window` can
+    hand out views instead of copies. The `historicals` endpoint only takes
+    a span, not a start time, so `update` fetches the short `delta_span`
+    (one day) and keeps the bars at or after the last stored one. It falls
+    back to `full_span` when the store is cold or the day doesn't reach back
+    to the last stored bar. With `use_collection` the bars are also
+    persisted to Mongo so a cold process starts from the database rather
+    than the API, reading back only the last `load_span` of bars.
+    """
+
+    def __init__(
+            self,
+            interval='5minute',
+            full_span='week',
+            delta_span='day',
+            capacity=8192,
+            load_span=np.timedelta64(7, 'D')
+        ):
+        """
+        Args:
+            interval (str): bar resolution passed to `get_historical_quote`
+            full_span (str): span fetched when the store is cold or has a gap
+            delta_span (str): span fetched on a warm update
+            capacity (int): bars kept in memory per symbol
+            load_span (:obj:`numpy.timedelta64`): bars read back from Mongo on a
+                cold start, counted back from the newest one
+        """
+        self.interval = interval
+        self.full_span = full_span
+        self.delta_span = delta_span
+        self.capacity = capacity
+        self.load_span = load_span
+        self.collection = None
+        self.times = {}
+        self.values = {}
+        self.lengths = {}
+        self.lock = threading.Lock()
+
+    def use_collection(self, collection):
+        """persist bars to and warm the store from a Mongo collection
+        Note:
+            the indexes are made once by `create_indexes`, not per job
+        Args:
+            collection (:obj:`pymongo.collection.Collection`): bar store
+        """
+        self.collection = collection
+
+    @staticmethod
+    def create_indexes(collection, retention=366*24*60*60):
+        """lookup index plus a TTL index that drops bars older than `retention` seconds
+        Note:
+            keep longer histories for backtests with `backtest.saveBars`
+        """
+        collection.create_index(
+            [('symbol', ASCENDING), ('interval', ASCENDING), ('begins_at', ASCENDING)],
+            unique=True
+        )
+        collection.create_index([('begins_at', ASCENDING)], expireAfterSeconds=int(retention))
+
+    def update(self, rh, symbol):
+        """fetch and append any bars newer than the last stored one
+        Args:
+            rh (:obj:`Robinhood`): logged in client
+            symbol (str): stock ticker
+        Returns:
+            (int): number of bars added or replaced
+        """
+        span = self._span(symbol)
+        barTimes, bars = rh.get_historical_quote(symbol, self.interval, span, timestamps=True)
+        if self._has_gap(symbol, span, barTimes):
+            barTimes, bars = rh.get_historical_quote(symbol, self.interval, self.full_span, timestamps=True)
+        return self._locked_append(symbol, barTimes, bars)
+
+    async def update_async(self, rh, symbol):
+        """`update` for an `AsyncRobinhood` client, the lock is never held across a fetch
+        Note:
+            the Mongo read of a cold start and the bar write run in the
+            loop's executor so they don't stall the other fetches
+        """
+        loop = asyncio.get_event_loop()
+        span = await loop.run_in_executor(None, self._span, symbol)
+        barTimes, bars = await rh.get_historical_quote(symbol, self.interval, span, timestamps=True)
+        if self._has_gap(symbol, span, barTimes):
+            barTimes, bars = await rh.get_historical_quote(symbol, self.interval, self.full_span, timestamps=True)
+        return await loop.run_in_executor(None, self._locked_append, symbol, barTimes, bars)
+
+    def _locked_append(self, symbol, barTimes, bars):
+        with self.lock:
+            return self._append(symbol, barTimes, bars)
+
+    def window(self, symbol, span=None, timestamps=False):
+        """rolling view of the stored bars, no copy is made
+        Args:
+            symbol (str): stock ticker
+            span (:obj:`numpy.timedelta64`): only bars within this of the last one,
+                all stored bars if None
+            timestamps (bool): also return the bar start times
+        Returns:
+            (:obj:`ndarray`) columns: open_price, low_price, high_price, close_price, mean_price, volume
+            when `timestamps` is set, a (`datetime64[s]` ndarray, values) tuple
+        """
+        with self.lock:
+            length = self.lengths.get(symbol, 0)
+            if length == 0:
+                times = np.empty(0, dtype='datetime64[s]')
+                values = np.empty((0, 6))
+            else:
+                times = self.times[symbol][:length]
+                start = 0
+                if span is not None:
+                    start = np.searchsorted(times, times[-1]-span, side='left')
+                times = times[start:]
+                values = self.values[symbol][start:length]
+        if timestamps:
+            return times, values
+        return values
+
+    def _span(self, symbol):
+        with self.lock:
+            if symbol not in self.times:
+                self._load(symbol)
+            return self.full_span if self.lengths[symbol] == 0 else self.delta_span
+
+    def _has_gap(self, symbol, span, barTimes):
+        # the short span doesn't reach back to what we have, refill the gap
+        if span == self.full_span:
+            return False
+        with self.lock:
+            lastTime = self.times[symbol][self.lengths[symbol]-1]
+        return len(barTimes) == 0 or barTimes[0] > lastTime
+
+    def _load(self, symbol):
+        self.times[symbol] = np.empty(self.capacity, dtype='datetime64[s]')
+        self.values[symbol] = np.empty((self.capacity, 6))
+        self.lengths[symbol] = 0
+        if self.collection is None:
+            return
+        query = {'symbol': symbol, 'interval': self.interval}
+        latest = self.collection.find_one(query, projection={'begins_at': True}, sort=[('begins_at', DESCENDING)])
+        if latest is None:
+            return
+        start = (np.datetime64(latest['begins_at'], 's')-self.load_span).item()
+        cursor = self.collection.find(
+            dict(query, begins_at={'$gte': start}),
+            projection={'_id': False},
+            sort=[('begins_at', DESCENDING)],
+            limit=self.capacity
+        )
+        docs = list(cursor)[::-1]
+        barTimes = np.array([doc['begins_at'] for doc in docs], dtype='datetime64[s]')
+        bars = np.array([doc['bar'] for doc in docs], dtype=np.float64)
+        self._append(symbol, barTimes, bars, persist=False)
+
+    def _append(self, symbol, barTimes, bars, persist=True):
+        length = self.lengths[symbol]
+        if length > 0:
+            # keep the last stored bar replaceable, it may have been partial
+            keep = barTimes >= self.times[symbol][length-1]
+            barTimes = barTimes[keep]
+            bars = bars[keep]
+            if len(barTimes) > 0 and barTimes[0] == self.times[symbol][length-1]:
+                length -= 1
+        count = len(barTimes)
+        if count == 0:
+            return 0
+        if length+count > self.capacity:
+            # compact by dropping the oldest bars, amortized over capacity/2 appends
+            keep = max(0, min(length, self.capacity//2-count))
+            self.times[symbol][:keep] = self.times[symbol][length-keep:length]
+            self.values[symbol][:keep] = self.values[symbol][length-keep:length]
+            length = keep
+            barTimes = barTimes[-self.capacity:]
+            bars = bars[-self.capacity:]
+            count = len(barTimes)
+        self.times[symbol][length:length+count] = barTimes
+        self.values[symbol][length:length+count] = bars
+        self.lengths[symbol] = length+count
+        if persist and self.collection is not None:
+            self.collection.bulk_write([
+                ReplaceOne(
+                    {'symbol': symbol, 'interval': self.interval, 'begins_at': barTime.item()},
+                    {'symbol': symbol, 'interval': self.interval, 'begins_at': barTime.item(), 'bar': bar.tolist()},
+                    upsert=True
+                )
+                for barTime, bar in zip(barTimes, bars)
+            ], ordered=False)
+        return count
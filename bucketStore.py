@@ -0,0 +1,220 @@
+import datetime
+import os
+import sys
+
+import numpy as np
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReplaceOne, UpdateOne
+
+class BucketStore:
+    """minute series packed into one document per series per UTC day
+
+    A bucket looks like
+        {'series': 'rawPrices', 'day': <midnight>, 'count': 390,
+         'offsets': [ms since midnight, ...], 'fields': {'spy': [...], ...}}
+    so a day of minute data is one document with packed arrays instead of
+    ~400 documents that each repeat every field name. `read` returns numpy
+    arrays for a time range and touches only the buckets in that range.
+    The field arrays of a bucket stay aligned with its offsets only if every
+    tick pushes every field, so series listed in `fields` push None for a
+    field a document lacks.
+    """
+
+    def __init__(self, db, collection='buckets', fields=None):
+        """
+        Args:
+            db (:obj:`pymongo.database.Database`): database holding the buckets
+            collection (str): bucket collection name
+            fields (dict): series name -> field names pushed on every tick,
+                e.g. `tickStore.tick_fields`
+        """
+        self.collection = db[collection]
+        self.fields = fields or {}
+
+    @staticmethod
+    def create_indexes(db, collection='buckets'):
+        """unique (series, day) index, made once by `createIndexes` rather than per job"""
+        db[collection].create_index([('series', ASCENDING), ('day', ASCENDING)], unique=True)
+
+    def append_operation(self, series, document):
+        """`UpdateOne` that appends a tick document to its day bucket
+        Args:
+            series (str): series name, e.g. 'percentageMove'
+            document (dict): tick with a naive UTC 'timestamp'
+        """
+        return UpdateOne(*append_spec(series, document, self.fields.get(series)), upsert=True)
+
+    def append(self, series, document):
+        """append one tick document to its day bucket"""
+        bucketFilter, update = append_spec(series, document, self.fields.get(series))
+        return self.collection.update_one(bucketFilter, update, upsert=True)
+
+    def append_many(self, documents):
+        """append several (series, document) pairs in one bulk write"""
+        operations = [self.append_operation(series, document) for series, document in documents]
+        return self.collection.bulk_write(operations, ordered=True)
+
+    def undo_operation(self, series, document):
+        """`UpdateOne` popping a tick appended by `append_operation` off its bucket
+        Note:
+            only correct while no later tick was appended to the same bucket
+        """
+        bucketFilter, update = append_spec(series, document, self.fields.get(series))
+        return UpdateOne(bucketFilter, {
+            '$pop': {field: 1 for field in update['$push']},
+            '$inc': {'count': -1}
+        })
+
+    def tail(self, series, count):
+        """the last `count` ticks of a series as documents, oldest first
+        Note:
+            reads whole buckets from the newest day back until enough ticks are found
+        """
+        documents = []
+        for bucket in self.collection.find({'series': series}, projection={'_id': False}, sort=[('day', DESCENDING)]):
+            offsets = bucket['offsets']
+            fields = bucket.get('fields', {})
+            for index in range(len(offsets)-1, -1, -1):
+                document = {'timestamp': bucket['day']+datetime.timedelta(milliseconds=offsets[index])}
+                for field, values in fields.items():
+                    # a field that first appeared partway through the day is short at the start
+                    position = index-(len(offsets)-len(values))
+                    document[field] = values[position] if position >= 0 else None
+                documents.append(document)
+                if len(documents) >= count:
+                    return documents[::-1]
+        return documents[::-1]
+
+    def read(self, series, start=None, end=None, fields=None):
+        """series values for a time range as numpy arrays
+        Args:
+            series (str): series name
+            start (:obj:`datetime.datetime`): inclusive start, None for the beginning
+            end (:obj:`datetime.datetime`): exclusive end, None for the latest
+            fields (list): fields to return, all if None
+        Returns:
+            (:obj:`ndarray`) `datetime64[ms]` timestamps, ascending
+            (dict): field -> float64 ndarray aligned with the timestamps
+        """
+        query = {'series': series}
+        dayRange = {}
+        if start is not None:
+            dayRange['$gte'] = datetime.datetime(start.year, start.month, start.day)
+        if end is not None:
+            dayRange['$lt'] = end
+        if dayRange:
+            query['day'] = dayRange
+        projection = {'_id': False, 'day': True, 'offsets': True}
+        if fields is None:
+            projection['fields'] = True
+        else:
+            for field in fields:
+                projection['fields.'+field] = True
+
+        buckets = list(self.collection.find(query, projection=projection, sort=[('day', ASCENDING)]))
+        if fields is None:
+            fields = sorted(set(field for bucket in buckets for field in bucket.get('fields', {})))
+        if not buckets:
+            return np.empty(0, dtype='datetime64[ms]'), {field: np.empty(0) for field in fields}
+
+        times = []
+        columns = {field: [] for field in fields}
+        for bucket in buckets:
+            count = len(bucket['offsets'])
+            times.append(np.datetime64(bucket['day'], 'ms')+np.asarray(bucket['offsets'], dtype='timedelta64[ms]'))
+            for field in fields:
+                values = np.asarray(bucket.get('fields', {}).get(field, []), dtype=np.float64)
+                if len(values) < count:
+                    # a field that first appeared partway through the day
+                    values = np.concatenate([np.full(count-len(values), np.nan), values])
+                columns[field].append(values)
+
+        timestamps = np.concatenate(times)
+        order = np.argsort(timestamps, kind='mergesort')
+        timestamps = timestamps[order]
+        mask = np.ones(len(timestamps), dtype=bool)
+        if start is not None:
+            mask &= timestamps >= np.datetime64(start, 'ms')
+        if end is not None:
+            mask &= timestamps < np.datetime64(end, 'ms')
+        return timestamps[mask], {
+            field: np.concatenate(chunks)[order][mask] for field, chunks in columns.items()
+        }
+
+    def migrate(self, db, series, batch=10000):
+        """rebuild the buckets of `series` from its one-document-per-tick collection
+        Note:
+            whole days are replaced, so it can be rerun safely
+        Args:
+            db (:obj:`pymongo.database.Database`): database holding `series`
+            series (str): source collection name, also used as the series name
+            batch (int): cursor batch size
+        Returns:
+            (int): number of day buckets written
+        """
+        cursor = db[series].find(projection={'_id': False}, sort=[('timestamp', ASCENDING)]).batch_size(batch)
+        written = 0
+        operations = []
+        bucket = None
+        for document in cursor:
+            timestamp = document['timestamp']
+            bucketDay = datetime.datetime(timestamp.year, timestamp.month, timestamp.day)
+            if bucket is None or bucket['day'] != bucketDay:
+                if bucket is not None:
+                    operations.append(ReplaceOne({'series': series, 'day': bucket['day']}, bucket, upsert=True))
+                bucket = {'series': series, 'day': bucketDay, 'count': 0, 'offsets': [], 'fields': {}}
+            bucket['offsets'].append(offset_ms(timestamp, bucketDay))
+            for field, value in document.items():
+                if field != 'timestamp':
+                    # pad fields that first appear partway through the day
+                    bucket['fields'].setdefault(field, [None]*bucket['count']).append(value)
+            bucket['count'] += 1
+            for column in bucket['fields'].values():
+                if len(column) < bucket['count']:
+                    column.append(None)
+            if len(operations) >= 100:
+                self.collection.bulk_write(operations, ordered=False)
+                written += len(operations)
+                operations = []
+        if bucket is not None:
+            operations.append(ReplaceOne({'series': series, 'day': bucket['day']}, bucket, upsert=True))
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+            written += len(operations)
+        return written
+
+def append_spec(series, document, fields=None):
+    """(filter, update) pushing a tick onto its day bucket
+    Args:
+        series (str): series name
+        document (dict): tick with a naive UTC 'timestamp'
+        fields (tuple): fields pushed even when `document` lacks them, as None
+    """
+    timestamp = document['timestamp']
+    bucketDay = datetime.datetime(timestamp.year, timestamp.month, timestamp.day)
+    push = {'offsets': offset_ms(timestamp, bucketDay)}
+    for field in fields or ():
+        push['fields.'+field] = document.get(field)
+    for field, value in document.items():
+        if field not in ('_id', 'timestamp'):
+            push['fields.'+field] = value
+    return {'series': series, 'day': bucketDay}, {'$push': push, '$inc': {'count': 1}}
+
+def offset_ms(timestamp, bucketDay):
+    delta = timestamp-bucketDay
+    return (delta.days*86400+delta.seconds)*1000+delta.microseconds//1000
+
+if __name__ == '__main__':
+    # python bucketStore.py [series ...], migrates rawPrices, percentageMove and tracking by default
+    try:
+        import config
+        print('using local config file')
+        mongodb_uri = config.mongodb_uri
+    except:
+        print('using environment variable')
+        mongodb_uri = os.getenv('MONGODB_URI')
+
+    client = MongoClient(mongodb_uri)
+    db = client.get_database()
+    store = BucketStore(db)
+    for series in (sys.argv[1:] or ['rawPrices', 'percentageMove', 'tracking']):
+        print(series, 'buckets written:', store.migrate(db, series))
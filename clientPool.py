@@ -0,0 +1,185 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import requests
+from pymongo import MongoClient
+
+from asyncRobinhood import AsyncRobinhood
+from robinhood import Robinhood
+
+class ClientPool:
+    """Robinhood (sync and async), Mongo and Mailgun clients kept open across jobs
+
+    Jobs take their clients from a pool instead of building them, so a warm
+    worker (`python worker.py --warm`) that runs every job in one process
+    keeps its keep-alive sockets, Mongo connection pool and server discovery
+    between ticks. A client is health checked before being handed out once
+    `check_interval` seconds have passed since its last check, and rebuilt
+    if the check fails. A pool built per job behaves like the old code.
+    """
+
+    def __init__(self, mongodb_uri=None, base_url=None, check_interval=300, **transport_options):
+        """
+        Args:
+            mongodb_uri (str): Mongo connection string
+            base_url (str): Robinhood API root, see `Robinhood`
+            check_interval (float): seconds between health checks of a client
+            **transport_options: forwarded to `Robinhood`
+        """
+        self.mongodb_uri = mongodb_uri
+        self.base_url = base_url
+        self.check_interval = check_interval
+        self.transport_options = transport_options
+        self.clients = {}
+        self.checked = {}
+        self.created = {}
+
+    def robinhood(self):
+        """shared `Robinhood` client, cleared of the previous job's account snapshot"""
+        rh = self.get('robinhood')
+        rh.snapshot = None
+        return rh
+
+    def async_robinhood(self):
+        """shared `AsyncRobinhood` client for the gather fan-out, see `AsyncRobinhood.run`"""
+        arh = self.get('async_robinhood')
+        arh.snapshot = None
+        return arh
+
+    def mongo(self):
+        """shared `pymongo.MongoClient`"""
+        return self.get('mongo')
+
+    def mailgun(self):
+        """shared `requests.Session` for the Mailgun API"""
+        return self.get('mailgun')
+
+    def get(self, name):
+        client = self.clients.get(name)
+        now = time.time()
+        if client is not None and now-self.checked[name] > self.check_interval:
+            if not self.healthy(name, client):
+                print(name, 'client failed its health check, reconnecting')
+                self.discard(name)
+                client = None
+            else:
+                self.checked[name] = now
+        if client is None:
+            client = getattr(self, 'create_'+name)()
+            self.clients[name] = client
+            self.checked[name] = now
+            self.created[name] = self.created.get(name, 0)+1
+        return client
+
+    def healthy(self, name, client):
+        try:
+            return getattr(self, 'check_'+name)(client)
+        except Exception as e:
+            print(name, 'health check error ', str(e))
+            return False
+
+    def discard(self, name):
+        """close and forget a client, the next `get` builds a new one"""
+        client = self.clients.pop(name, None)
+        if client is not None:
+            try:
+                getattr(self, 'close_'+name)(client)
+            except Exception as e:
+                print(name, 'close error ', str(e))
+
+    def close(self):
+        for name in list(self.clients):
+            self.discard(name)
+
+    def create_robinhood(self):
+        return Robinhood(base_url=self.base_url, **self.transport_options)
+
+    def check_robinhood(self, rh):
+        # public endpoint, also replaces keep-alive sockets the server dropped
+        return rh.session.get(rh.endpoints['markets']).status_code < 500
+
+    def close_robinhood(self, rh):
+        rh.session.session.close()
+
+    def create_async_robinhood(self):
+        return AsyncRobinhood(base_url=self.base_url)
+
+    def check_async_robinhood(self, arh):
+        return arh.session is None or not arh.session.closed
+
+    def close_async_robinhood(self, arh):
+        arh.shutdown()
+
+    def create_mongo(self):
+        return MongoClient(self.mongodb_uri)
+
+    def check_mongo(self, client):
+        client.admin.command('ping')
+        return True
+
+    def close_mongo(self, client):
+        client.close()
+
+    def create_mailgun(self):
+        return requests.session()
+
+    def check_mailgun(self, session):
+        return True
+
+    def close_mailgun(self, session):
+        session.close()
+
+def tick(pool, symbols, authTokens):
+    # the client side of a gather tick: connect, authenticate, read quotes and account
+    rh = pool.robinhood()
+    authTokens.login(rh)
+    rh.quotes(symbols)
+    rh.account_snapshot()
+    if pool.mongodb_uri:
+        pool.mongo().get_database().command('ping')
+
+def benchmark(ticks, symbols, base_url, mongodb_uri, authTokens):
+    """seconds per tick with a pool built per tick (forking worker) and one shared pool (warm worker)"""
+    timings = {}
+    warm = ClientPool(mongodb_uri, base_url)
+    for mode in ('cold', 'warm'):
+        durations = []
+        for i in range(ticks):
+            start = time.time()
+            pool = warm if mode == 'warm' else ClientPool(mongodb_uri, base_url)
+            tick(pool, symbols, authTokens)
+            durations.append(time.time()-start)
+            if mode == 'cold':
+                pool.close()
+        timings[mode] = np.array(durations)
+    warm.close()
+    return timings
+
+if __name__ == '__main__':
+    # compares per tick client latency of the forking and the warm worker
+    from fakeRobinhood import FakeRobinhood
+    from tokenStore import TokenStore
+
+    parser = argparse.ArgumentParser(description='per tick latency with and without shared clients')
+    parser.add_argument('--ticks', type=int, default=50)
+    parser.add_argument('--mongodb-uri', default=os.getenv('MONGODB_URI'), help='also time the Mongo handshake')
+    parser.add_argument('--base-url', default=None, help='Robinhood API root, an in-process fake server if omitted')
+    parser.add_argument('--latency', type=float, default=0.02, help='fake server seconds per request')
+    parser.add_argument('--connect-latency', type=float, default=0.05, help='fake server seconds per new connection')
+    args = parser.parse_args()
+
+    fake = None
+    base_url = args.base_url
+    if base_url is None:
+        fake = FakeRobinhood(latency=args.latency, connect_latency=args.connect_latency)
+        base_url = fake.start()
+    try:
+        timings = benchmark(args.ticks, ['SPY', 'TLT'], base_url, args.mongodb_uri, TokenStore('user', 'password'))
+    finally:
+        if fake is not None:
+            fake.stop()
+    for mode, durations in timings.items():
+        print(mode, 'mean', durations.mean()*1000, 'ms  p95', np.percentile(durations, 95)*1000, 'ms')
+    print('saved per tick', (timings['cold'].mean()-timings['warm'].mean())*1000, 'ms')
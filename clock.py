@@ -1,7 +1,12 @@
 from apscheduler.schedulers.blocking import BlockingScheduler
 from rq import Queue
 from worker import conn
-from run import run_trader,run_gather_data
+from run import run_trader,run_gather_data,run_refresh_risk_free,marketCalendar,send_email,mailgun_domain,mailgun_api_key,diag_email_dest
+from robinhood import Robinhood
+import jobGuard
+
+import datetime
+import pytz
 
 import logging
 import sys
@@ -12,15 +17,68 @@ sched = BlockingScheduler()
 q = Queue(connection=conn)
 
 
+# a gather tick is stale after a minute, the trader polls its orders for several
+gatherDeadline = 60
+gatherTimeout = 120
+traderDeadline = 5*60
+traderTimeout = 15*60
+
 def gather_data():
-    q.enqueue(run_gather_data)
+    jobGuard.enqueue(q, 'gather_data', run_gather_data, gatherDeadline, gatherTimeout)
 
 def trader():
-    q.enqueue(run_trader)
+    jobGuard.enqueue(q, 'trader', run_trader, traderDeadline, traderTimeout)
+
+def refresh_risk_free():
+    jobGuard.enqueue(q, 'refresh_risk_free', run_refresh_risk_free, 10*60, 60)
+
+# minutes between attempts to plan a session after the hours couldn't be fetched
+planRetry = 15
+planFailures = 0
+
+def plan_session():
+    # gather every minute of the current or next session only, holidays and
+    # early closes included, instead of a fixed weekday 12-20 UTC window
+    global planFailures
+    now = datetime.datetime.utcnow()
+    try:
+        rh = Robinhood()
+        closes = marketCalendar.next_close(rh, now)
+        opens = marketCalendar.next_open(rh, now)
+    except Exception as e:
+        planFailures += 1
+        print('session planning error ', str(e))
+        if planFailures == 1:
+            try:
+                send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader clock error '+str(datetime.datetime.now())),("session planning error, gathering on the static weekday schedule. Unexpected error: "+str(e)))
+            except Exception as e:
+                print('alert email error ', str(e))
+        # the static schedule the calendar replaced, run_gather_data still checks the market itself
+        sched.add_job(gather_data, 'cron', day_of_week='mon-fri', hour="12-20", minute='*', second="0",
+            timezone=pytz.utc, id='gather_data', replace_existing=True,
+            coalesce=True, max_instances=1, misfire_grace_time=30)
+        sched.add_job(plan_session, 'date', run_date=pytz.utc.localize(now+datetime.timedelta(minutes=planRetry)),
+            id='plan_retry', replace_existing=True)
+        return
+    planFailures = 0
+    if closes is None:
+        print('no market session in the next', marketCalendar.lookahead, 'days')
+        return
+    if opens is None or opens > closes:
+        opens = now
+    print('gathering data from', opens, 'to', closes, 'UTC')
+    sched.add_job(gather_data, 'cron', minute='*', second="0",
+        start_date=pytz.utc.localize(opens), end_date=pytz.utc.localize(closes),
+        timezone=pytz.utc, id='gather_data', replace_existing=True,
+        coalesce=True, max_instances=1, misfire_grace_time=30)
 
+# live trading stays switched off, traderDeadline and traderTimeout only apply once these are restored
 #sched.add_job(trader)
 #sched.add_job(trader, 'cron', day_of_week='mon-fri', hour="14", minute="30")
-sched.add_job(gather_data, 'cron', day_of_week='mon-fri', hour="12-20", minute='*',second="0")
+sched.add_job(plan_session, 'cron', hour="11", minute="0", timezone=pytz.utc)
+# the rate changes once per business day, gather ticks only read the cache
+sched.add_job(refresh_risk_free, 'cron', day_of_week='mon-fri', hour="*/3", minute="5", timezone=pytz.utc)
+plan_session()
 
 
 sched.start()
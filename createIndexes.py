@@ -0,0 +1,34 @@
+import os
+
+from pymongo import MongoClient
+
+from barStore import BarStore
+from bucketStore import BucketStore
+from riskFreeRate import RiskFreeRate
+from robinhood import InstrumentCache
+from tickStore import TickStore
+from tradingCalendar import TradingCalendar
+
+def create_indexes(db):
+    """indexes the stores rely on, run once at worker startup rather than in every job
+    Args:
+        db (:obj:`pymongo.database.Database`): trader database
+    """
+    BarStore.create_indexes(db.bars)
+    BucketStore.create_indexes(db)
+    InstrumentCache.create_indexes(db.instruments)
+    RiskFreeRate.create_indexes(db.riskFree)
+    TickStore.create_indexes(db)
+    TradingCalendar.create_indexes(db.marketHours)
+
+if __name__ == '__main__':
+    try:
+        import config
+        print('using local config file')
+        mongodb_uri = config.mongodb_uri
+    except:
+        print('using environment variable')
+        mongodb_uri = os.getenv('MONGODB_URI')
+
+    create_indexes(MongoClient(mongodb_uri).get_database())
+    print('indexes created')
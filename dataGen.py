@@ -1,51 +1,133 @@
 from pymongo import MongoClient
+import argparse
 import datetime
-import random
-
-try:
-    import config
-    print('using local config file')
-    mongodb_uri = config.mongodb_uri
-except:
-    print('using environment variable')
-    mongodb_uri = os.getenv('MONGODB_URI')
-
-print("Generating Test Data")
-success = True
-now = datetime.datetime.utcnow()
-year = datetime.timedelta(days=365)
-minute = datetime.timedelta(minutes=1)
-start = now-year
-fakeNow = start
-
-if success:
-    try:
-        client = MongoClient(mongodb_uri)
-        db = client.get_database()
-    except Exception as e:
-        print('mongo login error ', str(e))
-        success = False
-
-while fakeNow < now:
-    if fakeNow.isoweekday() in range(1, 6):
-        if fakeNow.hour*60+fakeNow.minute in range(13*60+30, 20*60):
-            # gonna act like this is a minute where the market was open but maybe not because daylight savings and holidays, but shouldnt matter for testing anyway
-            spyChange = ((1+(random.normalvariate(0.0002939, 0.0097392)))**(1/390))-1
-            tltChange = ((1+(random.normalvariate(0.0002939, 0.0097392)))**(1/390))-1
-            assignmentWeight = random.uniform(0.0,1.0)
-
-            if success:
-                try:
-                    # save data
-                    percentageData = {
-                        "timestamp":fakeNow,
-                        "spy":spyChange,
-                        "tlt":tltChange,
-                        "portfolio":assignmentWeight*spyChange+(1-assignmentWeight)*tltChange,
-                        "90dayTreasury":0.00000010426
-                    }
-                    data_id = db.percentageMoveTest.insert_one(percentageData).inserted_id
-                except Exception as e:
-                    print('data save error ', str(e))
-                    success = False
-    fakeNow+=minute
+import os
+
+import numpy as np
+
+# gonna act like these are minutes where the market was open but maybe not because daylight savings and holidays, but shouldnt matter for testing anyway
+sessionOpen = np.timedelta64(13*60+30, 'm')
+sessionMinutes = 390
+
+def tradingMinutes(start, end):
+    """every weekday minute from 13:30 to 20:00 UTC in [start, end)
+    Args:
+        start (:obj:`datetime.datetime`): naive UTC start
+        end (:obj:`datetime.datetime`): naive UTC end
+    Returns:
+        (:obj:`ndarray`) `datetime64[ms]` timestamps, ascending
+    """
+    start = np.datetime64(start, 'ms')
+    end = np.datetime64(end, 'ms')
+    days = np.arange(start.astype('datetime64[D]'), end.astype('datetime64[D]')+1)
+    # 1970-01-01 was a thursday, so monday is 0
+    weekdays = days[(days.astype(np.int64)+3) % 7 < 5]
+    minutes = (weekdays.reshape(-1, 1)+sessionOpen)+np.arange(sessionMinutes).astype('timedelta64[m]')
+    minutes = minutes.ravel().astype('datetime64[ms]')
+    return minutes[(minutes >= start) & (minutes < end)]
+
+def generate(
+        years=1.0,
+        symbols=('spy', 'tlt'),
+        seed=None,
+        correlation=0.0,
+        mean=0.0002939,
+        std=0.0097392,
+        riskFree=0.00000010426,
+        end=None
+    ):
+    """synthetic percentageMove series for a span of trading minutes
+    Args:
+        years (float): length of the series, ending at `end`
+        symbols (tuple): one return column per symbol
+        seed (int): random seed, None for a fresh one
+        correlation (float): pairwise correlation between the symbols' draws
+        mean (float): mean of the daily scale draw
+        std (float): std of the daily scale draw
+        riskFree (float): constant per minute 90dayTreasury change
+        end (:obj:`datetime.datetime`): last minute, defaults to now
+    Returns:
+        (:obj:`ndarray`) `datetime64[ms]` timestamps
+        (dict): column -> float64 ndarray, the symbols plus 'portfolio' and '90dayTreasury'
+    """
+    if end is None:
+        end = datetime.datetime.utcnow()
+    start = end-datetime.timedelta(days=365*years)
+    timestamps = tradingMinutes(start, end)
+    random = np.random.RandomState(seed)
+
+    count = len(symbols)
+    covariance = np.full((count, count), correlation*std**2)
+    np.fill_diagonal(covariance, std**2)
+    draws = mean+random.standard_normal((len(timestamps), count)).dot(np.linalg.cholesky(covariance).T)
+    changes = (1+draws)**(1/sessionMinutes)-1
+
+    # a random allocation between the symbols each minute
+    weights = random.dirichlet(np.ones(count), size=len(timestamps))
+    columns = {symbol: changes[:, column] for column, symbol in enumerate(symbols)}
+    columns['portfolio'] = (weights*changes).sum(axis=1)
+    columns['90dayTreasury'] = np.full(len(timestamps), riskFree)
+    return timestamps, columns
+
+def documents(timestamps, columns, start=0, stop=None):
+    """percentageMove style dicts for rows [start, stop)"""
+    times = timestamps[start:stop].astype(datetime.datetime)
+    names = list(columns)
+    rows = zip(times, *[columns[name][start:stop].tolist() for name in names])
+    return [dict(zip(['timestamp']+names, row)) for row in rows]
+
+def writeMongo(collection, timestamps, columns, batch=10000):
+    """insert the rows with one unordered `insert_many` per batch
+    Returns:
+        (int): documents inserted
+    """
+    inserted = 0
+    for start in range(0, len(timestamps), batch):
+        result = collection.insert_many(documents(timestamps, columns, start, start+batch), ordered=False)
+        inserted += len(result.inserted_ids)
+    return inserted
+
+def writeParquet(path, timestamps, columns):
+    """write the rows to one Parquet file, needs pyarrow"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_arrays(
+        [pa.array(timestamps)]+[pa.array(values) for values in columns.values()],
+        names=['timestamp']+list(columns)
+    )
+    pq.write_table(table, path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='generate synthetic percentageMove test data')
+    parser.add_argument('--years', type=float, default=1.0)
+    parser.add_argument('--symbols', default='spy,tlt', help='comma separated')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--correlation', type=float, default=0.0)
+    parser.add_argument('--collection', default='percentageMoveTest', help='mongo collection, skipped with --parquet')
+    parser.add_argument('--parquet', default=None, help='write to this file instead of mongo')
+    parser.add_argument('--batch', type=int, default=10000)
+    args = parser.parse_args()
+
+    print("Generating Test Data")
+    timestamps, columns = generate(args.years, tuple(args.symbols.split(',')), args.seed, args.correlation)
+    print('rows generated:', len(timestamps))
+
+    if args.parquet:
+        writeParquet(args.parquet, timestamps, columns)
+        print('data saved to', args.parquet)
+    else:
+        try:
+            import config
+            print('using local config file')
+            mongodb_uri = config.mongodb_uri
+        except:
+            print('using environment variable')
+            mongodb_uri = os.getenv('MONGODB_URI')
+
+        try:
+            client = MongoClient(mongodb_uri)
+            db = client.get_database()
+            print('rows saved:', writeMongo(db[args.collection], timestamps, columns, args.batch))
+        except Exception as e:
+            print('data save error ', str(e))
@@ -0,0 +1,444 @@
+import argparse
+import datetime
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+class FakeRobinhood:
+    """in-process stand-in for the Robinhood endpoints the trader uses
+
+    Serves market hours, login/logout, quotes, historicals, accounts,
+    portfolios, positions, instruments and orders over plain HTTP. Prices
+    follow a seeded random walk indexed by the minute, so quotes and
+    historicals agree with each other and between runs. Orders start
+    'queued' and become 'filled' (or 'rejected') once `fill_delay` has
+    passed, updating cash and positions at the quote. Every response can be
+    delayed by `latency` +/- `jitter` and replaced by a 503 with probability
+    `error_rate`. Point a client at it with
+    `Robinhood(base_url=server.base_url)` or the ROBINHOOD_API_URL variable.
+    """
+
+    walk_length = 1 << 16
+
+    def __init__(
+            self,
+            host='127.0.0.1',
+            port=0,
+            latency=0.0,
+            jitter=0.0,
+            connect_latency=0.0,
+            error_rate=0.0,
+            fill_delay=0.0,
+            reject_rate=0.0,
+            cash=10000.0,
+            prices={'SPY': 270.0, 'TLT': 120.0},
+            positions=None,
+            spread=0.0002,
+            volatility=0.0005,
+            market_open=True,
+            require_auth=True,
+            seed=0
+        ):
+        """
+        Args:
+            host (str): interface to listen on
+            port (int): port, 0 for any free one
+            latency (float): seconds added to every response
+            jitter (float): uniform +/- seconds around `latency`
+            connect_latency (float): seconds added to every new connection,
+                standing in for the TCP/TLS handshake
+            error_rate (float): probability a request gets a 503
+            fill_delay (float): seconds an order stays queued
+            reject_rate (float): probability an order is rejected
+            cash (float): starting cash
+            prices (dict): symbol -> starting price, the tradable universe
+            positions (dict): symbol -> starting quantity
+            spread (float): bid/ask spread as a fraction of the price
+            volatility (float): std of the per minute log price change
+            market_open (bool): True to report the market open around now today,
+                False for the real 13:30-20:00 UTC weekday session
+            require_auth (bool): 401 on account endpoints without a valid token
+            seed (int): seed for prices, errors and rejections
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.connect_latency = connect_latency
+        self.connections = 0
+        self.error_rate = error_rate
+        self.fill_delay = fill_delay
+        self.reject_rate = reject_rate
+        self.cash = cash
+        self.prices = dict(prices)
+        self.positions = dict(positions or {})
+        self.spread = spread
+        self.market_open = market_open
+        self.require_auth = require_auth
+        self.random = random.Random(seed)
+        self.walk = np.cumsum(np.random.RandomState(seed).normal(0, volatility, self.walk_length))
+        self.instruments = {symbol: uuid.UUID(int=index+1).hex for index, symbol in enumerate(prices)}
+        self.orders = {}
+        self.tokens = set()
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadedServer((host, port), handler_for(self))
+        self.base_url = 'http://%s:%d/' % self.server.server_address[:2]
+        self.thread = None
+
+    def start(self):
+        """serve on a daemon thread, returns the base url"""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    ##############################
+    # PRICES
+    ##############################
+
+    def price(self, symbol, when=None):
+        """mid price of `symbol` at a `datetime64[s]` time or array of times"""
+        when = np.datetime64(datetime.datetime.utcnow(), 's') if when is None else when
+        minutes = np.asarray(when, dtype='datetime64[m]').astype(np.int64)
+        return self.prices[symbol]*np.exp(self.walk[minutes % self.walk_length])
+
+    def quote(self, symbol):
+        mid = float(self.price(symbol))
+        bid = mid*(1-self.spread/2)
+        ask = mid*(1+self.spread/2)
+        return {
+            'symbol': symbol,
+            'bid_price': '%.4f' % bid,
+            'ask_price': '%.4f' % ask,
+            'last_trade_price': '%.4f' % mid,
+            'instrument': self.instrument_url(symbol)
+        }
+
+    def historicals(self, symbol, interval, span):
+        minutes = {'5minute': 5, '10minute': 10, 'day': 24*60, 'week': 7*24*60}.get(interval, 5)
+        days = {'day': 1, 'week': 7, 'year': 365, '5year': 5*365}.get(span, 1)
+        now = np.datetime64(datetime.datetime.utcnow(), 'm')
+        # reach back over weekends, then keep the sessions the span covers
+        first = (now-np.timedelta64(days+4, 'D')).astype(np.int64)
+        starts = np.arange(first-first % minutes, now.astype(np.int64)+1, minutes).astype('datetime64[m]')
+        if minutes < 24*60:
+            # regular session only, weekdays 13:30-20:00 UTC
+            weekday = (starts.astype('datetime64[D]').astype(np.int64)+3) % 7
+            minute = (starts-starts.astype('datetime64[D]')).astype(np.int64)
+            starts = starts[(weekday < 5) & (minute >= 13*60+30) & (minute < 20*60)]
+            sessions = np.unique(starts.astype('datetime64[D]'))
+            keep = {'day': 1, 'week': 5}.get(span, len(sessions))
+            starts = starts[starts >= sessions[-keep:][0]] if len(sessions) else starts
+        else:
+            starts = starts[starts >= now-np.timedelta64(days, 'D')]
+        path = self.price(symbol, starts.reshape(-1, 1)+np.arange(minutes).astype('timedelta64[m]'))
+        return [{
+            'begins_at': str(start)+':00Z',
+            'open_price': '%.4f' % prices[0],
+            'close_price': '%.4f' % prices[-1],
+            'high_price': '%.4f' % prices.max(),
+            'low_price': '%.4f' % prices.min(),
+            'volume': 1000+int(abs(prices[-1]-prices[0])*1e5),
+            'session': 'reg',
+            'interpolated': False
+        } for start, prices in zip(starts, path)]
+
+    ##############################
+    # ACCOUNT
+    ##############################
+
+    def instrument_url(self, symbol):
+        return self.base_url+'instruments/'+self.instruments[symbol]+'/'
+
+    def equity(self):
+        return self.cash+sum(quantity*float(self.price(symbol)) for symbol, quantity in self.positions.items())
+
+    def place_order(self, form):
+        symbol = form.get('symbol')
+        if symbol not in self.prices:
+            return 400, {'detail': 'unknown symbol'}
+        orderId = str(uuid.UUID(int=self.random.getrandbits(128)))
+        order = {
+            'id': orderId,
+            'url': self.base_url+'orders/'+orderId+'/',
+            'cancel': self.base_url+'orders/'+orderId+'/cancel/',
+            'symbol': symbol,
+            'instrument': form.get('instrument'),
+            'side': form.get('side'),
+            'quantity': form.get('quantity'),
+            'price': form.get('price'),
+            'type': form.get('type', 'market'),
+            'time_in_force': form.get('time_in_force'),
+            'state': 'queued',
+            'average_price': None,
+            'cumulative_quantity': '0.00000',
+            'created': time.time(),
+            'rejected': self.random.random() < self.reject_rate
+        }
+        self.orders[orderId] = order
+        return 201, self.public_order(order)
+
+    def advance(self, order):
+        """fill or reject a queued order once its delay has passed"""
+        if order['state'] != 'queued' or time.time()-order['created'] < self.fill_delay:
+            return
+        quantity = float(order['quantity'])
+        quote = self.quote(order['symbol'])
+        if order['side'] == 'buy':
+            price = float(quote['ask_price'])
+            if order['rejected'] or quantity*price > self.cash:
+                order['state'] = 'rejected'
+                return
+            self.cash -= quantity*price
+            self.positions[order['symbol']] = self.positions.get(order['symbol'], 0.0)+quantity
+        else:
+            price = float(quote['bid_price'])
+            if order['rejected'] or quantity > self.positions.get(order['symbol'], 0.0):
+                order['state'] = 'rejected'
+                return
+            self.cash += quantity*price
+            self.positions[order['symbol']] -= quantity
+        order['state'] = 'filled'
+        order['average_price'] = '%.4f' % price
+        order['cumulative_quantity'] = '%.5f' % quantity
+        order['cancel'] = None
+
+    def public_order(self, order):
+        return {key: value for key, value in order.items() if key not in ('created', 'rejected')}
+
+    ##############################
+    # ROUTING
+    ##############################
+
+    def handle(self, method, path, query, form, headers):
+        """(status, payload) for a request, called with the lock held"""
+        parts = [part for part in path.split('/') if part]
+        if not parts:
+            return 404, {'detail': 'not found'}
+        resource = parts[0]
+
+        if method == 'POST' and resource == 'api-token-auth':
+            if not form.get('username') or not form.get('password'):
+                return 400, {'non_field_errors': ['Unable to log in with provided credentials.']}
+            token = uuid.UUID(int=self.random.getrandbits(128)).hex
+            self.tokens.add(token)
+            return 200, {'token': token}
+        if method == 'POST' and resource == 'api-token-logout':
+            self.tokens.discard(token_of(headers))
+            return 200, {}
+
+        if resource == 'markets':
+            if len(parts) == 1:
+                return 200, {'results': [{
+                    'mic': 'XNYS',
+                    'url': self.base_url+'markets/XNYS/',
+                    'todays_hours': self.base_url+'markets/XNYS/hours/today/'
+                }]}
+            if len(parts) < 4 or parts[3] == 'today':
+                return 200, self.todays_hours()
+            try:
+                day = datetime.datetime.strptime(parts[3], '%Y-%m-%d')
+            except ValueError:
+                return 404, {'detail': 'not found'}
+            return 200, self.todays_hours(day)
+        if resource == 'quotes':
+            if len(parts) > 1 and parts[1] == 'historicals':
+                symbols = query.get('symbols', [''])[0].upper().split(',')
+                if any(symbol not in self.prices for symbol in symbols):
+                    return 400, {'detail': 'unknown symbol'}
+                interval = query.get('interval', ['5minute'])[0]
+                span = query.get('span', ['day'])[0]
+                return 200, {'results': [
+                    {'symbol': symbol, 'interval': interval, 'span': span, 'historicals': self.historicals(symbol, interval, span)}
+                    for symbol in symbols
+                ]}
+            if len(parts) > 1:
+                symbol = parts[1].upper()
+                if symbol not in self.prices:
+                    return 404, {'detail': 'not found'}
+                return 200, self.quote(symbol)
+            symbols = query.get('symbols', [''])[0].upper().split(',')
+            return 200, {'results': [self.quote(symbol) if symbol in self.prices else None for symbol in symbols]}
+        if resource == 'instruments':
+            if len(parts) > 1:
+                for symbol, instrumentId in self.instruments.items():
+                    if instrumentId == parts[1]:
+                        return 200, {'symbol': symbol, 'url': self.instrument_url(symbol), 'tradeable': True}
+                return 404, {'detail': 'not found'}
+            stock = query.get('query', [''])[0].upper()
+            return 200, {'results': [
+                {'symbol': symbol, 'url': self.instrument_url(symbol), 'tradeable': True}
+                for symbol in self.prices if not stock or symbol == stock
+            ], 'next': None}
+
+        if self.require_auth and token_of(headers) not in self.tokens:
+            return 401, {'detail': 'Authentication credentials were not provided.'}
+
+        if resource == 'accounts':
+            return 200, {'results': [{
+                'url': self.base_url+'accounts/FAKE0001/',
+                'account_number': 'FAKE0001',
+                'cash': '%.2f' % self.cash,
+                'buying_power': '%.2f' % self.cash
+            }]}
+        if resource == 'portfolios':
+            equity = '%.2f' % self.equity()
+            return 200, {'results': [{
+                'url': self.base_url+'portfolios/FAKE0001/',
+                'equity': equity,
+                'extended_hours_equity': equity,
+                'adjusted_equity_previous_close': equity
+            }]}
+        if resource == 'positions':
+            nonzero = query.get('nonzero', ['false'])[0] == 'true'
+            return 200, {'results': [
+                {'instrument': self.instrument_url(symbol), 'quantity': '%.4f' % quantity}
+                for symbol, quantity in self.positions.items() if quantity or not nonzero
+            ], 'next': None}
+        if resource == 'orders':
+            if method == 'POST' and len(parts) > 2 and parts[2] == 'cancel':
+                order = self.orders.get(parts[1])
+                if order is None or order['state'] != 'queued':
+                    return 400, {'detail': 'order cannot be canceled'}
+                order['state'] = 'canceled'
+                order['cancel'] = None
+                return 200, {}
+            if method == 'POST':
+                return self.place_order(form)
+            if len(parts) > 1:
+                order = self.orders.get(parts[1])
+                if order is None:
+                    return 404, {'detail': 'not found'}
+                self.advance(order)
+                return 200, self.public_order(order)
+            for order in self.orders.values():
+                self.advance(order)
+            return 200, {'results': [self.public_order(order) for order in self.orders.values()], 'next': None}
+        return 404, {'detail': 'not found'}
+
+    def todays_hours(self, day=None):
+        """weekday sessions 13:30 to 20:00 UTC, or always open around now for `market_open`"""
+        now = datetime.datetime.utcnow()
+        if day is not None and day.date() != now.date():
+            now = day.replace(hour=12)
+        if self.market_open and now.date() == datetime.datetime.utcnow().date():
+            opens = now-datetime.timedelta(hours=1)
+            closes = now+datetime.timedelta(hours=1)
+            isOpen = True
+        else:
+            opens = now.replace(hour=13, minute=30, second=0, microsecond=0)
+            closes = now.replace(hour=20, minute=0, second=0, microsecond=0)
+            isOpen = now.isoweekday() < 6
+        return {
+            'is_open': isOpen,
+            'date': now.strftime('%Y-%m-%d'),
+            'opens_at': opens.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'closes_at': closes.strftime('%Y-%m-%dT%H:%M:%SZ')
+        }
+
+    def respond(self, method, path, query, form, headers):
+        """apply the latency and error models around `handle`"""
+        with self.lock:
+            self.requests += 1
+            delay = max(0.0, self.latency+self.random.uniform(-self.jitter, self.jitter))
+            failed = self.random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if failed:
+            return 503, {'detail': 'Service unavailable (simulated).'}
+        with self.lock:
+            return self.handle(method, path, query, form, headers)
+
+def token_of(headers):
+    authorization = headers.get('Authorization') or ''
+    return authorization[len('Token '):] if authorization.startswith('Token ') else None
+
+class ThreadedServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def handler_for(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # headers and body are separate writes, Nagle would hold the body on keep-alive
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            BaseHTTPRequestHandler.setup(self)
+            with fake.lock:
+                fake.connections += 1
+            time.sleep(fake.connect_latency)
+
+        def do_GET(self):
+            self.dispatch('GET')
+
+        def do_POST(self):
+            self.dispatch('POST')
+
+        def dispatch(self, method):
+            url = urlparse(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length).decode() if length else ''
+            form = {key: values[0] for key, values in parse_qs(body).items()}
+            status, payload = fake.respond(method, url.path, parse_qs(url.query), form, self.headers)
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+if __name__ == '__main__':
+    # python fakeRobinhood.py --port 8000, then run with ROBINHOOD_API_URL=http://127.0.0.1:8000/
+    parser = argparse.ArgumentParser(description='serve a fake Robinhood API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--connect-latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--fill-delay', type=float, default=0.0)
+    parser.add_argument('--reject-rate', type=float, default=0.0)
+    parser.add_argument('--cash', type=float, default=10000.0)
+    parser.add_argument('--real-hours', action='store_true', help='report the real session instead of always open')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    fake = FakeRobinhood(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        connect_latency=args.connect_latency,
+        error_rate=args.error_rate,
+        fill_delay=args.fill_delay,
+        reject_rate=args.reject_rate,
+        cash=args.cash,
+        market_open=not args.real_hours,
+        seed=args.seed
+    )
+    print('serving fake Robinhood API at', fake.base_url)
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,66 @@
+import time
+import uuid
+
+# delete the lock only if this run still holds it, an expired lock may belong to a newer run
+release_if_owner = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+key_prefix = 'resiliant-trader:job:'
+
+def enqueue(queue, name, func, deadline, timeout, kwargs=None):
+    """queue `func` unless a run of the same job type is already waiting
+    Note:
+        at most one job per type is queued, so a slow worker makes the clock
+        skip ticks instead of growing the queue. The job is dropped unrun
+        once `deadline` seconds have passed, by rq's ttl and by `run_guarded`.
+    Args:
+        queue (:obj:`rq.Queue`): queue to add the job to
+        name (str): job type, e.g. 'gather_data'
+        func (function): job body, importable by the worker
+        deadline (float): seconds after which the job is stale
+        timeout (int): seconds the worker lets the job run before killing it
+        kwargs (dict): keyword arguments for `func`
+    Returns:
+        (:obj:`rq.job.Job`): queued job, None if the tick was coalesced
+    """
+    conn = queue.connection
+    queued = key_prefix+name+':queued'
+    if not conn.set(queued, 1, nx=True, ex=int(deadline)):
+        print(name, 'still queued, tick skipped')
+        return None
+    try:
+        return queue.enqueue_call(
+            run_guarded,
+            args=(name, func, time.time()+deadline, timeout, kwargs or {}),
+            timeout=timeout,
+            ttl=int(deadline)
+        )
+    except Exception:
+        # nothing was queued, don't let the marker skip the next ticks
+        conn.delete(queued)
+        raise
+
+def run_guarded(name, func, deadline, timeout, kwargs):
+    """run `func` in the worker if it is still on time and no other run of `name` holds the lock
+    Returns:
+        the result of `func`, None if the run was skipped
+    """
+    from worker import conn
+    conn.delete(key_prefix+name+':queued')
+    if time.time() > deadline:
+        print(name, 'missed its deadline by', time.time()-deadline, 'seconds, discarded')
+        return None
+    lock = key_prefix+name+':lock'
+    token = uuid.uuid4().hex
+    # outlives the rq timeout so a killed job's lock still expires on its own
+    if not conn.set(lock, token, nx=True, ex=int(timeout)+30):
+        print(name, 'already running, discarded')
+        return None
+    try:
+        return func(**kwargs)
+    finally:
+        conn.register_script(release_if_owner)(keys=[lock], args=[token])
@@ -0,0 +1,33 @@
+import datetime
+import json
+
+# naive UTC datetimes throughout, as stored by pymongo
+epoch = datetime.datetime(1970, 1, 1)
+
+def to_seconds(value):
+    """seconds since the epoch for a naive UTC datetime"""
+    return (value-epoch).total_seconds()
+
+def from_seconds(seconds):
+    """naive UTC datetime for seconds since the epoch"""
+    return epoch+datetime.timedelta(seconds=seconds)
+
+def serialize(document, fields):
+    """`document` as JSON for Redis, the datetimes in `fields` as epoch seconds
+    Args:
+        document (dict): e.g. a rawPrices document, Mongo's '_id' is left out
+        fields (tuple): keys holding datetimes
+    Returns:
+        (str): JSON
+    """
+    data = {key: value for key, value in document.items() if key != '_id'}
+    for field in fields:
+        data[field] = to_seconds(data[field])
+    return json.dumps(data)
+
+def deserialize(serialized, fields):
+    """inverse of `serialize`"""
+    data = json.loads(serialized)
+    for field in fields:
+        data[field] = from_seconds(data[field])
+    return data
@@ -0,0 +1,214 @@
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+OrderRequest = namedtuple('OrderRequest', ['symbol', 'instrument', 'quantity', 'side', 'price'])
+
+class OrderExecutor:
+    """places orders concurrently and tracks their fills together
+
+    Sells are submitted at once. Every outstanding order is polled in the same
+    round, starting at `initial_interval` seconds. The interval grows by
+    `backoff` on rounds where nothing changes, up to `max_interval`, and drops
+    back when an order resolves. Buys are released in the order given as soon
+    as the available cash, plus the proceeds of filled sells, covers their
+    estimated cost. They are all released once every sell has filled.
+    Orders still open after `timeout` seconds are canceled and reported,
+    buys not yet released are dropped.
+    """
+
+    def __init__(
+            self,
+            rh,
+            workers=4,
+            initial_interval=0.25,
+            max_interval=30.0,
+            backoff=1.5,
+            timeout=10*60,
+            time_in_force='gfd'
+        ):
+        """
+        Args:
+            rh (:obj:`Robinhood`): logged in client
+            workers (int): concurrent order/status requests
+            initial_interval (float): first poll delay in seconds
+            max_interval (float): cap on the poll delay in seconds
+            backoff (float): poll delay multiplier on rounds without progress
+            timeout (float): seconds before outstanding orders are canceled,
+                kept under the trader job's rq timeout
+            time_in_force (str): passed to every order
+        """
+        self.rh = rh
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.time_in_force = time_in_force
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def log(self, *args):
+        line = ' '.join(str(arg) for arg in args)
+        print(line)
+        with self.lock:
+            self.messages.append(line)
+
+    def place(self, request):
+        """submit one order
+        Returns:
+            (:obj:`dict`): order payload with 'request' and 'status' added
+        """
+        try:
+            if request.side == 'buy':
+                order = self.rh.place_immediate_market_order(
+                    request.instrument, request.symbol, self.time_in_force,
+                    request.quantity, request.side, request.price
+                )
+            else:
+                order = self.rh.place_immediate_market_order(
+                    request.instrument, request.symbol, self.time_in_force,
+                    request.quantity, request.side
+                )
+        except Exception as e:
+            # one failed submission must not lose track of the orders placed beside it
+            self.log(request.side, request.quantity, 'of', request.symbol, 'could not be placed:', str(e))
+            return {'request': request, 'status': 'failure'}
+        order['request'] = request
+        if 'url' in order:
+            order['status'] = 'unresolved'
+            self.log(request.side, request.quantity, 'of', request.symbol, 'placed')
+        else:
+            order['status'] = 'failure'
+            self.log(request.side, request.quantity, 'of', request.symbol, 'rejected:', order)
+        return order
+
+    def place_all(self, requests):
+        """submit several orders concurrently"""
+        return list(self.pool.map(self.place, requests))
+
+    def rebalance(self, sells, buys, cash=0.0):
+        """run sells and buys, releasing buys as proceeds come in
+        Args:
+            sells (list): `OrderRequest` sells, submitted together
+            buys (list): `OrderRequest` buys, released in this order
+            cash (float): cash already available for buys
+        Returns:
+            (bool): every order filled
+            (list): order payloads with their final 'status'
+        """
+        orders = self.place_all(sells)
+        outstanding = [order for order in orders if order['status'] == 'unresolved']
+        failed = len(outstanding) < len(orders)
+        pendingBuys = list(buys)
+
+        def release(force=False):
+            nonlocal cash
+            releasing = []
+            while pendingBuys and not failed:
+                cost = pendingBuys[0].quantity*pendingBuys[0].price
+                if cost > cash and not force:
+                    break
+                cash -= cost
+                releasing.append(pendingBuys.pop(0))
+            placed = self.place_all(releasing)
+            orders.extend(placed)
+            outstanding.extend(order for order in placed if order['status'] == 'unresolved')
+            return len(placed) < len(releasing) or any(order['status'] == 'failure' for order in placed)
+
+        failed = release() or failed
+        interval = self.initial_interval
+        start = time.time()
+        while outstanding or (pendingBuys and not failed):
+            if not outstanding:
+                # every sell filled, let the broker decide on any buy we couldn't cover
+                failed = release(force=True) or failed
+                continue
+            if time.time()-start > self.timeout:
+                self.expire(outstanding)
+                self.unplaced(pendingBuys)
+                return False, orders
+            time.sleep(interval)
+            resolved = self.poll(outstanding)
+            if not resolved:
+                interval = min(self.max_interval, interval*self.backoff)
+                continue
+            interval = self.initial_interval
+            for order in resolved:
+                outstanding.remove(order)
+                if order['status'] == 'failure':
+                    failed = True
+                elif order['request'].side == 'sell':
+                    cash += proceeds(order)
+            failed = release() or failed
+
+        # a failure stops the buys still held back, say which
+        self.unplaced(pendingBuys)
+        return (not failed) and all(order['status'] == 'success' for order in orders), orders
+
+    def poll(self, outstanding):
+        """fetch the status of every outstanding order in one round
+        Returns:
+            (list): orders that resolved this round
+        """
+        statuses = list(self.pool.map(self.status, outstanding))
+        resolved = []
+        for order, (status, detail) in zip(outstanding, statuses):
+            if status == 'unresolved':
+                continue
+            order['status'] = status
+            order['detail'] = detail
+            request = order['request']
+            self.log(request.side, request.quantity, 'of', request.symbol, status)
+            resolved.append(order)
+        if not resolved:
+            print('remaining unresolved orders, waiting')
+        return resolved
+
+    def status(self, order):
+        try:
+            return self.rh.order_status(order['url'])
+        except Exception as e:
+            # the order stays tracked, the next round asks again
+            print('order status error ', str(e))
+            return 'unresolved', None
+
+    def expire(self, outstanding):
+        """cancel the orders still open at the timeout and report them"""
+        self.log('timed out waiting on', len(outstanding), 'orders')
+        canceled = list(self.pool.map(self.cancel, outstanding))
+        for order, success in zip(outstanding, canceled):
+            request = order['request']
+            order['status'] = 'canceled' if success else 'unresolved'
+            self.log(request.side, request.quantity, 'of', request.symbol,
+                'canceled' if success else 'could not be canceled, still open')
+
+    def unplaced(self, requests):
+        for request in requests:
+            self.log(request.side, request.quantity, 'of', request.symbol, 'not placed')
+
+    def cancel(self, order):
+        try:
+            return self.rh.cancel_order(order.get('detail', order))
+        except Exception as e:
+            print('cancel error ', str(e))
+            return False
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+def proceeds(order):
+    """cash raised by a filled sell
+    Uses the fill's average price, or the request's price (a quote for
+    market sells) when the order detail doesn't carry one.
+    """
+    detail = order.get('detail', {})
+    request = order['request']
+    quantity = detail.get('cumulative_quantity') or detail.get('quantity') or request.quantity
+    price = detail.get('average_price') or request.price
+    try:
+        return float(quantity)*float(price)
+    except (TypeError, ValueError):
+        print('no price for the', request.symbol, 'sell, its proceeds are not counted')
+        return 0.0
@@ -0,0 +1,218 @@
+import heapq
+import math
+import threading
+from collections import Counter, deque
+
+class RollingMedian:
+    """median of the last `window` values with two heaps
+
+    The lower half is a max-heap and the upper half a min-heap. Values that
+    leave the window are only counted as deleted and dropped once they reach
+    the top of a heap, or on a rebuild once the heaps hold 4x the window, so
+    add is amortized O(log window) and median is O(1).
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self.low = []
+        self.high = []
+        self.lowSize = 0
+        self.highSize = 0
+        self.deleted = Counter()
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value):
+        if not self.low or value <= -self.low[0]:
+            heapq.heappush(self.low, -value)
+            self.lowSize += 1
+        else:
+            heapq.heappush(self.high, value)
+            self.highSize += 1
+        self.values.append(value)
+        if len(self.values) > self.window:
+            self._remove(self.values.popleft())
+        self._balance()
+        if len(self.low)+len(self.high) > 4*self.window:
+            self._rebuild()
+
+    def median(self):
+        if self.lowSize > self.highSize:
+            return -self.low[0]
+        return (-self.low[0]+self.high[0])/2
+
+    def _remove(self, value):
+        self.deleted[value] += 1
+        if value <= -self.low[0]:
+            self.lowSize -= 1
+            if value == -self.low[0]:
+                self._prune(self.low, -1)
+        else:
+            self.highSize -= 1
+            if value == self.high[0]:
+                self._prune(self.high, 1)
+
+    def _prune(self, heap, sign):
+        while heap and self.deleted[sign*heap[0]]:
+            value = sign*heapq.heappop(heap)
+            self.deleted[value] -= 1
+            if not self.deleted[value]:
+                del self.deleted[value]
+
+    def _rebuild(self):
+        # deleted values buried under the tops are only dropped here
+        ordered = sorted(self.values)
+        middle = (len(ordered)+1)//2
+        self.low = [-value for value in ordered[:middle]]
+        self.high = ordered[middle:]
+        heapq.heapify(self.low)
+        self.lowSize = len(self.low)
+        self.highSize = len(self.high)
+        self.deleted.clear()
+
+    def _balance(self):
+        # an add and an eviction on opposite sides can leave them two apart
+        while self.lowSize > self.highSize+1:
+            heapq.heappush(self.high, -heapq.heappop(self.low))
+            self.lowSize -= 1
+            self.highSize += 1
+            self._prune(self.low, -1)
+        while self.lowSize < self.highSize:
+            heapq.heappush(self.low, -heapq.heappop(self.high))
+            self.lowSize += 1
+            self.highSize -= 1
+            self._prune(self.high, 1)
+
+class RobustScore:
+    """streaming modified z-score of one series against its recent history
+
+    Same score as the notebook's `is_outlier` (Iglewicz and Hoaglin,
+    0.6745*|x-median|/MAD) but over a sliding window. The MAD is approximate:
+    each deviation is taken from the median at the time its value arrived.
+    When more than half the window sits on the median (MAD of 0, e.g. flat
+    prices) the mean absolute deviation is used instead.
+    """
+
+    def __init__(self, window):
+        self.median = RollingMedian(window)
+        self.deviations = RollingMedian(window)
+        self.absolute = deque(maxlen=window)
+        self.absoluteSum = 0.0
+
+    def __len__(self):
+        return len(self.median)
+
+    def score(self, value):
+        if not len(self.median):
+            return 0.0
+        deviation = abs(value-self.median.median())
+        mad = self.deviations.median()
+        if mad > 0:
+            return 0.6745*deviation/mad
+        meanDeviation = self.absoluteSum/len(self.absolute)
+        if meanDeviation > 0:
+            return deviation/(1.253314*meanDeviation)
+        return 0.0 if deviation == 0 else math.inf
+
+    def update(self, value):
+        deviation = abs(value-self.median.median()) if len(self.median) else 0.0
+        self.median.add(value)
+        self.deviations.add(deviation)
+        if len(self.absolute) == self.absolute.maxlen:
+            self.absoluteSum -= self.absolute[0]
+        self.absolute.append(deviation)
+        self.absoluteSum += deviation
+
+class OutlierFilter:
+    """flags percentageMove ticks whose moves are far outside recent ones
+
+    Keeps a `RobustScore` per field. Each tick is scored against the window
+    before it is added, so a bad quote can't hide itself, and is only added
+    with `add` once it has been saved. `seed` takes the last `window` ticks
+    once per process, so reading them belongs in a warm worker, not in
+    every forked job.
+    """
+
+    def __init__(self, fields=('spy', 'tlt', 'portfolio'), window=390, threshold=3.5, min_periods=30):
+        """
+        Args:
+            fields (tuple): percentageMove fields to score
+            window (int): ticks in the rolling window, 390 is one session of minutes
+            threshold (float): modified z-score above which a field is flagged
+            min_periods (int): ticks needed before anything is flagged
+        """
+        self.fields = fields
+        self.window = window
+        self.threshold = threshold
+        self.min_periods = min_periods
+        self.scores = {field: RobustScore(window) for field in fields}
+        self.seeded = False
+        self.lock = threading.Lock()
+
+    def seed(self, documents):
+        """warm up from the most recent ticks, only once
+        Args:
+            documents (list): percentageMove documents oldest first, e.g.
+                `TickStore.recent('percentageMove', window)`
+        """
+        with self.lock:
+            if self.seeded:
+                return
+            for document in documents[-self.window:]:
+                self._update(document)
+            self.seeded = True
+
+    def score(self, document):
+        """score a tick against the window without adding it
+        Args:
+            document (dict): percentageMove document
+        Returns:
+            (dict): field -> modified z-score, for fields above the threshold
+        """
+        with self.lock:
+            flagged = {}
+            for field, score in self.scores.items():
+                value = document.get(field)
+                if missing(value) or len(score) < self.min_periods:
+                    continue
+                z = score.score(value)
+                if z > self.threshold:
+                    flagged[field] = z
+            return flagged
+
+    def add(self, document):
+        """add a saved tick to the window"""
+        with self.lock:
+            self._update(document)
+
+    def flag(self, document):
+        """`score` then `add`, for replaying history"""
+        flagged = self.score(document)
+        self.add(document)
+        return flagged
+
+    def _update(self, document):
+        for field, score in self.scores.items():
+            value = document.get(field)
+            if not missing(value):
+                score.update(value)
+
+def missing(value):
+    # NaN would break the heap ordering
+    return value is None or value != value
+
+def flag_frame(frame, **options):
+    """replay a DataFrame through an `OutlierFilter`, e.g. for history written before flagging
+    Returns:
+        (:obj:`ndarray`) True for rows with any flagged field
+    """
+    import numpy as np
+
+    outlierFilter = OutlierFilter(**options)
+    fields = [field for field in outlierFilter.fields if field in frame]
+    flags = np.zeros(len(frame), dtype=bool)
+    for row, values in enumerate(frame[fields].itertuples(index=False)):
+        flags[row] = bool(outlierFilter.flag(dict(zip(fields, values))))
+    return flags
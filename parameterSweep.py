@@ -0,0 +1,175 @@
+import argparse
+import csv
+import itertools
+import math
+import multiprocessing
+import os
+import time
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+from pymongo import MongoClient
+
+import backtest
+
+# columns of the results table, in order
+result_fields = (
+    'rank', 'window', 'interval', 'steepness', 'center', 'threshold',
+    'sharpe', 'totalReturn', 'maxDrawdown', 'meanLoss', 'rebalances', 'trades', 'costs'
+)
+
+def share(bars):
+    """copy bars into shared memory once, for the pool's workers to map
+    Note:
+        RawArray rather than multiprocessing.shared_memory, which needs Python 3.8
+    Returns:
+        (tuple): handles for `attach`, passed to the pool initializer
+    """
+    times = RawArray('q', len(bars.times))
+    values = RawArray('d', bars.values.size)
+    np.frombuffer(times, dtype=np.int64)[:] = bars.times.astype('datetime64[s]').astype(np.int64)
+    np.frombuffer(values, dtype=np.float64)[:] = bars.values.ravel()
+    return times, values, bars.values.shape, bars.symbols
+
+def attach(shared):
+    """`backtest.Bars` viewing the shared arrays, nothing is copied"""
+    times, values, shape, symbols = shared
+    return backtest.Bars(
+        np.frombuffer(times, dtype=np.int64).view('datetime64[s]'),
+        symbols,
+        np.frombuffer(values, dtype=np.float64).reshape(shape)
+    )
+
+def grid(windows, intervals, steepnesses, centers, thresholds):
+    """every combination as `evaluate` points, ordered so runs sharing weights are adjacent
+    Args:
+        windows (list): lookbacks as `numpy.timedelta64`
+        intervals (list): bar lengths as `numpy.timedelta64`
+        steepnesses (list): sigmoid steepness, None for the raw allocation
+        centers (list): sigmoid midpoints, ignored when the steepness is None
+        thresholds (list): rebalance thresholds as `allocationLoss`
+    """
+    points = []
+    for interval, window, steepness in itertools.product(intervals, windows, steepnesses):
+        for center in (centers if steepness is not None else [.5]):
+            for threshold in thresholds:
+                points.append({
+                    'interval': interval,
+                    'window': window,
+                    'steepness': steepness,
+                    'center': center,
+                    'threshold': threshold
+                })
+    return points
+
+# per worker state, the shared bars plus the last resampled bars and weights
+workerBars = None
+workerBroker = {}
+workerCache = {}
+
+def initWorker(shared, brokerOptions):
+    global workerBars, workerBroker
+    workerBars = attach(shared)
+    workerBroker = brokerOptions
+    workerCache.clear()
+
+def cached(key, compute):
+    # one entry per kind, consecutive points mostly share it
+    if workerCache.get(key[0], (None,))[0] != key:
+        workerCache[key[0]] = (key, compute())
+    return workerCache[key[0]][1]
+
+def evaluate(point):
+    """backtest one grid point in a worker, returns a results row"""
+    interval = point['interval']
+    bars = cached(('bars', interval), lambda: backtest.resample(workerBars, interval))
+    weights = cached(
+        ('weights', interval, point['window'], point['steepness'], point['center']),
+        lambda: backtest.targetWeights(bars, point['window'], point['steepness'], point['center'])
+    )
+    result = backtest.run(
+        bars,
+        weights=weights,
+        threshold=point['threshold'],
+        broker=backtest.SimulatedBroker(**workerBroker)
+    )
+    row = dict(point)
+    row.update(backtest.summary(result))
+    return row
+
+def sweep(bars, points, brokerOptions={}, processes=None, chunksize=None):
+    """evaluate every grid point on a process pool sharing one copy of the bars
+    Args:
+        bars (:obj:`backtest.Bars`): base bars, usually 5minute
+        points (list): from `grid`
+        brokerOptions (dict): `backtest.SimulatedBroker` arguments for every run
+        processes (int): pool size, the cpu count if None
+        chunksize (int): points per task, contiguous so workers reuse their cache
+    Returns:
+        (list): result rows ranked by Sharpe, best first
+    """
+    processes = processes or multiprocessing.cpu_count()
+    if chunksize is None:
+        chunksize = max(1, int(math.ceil(len(points)/(processes*4))))
+    with multiprocessing.Pool(processes, initWorker, (share(bars), brokerOptions)) as pool:
+        rows = pool.map(evaluate, points, chunksize)
+    return rank(rows)
+
+def rank(rows):
+    rows = sorted(rows, key=lambda row: -row['sharpe'] if not math.isnan(row['sharpe']) else math.inf)
+    for position, row in enumerate(rows):
+        row['rank'] = position+1
+    return rows
+
+def writeResults(path, rows):
+    """results table as CSV, lookbacks in days and intervals in minutes"""
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, result_fields)
+        writer.writeheader()
+        for row in rows:
+            row = dict(row)
+            row['window'] = row['window']/np.timedelta64(1, 'D')
+            row['interval'] = row['interval']/np.timedelta64(1, 'm')
+            writer.writerow(row)
+
+def floats(text):
+    return [None if value == 'none' else float(value) for value in text.split(',')]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='backtest a grid of allocation parameters')
+    parser.add_argument('--bars', default=None, help='.npz from backtest.saveBars, the bars collection if omitted')
+    parser.add_argument('--windows', default='3,7,14', help='lookback days')
+    parser.add_argument('--intervals', default='5,15,60', help='bar minutes, multiples of 5')
+    parser.add_argument('--steepnesses', default='none,10,20,40', help="sigmoid steepness, 'none' for the raw allocation")
+    parser.add_argument('--centers', default='.4,.5,.6')
+    parser.add_argument('--thresholds', default='0,.02,.05')
+    parser.add_argument('--spread', type=float, default=0.0002)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--output', default='sweepResults.csv')
+    args = parser.parse_args()
+
+    if args.bars:
+        bars = backtest.loadBarsFile(args.bars)
+    else:
+        try:
+            import config
+            print('using local config file')
+            mongodb_uri = config.mongodb_uri
+        except:
+            print('using environment variable')
+            mongodb_uri = os.getenv('MONGODB_URI')
+        bars = backtest.loadBars(MongoClient(mongodb_uri).get_database().bars)
+
+    points = grid(
+        [np.timedelta64(int(days*24*60), 'm') for days in floats(args.windows)],
+        [np.timedelta64(int(minutes), 'm') for minutes in floats(args.intervals)],
+        floats(args.steepnesses),
+        floats(args.centers),
+        floats(args.thresholds)
+    )
+    start = time.time()
+    rows = sweep(bars, points, {'spread': args.spread}, args.processes)
+    print(len(rows), 'points in', time.time()-start, 'seconds')
+    writeResults(args.output, rows)
+    for row in rows[:10]:
+        print(row['rank'], row['sharpe'], {field: row[field] for field in ('window', 'interval', 'steepness', 'center', 'threshold')})
@@ -0,0 +1,143 @@
+import numpy as np
+
+# Vectorized versions of the Sharpe/information ratio analysis in
+# performanceAnalysis.ipynb. Every function takes a (periods x series) matrix
+# so all series are computed at once. The rolling versions take differences
+# of cumulative sums, so a window costs O(1) per row whatever its length.
+
+year = np.timedelta64(365, 'D')
+
+def periodsPerYear(timestamps):
+    """observations per year implied by a `datetime64` index"""
+    timestamps = np.asarray(timestamps, dtype='datetime64[ms]')
+    elapsed = (timestamps[-1]-timestamps[0])/year
+    return (len(timestamps)-1)/elapsed
+
+def excessReturns(returns, benchmark):
+    """returns minus a benchmark column, e.g. the 90 day treasury or spy
+    Args:
+        returns (:obj:`ndarray`): (periods x series) returns
+        benchmark (:obj:`ndarray`): (periods,) benchmark returns
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    return returns-np.asarray(benchmark, dtype=np.float64).reshape(-1, 1)
+
+def sharpe(excess, annualization=1.0):
+    """mean/std of excess returns per series, scaled by sqrt(annualization)
+    Note:
+        std uses ddof=1 to match pandas
+    Args:
+        excess (:obj:`ndarray`): (periods x series) excess returns
+        annualization (float): periods per year for an annual ratio
+    """
+    excess = np.asarray(excess, dtype=np.float64)
+    return np.sqrt(annualization)*excess.mean(axis=0)/excess.std(axis=0, ddof=1)
+
+def informationRatio(portfolio, benchmarks, annualization=1.0):
+    """Sharpe of the portfolio's return over each benchmark
+    Args:
+        portfolio (:obj:`ndarray`): (periods,) portfolio returns
+        benchmarks (:obj:`ndarray`): (periods x series) benchmark returns
+    """
+    active = np.asarray(portfolio, dtype=np.float64).reshape(-1, 1)-np.asarray(benchmarks, dtype=np.float64)
+    return sharpe(active, annualization)
+
+def cumulativeReturns(returns):
+    """compounded return since the first period, per series"""
+    return np.cumprod(1+np.asarray(returns, dtype=np.float64), axis=0)-1
+
+def drawdown(returns):
+    """fractional drop from the running peak of compounded wealth, per series"""
+    wealth = np.cumprod(1+np.asarray(returns, dtype=np.float64), axis=0)
+    return wealth/np.maximum.accumulate(wealth, axis=0)-1
+
+def maxDrawdown(returns):
+    return drawdown(returns).min(axis=0)
+
+def windowStarts(length, window=None, timestamps=None, span=None):
+    """first row of the trailing window ending at each row
+    Args:
+        length (int): number of rows
+        window (int): fixed number of rows per window
+        timestamps (:obj:`ndarray`): `datetime64` row times, for time windows
+        span (:obj:`numpy.timedelta64`): time window, e.g. np.timedelta64(1, 'D')
+    """
+    if span is not None:
+        timestamps = np.asarray(timestamps)
+        return np.searchsorted(timestamps, timestamps-span, side='right')
+    return np.maximum(np.arange(length)-window+1, 0)
+
+def rollingMeanStd(values, starts, ddof=1):
+    """mean and std over [starts[i], i] for every row, by cumulative sums
+    Args:
+        values (:obj:`ndarray`): (periods x series)
+        starts (:obj:`ndarray`): from `windowStarts`
+        ddof (int): 1 for the sample std, 0 for the population std
+    Returns:
+        (:obj:`ndarray`) means, (:obj:`ndarray`) stds, NaN where a window has <= ddof rows
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+    # centering first keeps the sum of squares from cancelling badly
+    centered = values-values.mean(axis=0)
+    zeros = np.zeros((1, values.shape[1]))
+    sums = np.concatenate([zeros, np.cumsum(centered, axis=0)])
+    squares = np.concatenate([zeros, np.cumsum(centered**2, axis=0)])
+    ends = np.arange(1, len(values)+1)
+    counts = (ends-starts).reshape(-1, 1).astype(np.float64)
+    windowSums = sums[ends]-sums[starts]
+    windowSquares = squares[ends]-squares[starts]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = windowSums/counts
+        variances = (windowSquares-windowSums*means)/(counts-ddof)
+        stds = np.sqrt(np.maximum(variances, 0))
+    stds[counts[:, 0] <= ddof] = np.nan
+    return means+values.mean(axis=0), stds
+
+def rollingSharpe(excess, starts, annualization=1.0):
+    """`sharpe` over the trailing window ending at every row"""
+    means, stds = rollingMeanStd(excess, starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.sqrt(annualization)*means/stds
+
+def rollingInformationRatio(portfolio, benchmarks, starts, annualization=1.0):
+    """`informationRatio` over the trailing window ending at every row"""
+    active = np.asarray(portfolio, dtype=np.float64).reshape(-1, 1)-np.asarray(benchmarks, dtype=np.float64)
+    return rollingSharpe(active, starts, annualization)
+
+def rollingCumulativeReturns(returns, starts):
+    """compounded return over the trailing window ending at every row"""
+    logs = np.log1p(np.asarray(returns, dtype=np.float64))
+    if logs.ndim == 1:
+        logs = logs.reshape(-1, 1)
+    sums = np.concatenate([np.zeros((1, logs.shape[1])), np.cumsum(logs, axis=0)])
+    ends = np.arange(1, len(logs)+1)
+    return np.expm1(sums[ends]-sums[starts])
+
+def summary(frame, riskFree='90dayTreasury', portfolio='portfolio', annualization=None):
+    """Sharpe of every series and information ratio of the portfolio against every other
+    Args:
+        frame (:obj:`pandas.DataFrame`): percentageMove rows indexed by timestamp
+        riskFree (str): risk free column
+        portfolio (str): portfolio column
+        annualization (float): defaults to `periodsPerYear` of the index
+    Returns:
+        (:obj:`pandas.DataFrame`) 'sharpe', 'information' and 'maxDrawdown' per series
+    """
+    import pandas as pd
+
+    if annualization is None:
+        annualization = periodsPerYear(frame.index.values)
+    series = [column for column in frame.columns if column != riskFree]
+    returns = frame[series].values
+    benchmarks = [column for column in series if column != portfolio]
+    information = np.full(len(series), np.nan)
+    information[[series.index(column) for column in benchmarks]] = informationRatio(
+        frame[portfolio].values, frame[benchmarks].values, annualization
+    )
+    return pd.DataFrame({
+        'sharpe': sharpe(excessReturns(returns, frame[riskFree].values), annualization),
+        'information': information,
+        'maxDrawdown': maxDrawdown(returns)
+    }, index=series)
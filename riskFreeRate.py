@@ -0,0 +1,194 @@
+import datetime
+import os
+import sys
+
+import numpy as np
+import quandl
+from pymongo import ASCENDING, DESCENDING, MongoClient, UpdateOne
+from redis.exceptions import RedisError
+
+import jsonTime
+
+class RiskFreeRate:
+    """the 90 day treasury bill rate, fetched from Quandl at most a few times a day
+
+    The series only changes once per business day, so `current` serves the
+    cached rate and `refresh` runs as its own job, scheduled by clock.py
+    every few hours, rather than on a thread a forked job would kill. A rate
+    older than `max_age` is still served but logged. Only a cold cache, or
+    one older than `max_stale`, waits for Quandl inside a tick. The cache is
+    checked in Redis (shared by every worker), then memory, then the Mongo
+    table, which also keeps every daily rate for `rate_at`.
+    """
+
+    def __init__(self, api_key=None, dataset='USTREASURY/BILLRATES.3', max_age=6*60*60, max_stale=4*24*60*60):
+        """
+        Args:
+            api_key (str): Quandl API key
+            dataset (str): Quandl code, the value is the first column after the date
+            max_age (float): seconds before a cached rate is logged as overdue for a refresh
+            max_stale (float): seconds before a cached rate is no longer served
+        """
+        self.api_key = api_key
+        self.dataset = dataset
+        self.max_age = max_age
+        self.max_stale = max_stale
+        self.collection = None
+        self.redis = None
+        self.redisKey = None
+        self.latest = None
+        self.table = None
+
+    def use_collection(self, collection):
+        """keep fetched rates in a Mongo table, one document per date
+        Note:
+            the index is made once by `create_indexes`, not per job
+        Args:
+            collection (:obj:`pymongo.collection.Collection`): e.g. db.riskFree
+        """
+        self.collection = collection
+
+    @staticmethod
+    def create_indexes(collection):
+        """unique date index"""
+        collection.create_index([('date', ASCENDING)], unique=True)
+
+    def use_redis(self, conn, key='resiliant-trader:riskFree'):
+        """share the latest rate between workers
+        Args:
+            conn (:obj:`redis.Redis`): connection, e.g. `worker.conn`
+            key (str): key holding the latest rate
+        """
+        self.redis = conn
+        self.redisKey = key
+
+    def current(self):
+        """latest annualized rate in percent, see the class notes for when Quandl is called
+        Returns:
+            (float): rate
+        Raises:
+            (:obj:`Exception`) the Quandl error if nothing usable is cached
+        """
+        cached = self.cached()
+        age = None if cached is None else (datetime.datetime.utcnow()-cached['fetched']).total_seconds()
+        if cached is None or age > self.max_stale:
+            try:
+                return self.refresh()['rate']
+            except Exception as e:
+                if cached is None:
+                    raise
+                print('risk free refresh error, using rate from ', cached['date'], str(e))
+                return cached['rate']
+        if age > self.max_age:
+            print('risk free rate from ', cached['date'], 'is', age, 'seconds old, is the refresh job scheduled?')
+        return cached['rate']
+
+    def cached(self):
+        """latest {'rate', 'date', 'fetched'} from Redis, memory or Mongo, None when cold"""
+        if self.redis is not None:
+            try:
+                serialized = self.redis.get(self.redisKey)
+                if serialized is not None:
+                    entry = deserialize(serialized)
+                    if self.latest is None or entry['fetched'] > self.latest['fetched']:
+                        self.latest = entry
+            except RedisError as e:
+                print('redis risk free error ', str(e))
+        if self.latest is None and self.collection is not None:
+            document = self.collection.find_one({'fetched': {'$exists': True}}, sort=[('fetched', DESCENDING)])
+            if document is not None:
+                self.latest = {'rate': document['rate'], 'date': document['date'], 'fetched': document['fetched']}
+        return self.latest
+
+    def refresh(self):
+        """fetch the latest rate from Quandl and store it in every cache
+        Returns:
+            (dict): {'rate', 'date', 'fetched'}
+        """
+        rows = self.fetch(rows=1)
+        date, rate = rows[-1]
+        entry = {'rate': rate, 'date': date, 'fetched': datetime.datetime.utcnow()}
+        self.latest = entry
+        if self.redis is not None:
+            try:
+                self.redis.set(self.redisKey, serialize(entry))
+            except RedisError as e:
+                print('redis risk free error ', str(e))
+        if self.collection is not None:
+            self.collection.update_one({'date': date}, {'$set': {'rate': rate, 'fetched': entry['fetched']}}, upsert=True)
+        return entry
+
+    def fetch(self, **options):
+        """(date, rate) rows from Quandl, oldest first"""
+        quandl.ApiConfig.api_key = self.api_key
+        rows = quandl.get(self.dataset, returns='numpy', **options)
+        return sorted((day(row[0]), float(row[1])) for row in rows)
+
+    def load_history(self, start_date=None):
+        """copy the dataset's history into the Mongo table, for `rate_at`
+        Args:
+            start_date (str): first date to load, e.g. '2017-01-01', all if None
+        Returns:
+            (int): rows written
+        """
+        rows = self.fetch(start_date=start_date) if start_date else self.fetch()
+        if rows:
+            self.collection.bulk_write([
+                UpdateOne({'date': date}, {'$set': {'rate': rate}}, upsert=True)
+                for date, rate in rows
+            ], ordered=False)
+        self.table = None
+        return len(rows)
+
+    def rate_at(self, timestamps):
+        """rate in force at each timestamp, from the Mongo table without any network calls
+        Args:
+            timestamps (:obj:`ndarray`): `datetime64` times, or a list of datetimes
+        Returns:
+            (:obj:`ndarray`) rate of the latest date at or before each timestamp, NaN before the first
+        """
+        if self.table is None:
+            documents = list(self.collection.find(projection={'_id': False, 'date': True, 'rate': True}, sort=[('date', ASCENDING)]))
+            self.table = (
+                np.array([document['date'] for document in documents], dtype='datetime64[D]'),
+                np.array([document['rate'] for document in documents], dtype=np.float64)
+            )
+        dates, rates = self.table
+        timestamps = np.asarray(timestamps, dtype='datetime64[D]')
+        if not len(rates):
+            return np.full(timestamps.shape, np.nan)
+        index = np.searchsorted(dates, timestamps, side='right')-1
+        return np.where(index >= 0, rates[np.maximum(index, 0)], np.nan)
+
+def day(value):
+    """midnight datetime for a numpy, pandas or python date"""
+    if not isinstance(value, datetime.date):
+        value = np.datetime64(value, 'D').astype(datetime.date)
+    return datetime.datetime(value.year, value.month, value.day)
+
+def serialize(entry):
+    # the date stays a plain YYYY-MM-DD string, as already cached in Redis
+    return jsonTime.serialize(dict(entry, date=entry['date'].strftime('%Y-%m-%d')), ('fetched',))
+
+def deserialize(serialized):
+    data = jsonTime.deserialize(serialized, ('fetched',))
+    data['date'] = datetime.datetime.strptime(data['date'], '%Y-%m-%d')
+    return data
+
+if __name__ == '__main__':
+    # python riskFreeRate.py [start date], loads the rate history into the riskFree collection
+    try:
+        import config
+        print('using local config file')
+        mongodb_uri = config.mongodb_uri
+        quandl_key = config.quandl_key
+    except:
+        print('using environment variable')
+        mongodb_uri = os.getenv('MONGODB_URI')
+        quandl_key = os.getenv('QUANDL_KEY')
+
+    rates = RiskFreeRate(quandl_key)
+    collection = MongoClient(mongodb_uri).get_database().riskFree
+    RiskFreeRate.create_indexes(collection)
+    rates.use_collection(collection)
+    print('rates loaded:', rates.load_history(sys.argv[1] if len(sys.argv) > 1 else None))
@@ -4,11 +4,365 @@
 ##############################
 
 import getpass
+import json
+import os
+import random
+import threading
+import time
 import requests
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import numpy as np
 
+Quote = namedtuple('Quote', ['symbol', 'bid_price', 'ask_price', 'mid_price'])
+
+api_url = 'https://api.robinhood.com/'
+
+def rebase_endpoints(endpoints, base_url):
+    """the endpoint table pointed at another server, e.g. `fakeRobinhood`
+    Args:
+        endpoints (dict): endpoint name -> url under `api_url`
+        base_url (str): replacement for `api_url`, with a trailing slash
+    Returns:
+        (dict): endpoint name -> url under `base_url`
+    """
+    return {name: base_url+url[len(api_url):] for name, url in endpoints.items()}
+
+historical_fields = ('open_price', 'low_price', 'high_price', 'close_price', 'volume')
+
+def parse_historicals(rawHistoricals, dtype=np.float64):
+    """convert `historicals` bars to arrays in one pass
+    Args:
+        rawHistoricals (list): bar dicts from the `historicals` endpoint
+        dtype (:obj:`numpy.dtype`): float type of the returned matrix
+    Returns:
+        (:obj:`ndarray`) `datetime64[s]` bar start times
+        (:obj:`ndarray`) columns: open_price, low_price, high_price, close_price, mean_price, volume
+    """
+    numpyHistoricals = np.empty((len(rawHistoricals), 6), dtype=dtype)
+    if len(rawHistoricals) == 0:
+        return np.empty(0, dtype='datetime64[s]'), numpyHistoricals
+
+    # numpy parses the decimal strings itself, no per-field float() calls
+    fields = np.array(
+        [[bar[field] for field in historical_fields] for bar in rawHistoricals],
+        dtype=dtype
+    )
+    numpyHistoricals[:, 0:4] = fields[:, 0:4]
+    numpyHistoricals[:, 4] = fields[:, 0:4].sum(axis=1)/4
+    numpyHistoricals[:, 5] = fields[:, 4]
+
+    # drop the trailing 'Z', numpy warns on timezone suffixes
+    barTimes = np.array([bar['begins_at'][:19] for bar in rawHistoricals], dtype='datetime64[s]')
+
+    return barTimes, numpyHistoricals
+
+# shared by `Transport` and `asyncRobinhood.AsyncRobinhood`
+retry_statuses = frozenset([429, 500, 502, 503, 504])
+
+def endpoint_name(names, url):
+    """label a url with the longest matching entry in `names`"""
+    best = None
+    for name, prefix in names.items():
+        if url.startswith(prefix) and (best is None or len(prefix) > len(names[best])):
+            best = name
+    return best or 'other'
+
+def backoff_delay(attempt, backoff, max_backoff):
+    # full jitter keeps workers retrying on the same minute from lining up
+    return random.uniform(0, min(max_backoff, backoff*(2**attempt)))
+
+def record_latency(latency, lock, name, start, retries, error=False):
+    """add one request to the per-endpoint counters in `latency`, under `lock`"""
+    elapsed = time.time() - start
+    with lock:
+        stats = latency.setdefault(name, {
+            'count': 0,
+            'errors': 0,
+            'retries': 0,
+            'total': 0.0,
+            'max': 0.0
+        })
+        stats['count'] += 1
+        stats['retries'] += retries
+        stats['total'] += elapsed
+        stats['max'] = max(stats['max'], elapsed)
+        if error:
+            stats['errors'] += 1
+
+def summarize_latency(latency, lock):
+    """per-endpoint request counters
+    Returns:
+        (dict): endpoint name -> count, errors, retries, total, max and
+        mean seconds (retries and backoff included)
+    """
+    with lock:
+        stats = {name: dict(counters) for name, counters in latency.items()}
+    for counters in stats.values():
+        counters['mean'] = counters['total']/counters['count']
+    return stats
+
+class Transport:
+    """pooled keep-alive session with timeouts, retries and latency counters
+
+    Exposes the `get`/`post`/`headers` surface of `requests.Session` so it can
+    stand in for one. GETs are retried on connection errors, timeouts, 5xx and
+    429. POSTs are only retried on 429 and connect timeouts, since those never
+    reach the order/login handlers and cannot be applied twice. A 401 calls
+    `reauthenticate`, when set, and the request is sent once more if it
+    returns True (a rejected token means the request was never applied).
+    """
+    retry_statuses = retry_statuses
+
+    def __init__(
+            self,
+            pool_size=10,
+            connect_timeout=3.05,
+            read_timeout=10.0,
+            max_retries=3,
+            backoff=0.25,
+            max_backoff=5.0,
+            names=None
+        ):
+        """
+        Args:
+            pool_size (int): keep-alive connections kept per host
+            connect_timeout (float): seconds to wait for the TCP/TLS handshake
+            read_timeout (float): seconds to wait between bytes of the response
+            max_retries (int): extra attempts after the first one
+            backoff (float): base of the exponential backoff, in seconds
+            max_backoff (float): cap on a single backoff sleep, in seconds
+            names (dict): endpoint name -> url prefix, used to label latency
+        """
+        self.session = requests.session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.names = names or {}
+        self.latency = {}
+        # requests run concurrently from the executor and prefetch threads
+        self.latencyLock = threading.Lock()
+        self.reauthenticate = None
+
+    @property
+    def headers(self):
+        return self.session.headers
+
+    @headers.setter
+    def headers(self, headers):
+        self.session.headers = headers
+
+    def endpoint_name(self, url):
+        return endpoint_name(self.names, url)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """send through the pooled session, retrying with jittered backoff
+        Returns:
+            (:obj:`requests.Response`) last response received
+        Raises:
+            (:obj:`requests.exceptions.RequestException`) if every attempt
+            failed without a response
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        idempotent = method == 'GET'
+        name = self.endpoint_name(url)
+        attempt = 0
+        reauthenticated = False
+        start = time.time()
+        while True:
+            try:
+                res = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                retryable = idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+                if not retryable or attempt >= self.max_retries:
+                    self._record(name, start, attempt, error=True)
+                    raise
+            else:
+                if res.status_code == 401 and self.reauthenticate is not None and not reauthenticated:
+                    reauthenticated = True
+                    if self.reauthenticate():
+                        res.close()
+                        continue
+                retryable = res.status_code == 429 or (idempotent and res.status_code in self.retry_statuses)
+                if not retryable or attempt >= self.max_retries:
+                    self._record(name, start, attempt, error=res.status_code >= 400)
+                    return res
+                res.close()
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def _backoff(self, attempt):
+        return backoff_delay(attempt, self.backoff, self.max_backoff)
+
+    def _record(self, name, start, retries, error=False):
+        record_latency(self.latency, self.latencyLock, name, start, retries, error)
+
+    def latency_stats(self):
+        """per-endpoint request counters, see `summarize_latency`"""
+        return summarize_latency(self.latency, self.latencyLock)
+
+class InstrumentCache:
+    """bidirectional symbol <-> instrument url cache
+
+    Holds an in-process LRU of at most `maxsize` instruments. Entries older
+    than `ttl` seconds are treated as misses and refetched. Entries can be
+    persisted to a Mongo collection (`use_collection`), read one at a time
+    on a memory miss, and/or a local JSON file (`path`), loaded up front.
+    Both are written through on refresh.
+    """
+
+    def __init__(self, maxsize=256, ttl=7*24*60*60, path=None):
+        """
+        Args:
+            maxsize (int): instruments kept in memory
+            ttl (float): seconds before an entry is refetched
+            path (str): optional JSON file to load from and persist to
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.collection = None
+        self.by_symbol = OrderedDict()
+        self.by_url = {}
+        self.lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                for entry in json.load(f):
+                    self._put(entry)
+
+    def use_collection(self, collection):
+        """read misses from and write through to a Mongo collection
+        Note:
+            cheap enough to call per job with the job's client, indexes
+            come from `create_indexes`
+        Args:
+            collection (:obj:`pymongo.collection.Collection`): instrument store
+        """
+        self.collection = collection
+
+    @staticmethod
+    def create_indexes(collection):
+        collection.create_index('symbol', unique=True)
+        collection.create_index('url')
+
+    def symbol(self, url):
+        """cached ticker for an instrument url, None on miss or expiry"""
+        with self.lock:
+            entry = self.by_url.get(url)
+            if self._fresh(entry):
+                return entry['symbol']
+        entry = self._load({'url': url})
+        return entry['symbol'] if entry is not None else None
+
+    def url(self, symbol):
+        """cached instrument url for a ticker, None on miss or expiry"""
+        with self.lock:
+            entry = self.by_symbol.get(symbol.upper())
+            if self._fresh(entry):
+                return entry['url']
+        entry = self._load({'symbol': symbol.upper()})
+        return entry['url'] if entry is not None else None
+
+    def store(self, symbol, url):
+        """record a fetched instrument and persist it"""
+        entry = {'symbol': symbol.upper(), 'url': url, 'fetched': time.time()}
+        self._put(entry)
+        if self.collection is not None:
+            self.collection.replace_one({'symbol': entry['symbol']}, entry, upsert=True)
+        if self.path is not None:
+            self.save()
+
+    def save(self):
+        """write every in-memory entry to `path`"""
+        with self.lock:
+            entries = list(self.by_symbol.values())
+        tmpPath = self.path + '.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmpPath, self.path)
+
+    def clear(self):
+        with self.lock:
+            self.by_symbol.clear()
+            self.by_url.clear()
+
+    def _fresh(self, entry):
+        if entry is None:
+            return False
+        if time.time() - entry['fetched'] > self.ttl:
+            return False
+        self.by_symbol.move_to_end(entry['symbol'])
+        return True
+
+    def _load(self, query):
+        # one stored instrument into memory, a failed read is just a miss
+        if self.collection is None:
+            return None
+        try:
+            entry = self.collection.find_one(query, projection={'_id': False})
+        except Exception as e:
+            print('instrument cache read error ', str(e))
+            return None
+        if entry is None or time.time() - entry['fetched'] > self.ttl:
+            return None
+        self._put(entry)
+        return entry
+
+    def _put(self, entry):
+        with self.lock:
+            stale = self.by_symbol.pop(entry['symbol'], None)
+            if stale is not None:
+                self.by_url.pop(stale['url'], None)
+            self.by_symbol[entry['symbol']] = entry
+            self.by_url[entry['url']] = entry
+            while len(self.by_symbol) > self.maxsize:
+                _, evicted = self.by_symbol.popitem(last=False)
+                self.by_url.pop(evicted['url'], None)
+
+class AccountSnapshot:
+    """account, portfolio and nonzero positions fetched together
+
+    Taken once per run and handed to the order and tracking code so they
+    don't each re-fetch `accounts`/`portfolios`. Call
+    `Robinhood.account_snapshot(refresh=True)` after trades that change it.
+    """
+
+    def __init__(self, account, portfolio, positions):
+        self.account = account
+        self.portfolio = portfolio
+        self.positions = positions
+        self.fetched = time.time()
+
+    @property
+    def account_url(self):
+        return self.account['url']
+
+    @property
+    def equity(self):
+        return float(self.portfolio['equity'])
+
+    @property
+    def adjusted_equity_previous_close(self):
+        return float(self.portfolio['adjusted_equity_previous_close'])
+
+# shared by every client in the process so warm workers skip the lookups
+instrument_cache = InstrumentCache()
+
 class Robinhood:
     """wrapper class for fetching/parsing Robinhood endpoints"""
     endpoints = {
@@ -39,6 +393,16 @@ class Robinhood:
         "fundamentals": "https://api.robinhood.com/fundamentals/",
     }
 
+    default_headers = {
+        "Accept": "*/*",
+        "Accept-Encoding": "gzip, deflate",
+        "Accept-Language": "en;q=1, fr;q=0.9, de;q=0.8, ja;q=0.7, nl;q=0.6, it;q=0.5",
+        "Content-Type": "application/x-www-form-urlencoded; charset=utf-8",
+        "X-Robinhood-API-Version": "1.0.0",
+        "Connection": "keep-alive",
+        "User-Agent": "Robinhood/823 (iPhone; iOS 7.1.2; Scale/2.00)"
+    }
+
     session = None
 
     username = None
@@ -53,17 +417,24 @@ class Robinhood:
     #Logging in and initializing
     ##############################
 
-    def __init__(self):
-        self.session = requests.session()
-        self.headers = {
-            "Accept": "*/*",
-            "Accept-Encoding": "gzip, deflate",
-            "Accept-Language": "en;q=1, fr;q=0.9, de;q=0.8, ja;q=0.7, nl;q=0.6, it;q=0.5",
-            "Content-Type": "application/x-www-form-urlencoded; charset=utf-8",
-            "X-Robinhood-API-Version": "1.0.0",
-            "Connection": "keep-alive",
-            "User-Agent": "Robinhood/823 (iPhone; iOS 7.1.2; Scale/2.00)"
-        }
+    def __init__(self, instrument_cache=instrument_cache, base_url=None, **transport_options):
+        """
+        Args:
+            instrument_cache (:obj:`InstrumentCache`): symbol/url cache,
+                defaults to the process-wide one
+            base_url (str): API root to use instead of api.robinhood.com,
+                defaults to the ROBINHOOD_API_URL environment variable
+            **transport_options: forwarded to `Transport` (pool_size,
+                connect_timeout, read_timeout, max_retries, backoff, ...)
+        """
+        self.instrument_cache = instrument_cache
+        self.snapshot = None
+        base_url = base_url or os.getenv('ROBINHOOD_API_URL')
+        if base_url:
+            self.endpoints = rebase_endpoints(self.endpoints, base_url)
+        transport_options.setdefault('names', self.endpoints)
+        self.session = Transport(**transport_options)
+        self.headers = dict(self.default_headers)
         self.session.headers = self.headers
 
     def login_prompt(self): #pragma: no cover
@@ -109,12 +480,16 @@ class Robinhood:
             raise RH_exception.TwoFactorRequired()  #requires a second call to enable 2FA
 
         if 'token' in data.keys():
-            self.auth_token = data['token']
-            self.headers['Authorization'] = 'Token ' + self.auth_token
+            self.use_token(data['token'])
             return True
 
         return False
 
+    def use_token(self, auth_token):
+        """authenticate with a token from an earlier login, see `tokenStore`"""
+        self.auth_token = auth_token
+        self.headers['Authorization'] = 'Token ' + auth_token
+
     def logout(self):
         """logout from Robinhood
         Returns:
@@ -139,31 +514,55 @@ class Robinhood:
     ##############################
     #GET DATA
     ##############################
+    def market_hours(self, date=None):
+        """trading hours of a day, combined over every market
+        Note:
+            open only if every market is open, from the latest open to the
+            earliest close, the same rule `marketOpenCheck` applies
+        Args:
+            date (:obj:`datetime.date`): day to fetch, today if None
+        Returns:
+            (dict): 'date', 'is_open', 'opens_at' and 'closes_at', the times
+            as naive UTC datetimes or None when closed
+        """
+        markets = self.get_url(self.endpoints['markets'])['results']
+        day = date or datetime.utcnow().date()
+        hours = {'date': datetime(day.year, day.month, day.day), 'is_open': True, 'opens_at': None, 'closes_at': None}
+        for market in markets:
+            if date is None:
+                url = market['todays_hours']
+            else:
+                url = market['url']+'hours/'+day.strftime('%Y-%m-%d')+'/'
+            marketTimeData = self.get_url(url)
+            if not marketTimeData['is_open']:
+                hours['is_open'] = False
+                continue
+            openTimeObject = datetime.strptime(marketTimeData['opens_at'],'%Y-%m-%dT%H:%M:%SZ')
+            closeTimeObject = datetime.strptime(marketTimeData['closes_at'],'%Y-%m-%dT%H:%M:%SZ')
+            if hours['opens_at'] is None or openTimeObject > hours['opens_at']:
+                hours['opens_at'] = openTimeObject
+            if hours['closes_at'] is None or closeTimeObject < hours['closes_at']:
+                hours['closes_at'] = closeTimeObject
+        if not hours['is_open']:
+            hours['opens_at'] = None
+            hours['closes_at'] = None
+        return hours
+
     def marketOpenCheck(self):
-        canTrade = True
+        """True if every market is open right now, see `tradingCalendar` for a cached check"""
         now = datetime.utcnow()
-
-        url = self.endpoints['markets']
-        marketData = (self.get_url(url)['results'])
-        for market in marketData:
-            marketTimeData = self.get_url(market['todays_hours'])
-            status = marketTimeData['is_open']
-            if status == False:
-                canTrade = False
-                print('is_open flag not true')
-            else:
-                print('is_open flag true')
-                openTime = marketTimeData['opens_at']
-                openTimeObject = datetime.strptime(openTime,'%Y-%m-%dT%H:%M:%SZ')
-                closeTime = marketTimeData['closes_at']
-                closeTimeObject= datetime.strptime(closeTime,'%Y-%m-%dT%H:%M:%SZ')
-            if not (status == False):
-                if now < openTimeObject:
-                    canTrade = False
-                    print('time before open')
-                if now > closeTimeObject:
-                    canTrade = False
-                    print('time after close')
+        hours = self.market_hours()
+        if not hours['is_open']:
+            print('is_open flag not true')
+            return False
+        print('is_open flag true')
+        canTrade = True
+        if now < hours['opens_at']:
+            canTrade = False
+            print('time before open')
+        if now > hours['closes_at']:
+            canTrade = False
+            print('time after close')
         return canTrade
 
 
@@ -188,6 +587,34 @@ class Robinhood:
 
         return res['results']
 
+    def instrument_symbol(self, url):
+        """ticker for an instrument url, fetched only on a cache miss
+        Args:
+            url (str): instrument url, e.g. from a position
+        Returns:
+            (str): stock ticker
+        """
+        symbol = self.instrument_cache.symbol(url)
+        if symbol is None:
+            symbol = self.get_url(url)['symbol']
+            self.instrument_cache.store(symbol, url)
+        return symbol
+
+    def instrument_url(self, stock):
+        """instrument url for a ticker, fetched only on a cache miss
+        Args:
+            stock (str): stock ticker
+        Returns:
+            (str): instrument url
+        """
+        url = self.instrument_cache.url(stock)
+        if url is None:
+            results = self.instruments(stock)
+            matches = [result for result in results if result['symbol'] == stock.upper()]
+            url = (matches or results)[0]['url']
+            self.instrument_cache.store(stock, url)
+        return url
+
     def get_url(self, url):
         """flat wrapper for fetching URL directly"""
         return self.session.get(url).json()
@@ -196,7 +623,9 @@ class Robinhood:
             self,
             stock,
             interval,
-            span
+            span,
+            dtype=np.float64,
+            timestamps=False
         ):
         """fetch historical data for stock
         Note: valid interval/span configs
@@ -208,9 +637,12 @@ class Robinhood:
             stock (str): stock ticker
             interval (str): resolution of data
             span (str): length of data
+            dtype (:obj:`numpy.dtype`): float type of the returned matrix
+            timestamps (bool): also return each bar's `begins_at`
         Returns:
             (:obj:`ndarray`) values returned from `historicals` endpoint
             columns: open_price, low_price, high_price, close_price, mean_price, volume
+            when `timestamps` is set, a (`datetime64[s]` ndarray, values) tuple
         """
 
         params = {
@@ -226,21 +658,10 @@ class Robinhood:
 
         rawHistoricals = ((res.json()['results'])[0])['historicals']
 
-        numpyHistoricals = np.zeros((len(rawHistoricals),6))
-
-        ii = 0
-
-
-        for bar in rawHistoricals:
-            numpyHistoricals[ii,0] = float(bar['open_price'])
-            numpyHistoricals[ii,1] = float(bar['low_price'])
-            numpyHistoricals[ii,2] = float(bar['high_price'])
-            numpyHistoricals[ii,3] = float(bar['close_price'])
-            numpyHistoricals[ii,4] = (float(bar['open_price'])+float(bar['low_price'])+float(bar['high_price'])+float(bar['close_price']))/4
-            numpyHistoricals[ii,5] = float(bar['volume'])
-            ii = ii+1
-
+        barTimes, numpyHistoricals = parse_historicals(rawHistoricals, dtype)
 
+        if timestamps:
+            return barTimes, numpyHistoricals
         return numpyHistoricals
 
     def quote_data(self, stock=''):
@@ -257,7 +678,7 @@ class Robinhood:
             url = str(self.endpoints['quotes']) + "?symbols=" + str(stock)
         #Check for validity of symbol
         try:
-            req = requests.get(url)
+            req = self.session.get(url)
             req.raise_for_status()
             data = req.json()
         except requests.exceptions.HTTPError:
@@ -265,7 +686,32 @@ class Robinhood:
 
         return data
 
+    def quotes(self, stocks):
+        """fetch bid/ask/mid prices for several stocks in one request
+        Note:
+            always uses the `?symbols=` form of the `quotes` endpoint
+        Args:
+            stocks (list): stock tickers
+        Returns:
+            (dict): `Quote` records keyed by stock ticker
+        """
+        symbols = ','.join(stock.upper() for stock in stocks)
+        url = str(self.endpoints['quotes']) + "?symbols=" + symbols
+        try:
+            req = self.session.get(url)
+            req.raise_for_status()
+            data = req.json()
+        except requests.exceptions.HTTPError:
+            raise NameError('Invalid Symbol: ' + symbols) #TODO: custom exception
 
+        quotes = {}
+        for stock, result in zip(stocks, data['results']):
+            if result is None:
+                raise NameError('Invalid Symbol: ' + stock)
+            bid = float(result['bid_price'])
+            ask = float(result['ask_price'])
+            quotes[result['symbol']] = Quote(result['symbol'], bid, ask, (ask+bid)/2)
+        return quotes
 
     def ask_price(self, stock=''):
         """get asking price for a stock
@@ -334,30 +780,72 @@ class Robinhood:
         """
         return self.session.get(self.endpoints['positions']+'?nonzero=true').json()
 
+    def account_snapshot(self, refresh=False):
+        """account, portfolio and positions, fetched concurrently once per run
+        Args:
+            refresh (bool): refetch even if a snapshot is cached
+        Returns:
+            (:obj:`AccountSnapshot`)
+        """
+        if self.snapshot is None or refresh:
+            with ThreadPoolExecutor(max_workers=3) as pool:
+                account = pool.submit(self.get_account)
+                portfolio = pool.submit(self.portfolios)
+                positions = pool.submit(self.securities_owned)
+                self.snapshot = AccountSnapshot(
+                    account.result(),
+                    portfolio.result(),
+                    positions.result()['results']
+                )
+        return self.snapshot
+
     ##############################
     #PLACE ORDER
     ##############################
 
+    orderOutcomeDictionary = {
+        'queued':'unresolved',
+        'unconfirmed':'unresolved',
+        'confirmed':'unresolved',
+        'partially_filled':'unresolved',
+        'filled':'success',
+        'rejected':'failure',
+        'canceled':'failure',
+        'failed':'failure'
+    }
+
     def check_order_status(self,url):
-        orderOutcomeDictionary = {
-            'queued':'unresolved',
-            'unconfirmed':'unresolved',
-            'confirmed':'unresolved',
-            'partially_filled':'unresolved',
-            'filled':'success',
-            'rejected':'failure',
-            'canceled':'failure',
-            'failed':'failure'
-        }
+        return self.order_status(url)[0]
+
+    def order_status(self,url):
+        """fetch an order and map its state to an outcome
+        Args:
+            url (str): order url from `place_immediate_market_order`
+        Returns:
+            (str): 'unresolved', 'success' or 'failure'
+            (:obj:`dict`): `orders` endpoint payload
+        """
         orderResponse = self.get_url(url)
-        return orderOutcomeDictionary[orderResponse['state']]
+        return self.orderOutcomeDictionary[orderResponse['state']], orderResponse
+
+    def cancel_order(self,order):
+        """ask Robinhood to cancel an open order
+        Args:
+            order (dict): `orders` endpoint payload, its 'cancel' url is None once the order can't be canceled
+        Returns:
+            (bool): the cancel was accepted
+        """
+        if not order.get('cancel'):
+            return False
+        res = self.session.post(order['cancel'])
+        return res.status_code < 400
 
 
 
 
     def place_immediate_market_order(self,instrument,symbol,time_in_force,quantity,side,price=0.0):
         payload = {
-            'account': self.get_account()['url'],
+            'account': self.account_snapshot().account_url,
             'instrument': instrument,
             'quantity': quantity,
             'side': side,
@@ -0,0 +1,156 @@
+import math
+import threading
+from collections import deque
+
+import numpy as np
+
+class RollingVolatility:
+    """O(1) sliding-window VWAP and volatility of VWAP-normalized prices
+
+    Matches `calcAlloc`: VWAP is the volume weighted mean price over the
+    window and the volatility is the population std of price/VWAP, which is
+    std(price)/VWAP. Keeps running sums of price*volume and volume plus a
+    Welford mean/M2 of price, each updated on add and evict. The sums are
+    rebuilt exactly from the window every `recompute_every` updates to bound
+    floating point drift.
+    """
+
+    def __init__(self, span, recompute_every=1000):
+        """
+        Args:
+            span (:obj:`numpy.timedelta64`): bars within this of the newest one are kept
+            recompute_every (int): updates between exact recomputes
+        """
+        self.span = span
+        self.recompute_every = recompute_every
+        self.bars = deque()
+        self.updates = 0
+        self.recompute()
+
+    def recompute(self):
+        """rebuild every running sum from the bars in the window"""
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.priceVolume = 0.0
+        self.volume = 0.0
+        for _, price, volume in self.bars:
+            self._add(price, volume)
+        self.updates = 0
+
+    def update(self, time, price, volume):
+        """add a bar, replacing the newest one if it has the same time
+        Args:
+            time (:obj:`numpy.datetime64`): bar start time
+            price (float): bar mean price
+            volume (float): bar volume
+        """
+        if self.bars and time < self.bars[-1][0]:
+            return
+        if self.bars and time == self.bars[-1][0]:
+            _, oldPrice, oldVolume = self.bars.pop()
+            self._remove(oldPrice, oldVolume)
+        self.bars.append((time, price, volume))
+        self._add(price, volume)
+        cutoff = time-self.span
+        while self.bars[0][0] < cutoff:
+            _, oldPrice, oldVolume = self.bars.popleft()
+            self._remove(oldPrice, oldVolume)
+        self.updates += 1
+        if self.updates >= self.recompute_every:
+            self.recompute()
+
+    def last_time(self):
+        return self.bars[-1][0] if self.bars else None
+
+    def vwap(self):
+        return self.priceVolume/self.volume
+
+    def volatility(self):
+        """population std of price/VWAP over the window"""
+        variance = max(self.m2, 0.0)/self.count
+        return math.sqrt(variance)/self.vwap()
+
+    def _add(self, price, volume):
+        self.count += 1
+        delta = price-self.mean
+        self.mean += delta/self.count
+        self.m2 += delta*(price-self.mean)
+        self.priceVolume += price*volume
+        self.volume += volume
+
+    def _remove(self, price, volume):
+        self.count -= 1
+        if self.count == 0:
+            self.mean = 0.0
+            self.m2 = 0.0
+        else:
+            delta = price-self.mean
+            self.mean -= delta/self.count
+            self.m2 -= delta*(price-self.mean)
+        self.priceVolume -= price*volume
+        self.volume -= volume
+
+class RollingAllocator:
+    """streaming version of `calcAlloc` fed from stored bars
+
+    Keeps one `RollingVolatility` per symbol. `sync` feeds only the bars at
+    or after the last one seen, so calling it every tick with a `BarStore`
+    window costs O(new bars).
+    """
+
+    def __init__(self, span=np.timedelta64(7, 'D'), recompute_every=1000):
+        self.span = span
+        self.recompute_every = recompute_every
+        self.estimators = {}
+        self.lock = threading.Lock()
+
+    def sync(self, symbol, times, bars):
+        """feed any bars not seen yet
+        Args:
+            symbol (str): stock ticker
+            times (:obj:`ndarray`) `datetime64` bar start times, ascending
+            bars (:obj:`ndarray`) columns: open_price, low_price, high_price, close_price, mean_price, volume
+        Returns:
+            (int): number of bars fed
+        """
+        with self.lock:
+            estimator = self.estimators.get(symbol)
+            if estimator is None:
+                estimator = RollingVolatility(self.span, self.recompute_every)
+                self.estimators[symbol] = estimator
+            start = 0
+            lastTime = estimator.last_time()
+            if lastTime is not None:
+                start = np.searchsorted(times, lastTime, side='left')
+            for ii in range(start, len(times)):
+                estimator.update(times[ii], float(bars[ii, 4]), float(bars[ii, 5]))
+            return len(times)-start
+
+    def allocation(self, first, second, steepness=None, center=.5):
+        """share of the portfolio for `first`, the less volatile gets more
+        Args:
+            first (str): ticker being allocated, e.g. 'SPY'
+            second (str): the other ticker, e.g. 'TLT'
+            steepness (float): if set, pass the raw allocation through the
+                sigmoid from trader.py, 1/(1+exp(-steepness*(raw-center)))
+            center (float): sigmoid midpoint
+        Returns:
+            (float): allocation of `first` in [0, 1]
+        """
+        with self.lock:
+            firstVolatility = self.estimators[first].volatility()
+            secondVolatility = self.estimators[second].volatility()
+
+        totalVolatility = firstVolatility+secondVolatility
+
+        allocation = 1-(firstVolatility/totalVolatility)
+        if steepness is not None:
+            allocation = 1/(1+math.exp(-steepness*(allocation-center)))
+
+        if allocation > 1:
+            allocation = 1
+        if allocation < 0:
+            allocation = 0
+
+        return allocation
@@ -1,13 +1,22 @@
-from robinhood import Robinhood
+from barStore import BarStore
+from tickStore import TickStore, tick_fields
+from outlierFilter import OutlierFilter
+from riskFreeRate import RiskFreeRate
+from tradingCalendar import TradingCalendar
+from tokenStore import TokenStore
+from clientPool import ClientPool
+from bucketStore import BucketStore
+from rollingStats import RollingAllocator
+import allocation
+from orderExecution import OrderExecutor, OrderRequest
 import numpy as np
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import math
 import os
 import random
-import time
 import smtplib
 import datetime
-from pymongo import MongoClient
-import quandl
 import requests
 
 
@@ -35,6 +44,9 @@ except:
     mailgun_domain = os.getenv('MAILGUN_DOMAIN')
     diag_email_dest = os.getenv('DIAG_EMAIL_DEST')
 
+# GATHER_ASYNC=1 fans a tick's independent fetches out on an event loop, see the README
+gatherAsync = os.getenv('GATHER_ASYNC') == '1'
+
 #from https://stackoverflow.com/questions/865618/how-can-i-perform-divison-on-a-datetime-timedelta-in-python
 
 def divtd(td1, td2):
@@ -42,15 +54,19 @@ def divtd(td1, td2):
     us2 = td2.microseconds + 1000000 * (td2.seconds + 86400 * td2.days)
     return float(us1) / us2
 
-def run_gather_data():
+def run_gather_data(asyncMode=None, clients=None):
     #code that gets and logs performance data
     print("Gathering Data")
     success = True
+    if asyncMode is None:
+        asyncMode = gatherAsync
+    clients = clients or warmClients or ClientPool(mongodb_uri)
+    prefetch = {}
 
-    rh = Robinhood()
+    rh = clients.robinhood()
     now = datetime.datetime.utcnow()
     try:
-        success = rh.marketOpenCheck()
+        success = marketOpen(rh, clients)
         if not success:
             print('markets are closed')
         else:
@@ -58,11 +74,39 @@ def run_gather_data():
     except Exception as e:
         success = False
         print('rh market check error ', str(e))
-        send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("rh market check error. Unexpected error: "+str(e)))
+        send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("rh market check error. Unexpected error: "+str(e)),session=clients.mailgun())
+
+    loginFuture = None
+    if success and asyncMode:
+        # the mongo stage doesn't need the token, log in alongside it
+        loginPool = ThreadPoolExecutor(max_workers=1)
+        loginFuture = loginPool.submit(robinhoodLogin, rh)
+        loginPool.shutdown(wait=False)
 
     if success:
         try:
-            success = rh.login(username=rhuser, password=rhpass)
+            client = clients.mongo()
+            db = client.get_database()
+            rh.instrument_cache.use_collection(db.instruments)
+            if bars.collection is None:
+                bars.use_collection(db.bars)
+            if ticks.db is None:
+                ticks.use_database(db)
+                # TICK_LEGACY_WRITES=1 keeps the per-minute collections written while migrating
+                ticks.use_buckets(BucketStore(db, fields=tick_fields), legacy=os.getenv('TICK_LEGACY_WRITES') == '1')
+            if warmClients is not None and not outliers.seeded:
+                # once per warm process, a forked job would read the window every tick
+                outliers.seed(ticks.recent('percentageMove', outliers.window))
+            if riskFreeRates.collection is None:
+                riskFreeRates.use_collection(db.riskFree)
+        except Exception as e:
+            print('mongo login error ', str(e))
+            success = False
+            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("mongo login error. Unexpected error: "+str(e)),session=clients.mailgun())
+
+    if success:
+        try:
+            success = loginFuture.result() if loginFuture is not None else robinhoodLogin(rh)
             if success:
                 print('robinhood login succesful')
             else:
@@ -70,48 +114,50 @@ def run_gather_data():
         except Exception as e:
             success = False
             print('rh login error ', str(e))
-            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("rh login error. Unexpected error: "+str(e)))
-
-
+            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("rh login error. Unexpected error: "+str(e)),session=clients.mailgun())
 
+    if success and ticks.redis is None:
+        try:
+            from worker import conn
+            ticks.use_redis(conn)
+            riskFreeRates.use_redis(conn)
+        except Exception as e:
+            # the previous tick is read from mongo instead
+            print('redis connection error ', str(e))
 
-    if success:
+    if success and asyncMode:
         try:
-            client = MongoClient(mongodb_uri)
-            db = client.get_database()
+            prefetch = prefetchGatherData(rh, clients)
         except Exception as e:
-            print('mongo login error ', str(e))
-            success = False
-            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("mongo login error. Unexpected error: "+str(e)))
+            # each stage below fetches for itself when its result is missing
+            print('async prefetch error ', str(e))
 
     if success:
         try:
             #get pricing data
-            spyAskPrice = rh.ask_price('SPY')
-            spyBidPrice = rh.bid_price('SPY')
-            spyAvgCost = (spyAskPrice+spyBidPrice)/2
+            quotes = fetched(prefetch, 'quotes', lambda: rh.quotes(['SPY','TLT']))
+            spyAvgCost = quotes['SPY'].mid_price
             print('spyAvgCost = ', spyAvgCost)
 
-            tltAskPrice = rh.ask_price('TLT')
-            tltBidPrice = rh.bid_price('TLT')
-            tltAvgCost = (tltAskPrice+tltBidPrice)/2
+            tltAvgCost = quotes['TLT'].mid_price
             print('tltAvgCost = ', tltAvgCost)
         except Exception as e:
             print('etf price error ', str(e))
             success = False
-            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("etf price error. Unexpected error: "+str(e)))
+            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("etf price error. Unexpected error: "+str(e)),session=clients.mailgun())
 
     if success:
         try:
             #get portfolioValue
-            portfolioValue = rh.equity()
+            snapshot = fetched(prefetch, 'snapshot', rh.account_snapshot)
+            portfolioValue = snapshot.equity
             tltPosition = 0
             spyPosition = 0
             print('portfolioValue =', portfolioValue)
-            openPositions = rh.securities_owned()['results']
+            openPositions = snapshot.positions
             for position in openPositions:
                 instrumentURL = position['instrument']
-                positionTicker = rh.get_url(instrumentURL)['symbol']
+                positionTicker = rh.instrument_symbol(instrumentURL)
                 positionQuantity = float(position['quantity'])
                 if (positionTicker == 'SPY'):
                     spyPosition = positionQuantity
@@ -122,23 +168,22 @@ def run_gather_data():
         except Exception as e:
             print('portfolio value error ', str(e))
             success = False
-            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("portfolio value error. Unexpected error: "+str(e)))
+            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("portfolio value error. Unexpected error: "+str(e)),session=clients.mailgun())
 
     if success:
         try:
             #get treasury risk free rate
-            quandl.ApiConfig.api_key = quandl_key
-            riskFree = (quandl.get("USTREASURY/BILLRATES.3", rows=1,returns='numpy')[0])[1]
+            riskFree = fetched(prefetch, 'riskFree', fetchRiskFree)
             print('riskFree =', riskFree)
         except Exception as e:
             print('risk free error ', str(e))
             success = False
-            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("risk free error. Unexpected error: "+str(e)))
+            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("risk free error. Unexpected error: "+str(e)),session=clients.mailgun())
 
     if success:
         try:
             #get last data
-            lastData = db.rawPrices.find_one(sort=[("timestamp", -1)])
+            lastData = fetched(prefetch, 'lastData', ticks.last)
             lastTimestamp = lastData['timestamp']
             lastSpy = lastData['spy']
             lastTlt = lastData['tlt']
@@ -147,24 +192,7 @@ def run_gather_data():
         except Exception as e:
             print('error getting previous data ', str(e))
             success = False
-            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("error getting previous data. Unexpected error: "+str(e)))
-
-    if success:
-        try:
-            # save data
-            rawData = {
-                "timestamp":now,
-                "spy":spyAvgCost,
-                "tlt":tltAvgCost,
-                "portfolio":portfolioValue,
-                "annualized90day":riskFree
-            }
-            data_id = db.rawPrices.insert_one(rawData).inserted_id
-            print("data saved to",data_id)
-        except Exception as e:
-            print('data save error ', str(e))
-            success = False
-            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("error calculating change. Unexpected error: "+str(e)))
+            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("error getting previous data. Unexpected error: "+str(e)),session=clients.mailgun())
 
     if success:
         try:
@@ -182,29 +210,12 @@ def run_gather_data():
         except Exception as e:
             print('error calculating change ', str(e))
             success = False
-            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("error calculating change. Unexpected error: "+str(e)))
-
-    if success:
-        try:
-            # save data
-            percentageData = {
-                "timestamp":now,
-                "spy":spyChange,
-                "tlt":tltChange,
-                "portfolio":portfolioChange,
-                "90dayTreasury":treasuryChange
-            }
-            data_id = db.percentageMove.insert_one(percentageData).inserted_id
-            print("data saved to",data_id)
-        except Exception as e:
-            print('data save error ', str(e))
-            success = False
-            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("data save error. Unexpected error: "+str(e)))
+            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("error calculating change. Unexpected error: "+str(e)),session=clients.mailgun())
 
     if success:
         try:
             # calculate tracking
-            spyTarget = calcAlloc(rh)
+            spyTarget = fetched(prefetch, 'spyTarget', lambda: calcAlloc(rh, bars))
             print('spyTarget = ',spyTarget)
             tltTarget = 1-spyTarget
             print('tltTarget = ',tltTarget)
@@ -216,11 +227,35 @@ def run_gather_data():
         except Exception as e:
             print('error calculating tracking ', str(e))
             success = False
-            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("error calculating tracking. Unexpected error: "+str(e)))
+            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("error calculating tracking. Unexpected error: "+str(e)),session=clients.mailgun())
 
     if success:
         try:
-            # save tracking data
+            # save the tick to rawPrices, percentageMove and tracking together
+            rawData = {
+                "timestamp":now,
+                "spy":spyAvgCost,
+                "tlt":tltAvgCost,
+                "portfolio":portfolioValue,
+                "annualized90day":riskFree
+            }
+            percentageData = {
+                "timestamp":now,
+                "spy":spyChange,
+                "tlt":tltChange,
+                "portfolio":portfolioChange,
+                "90dayTreasury":treasuryChange
+            }
+            # unknown unless the check below succeeds
+            percentageData["outlier"] = None
+            try:
+                # score against the recent window before the tick is saved
+                flagged = outliers.score(percentageData)
+                percentageData["outlier"] = bool(flagged)
+                if flagged:
+                    print('outlier tick ', flagged)
+            except Exception as e:
+                print('outlier check error ', str(e))
             trackingData = {
                 "timestamp":now,
                 "spyActual":spyActual,
@@ -228,20 +263,78 @@ def run_gather_data():
                 "spyTarget":spyTarget,
                 "tltTarget":tltTarget
             }
-            data_id = db.tracking.insert_one(trackingData).inserted_id
-            print("data saved to",data_id)
+            data_ids = ticks.write(rawData,percentageData,trackingData)
+            print("data saved to",data_ids)
+            try:
+                # only a saved tick joins the window
+                outliers.add(percentageData)
+            except Exception as e:
+                print('outlier window error ', str(e))
         except Exception as e:
-            print('tracking data save error ', str(e))
+            print('tick data save error ', str(e))
             success = False
-            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("tracking data save error. Unexpected error: "+str(e)))
+            send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader data gather error '+str(datetime.datetime.now())),("tick data save error. Unexpected error: "+str(e)),session=clients.mailgun())
 
 
-def send_email(domain,key,recipient, subject, body):
+def fetchRiskFree():
+    #get treasury risk free rate, cached since it only changes once a business day
+    return riskFreeRates.current()
+
+def run_refresh_risk_free(clients=None):
+    #fetch the treasury rate from quandl into every cache, scheduled by clock.py
+    clients = clients or warmClients or ClientPool(mongodb_uri)
+    if riskFreeRates.collection is None:
+        riskFreeRates.use_collection(clients.mongo().get_database().riskFree)
+    if riskFreeRates.redis is None:
+        try:
+            from worker import conn
+            riskFreeRates.use_redis(conn)
+        except Exception as e:
+            print('redis connection error ', str(e))
+    entry = riskFreeRates.refresh()
+    print('risk free rate', entry['rate'], 'for', entry['date'])
+    return entry['rate']
+
+def fetched(prefetch, name, fetch):
+    #result of a prefetched call, re-raising its error, or make the call now
+    if name not in prefetch:
+        return fetch()
+    if isinstance(prefetch[name], Exception):
+        raise prefetch[name]
+    return prefetch[name]
+
+def prefetchGatherData(rh, clients):
+    #run the independent fetches of a gather tick concurrently, the slowest one sets the wall time
+    arh = clients.async_robinhood()
+    arh.use_token(rh.auth_token)
+    return arh.run(prefetchGatherDataAsync(arh))
+
+async def prefetchGatherDataAsync(arh):
+    loop = asyncio.get_event_loop()
+
+    async def snapshotWithSymbols():
+        # resolving the symbols here warms the cache the sync stage reads
+        snapshot = await arh.account_snapshot()
+        await asyncio.gather(*[arh.instrument_symbol(position['instrument']) for position in snapshot.positions])
+        return snapshot
+
+    names = ['quotes', 'snapshot', 'riskFree', 'lastData', 'spyTarget']
+    results = await asyncio.gather(
+        arh.quotes(['SPY','TLT']),
+        snapshotWithSymbols(),
+        loop.run_in_executor(None, fetchRiskFree),
+        loop.run_in_executor(None, ticks.last),
+        calcAllocAsync(arh, bars),
+        return_exceptions=True
+    )
+    return dict(zip(names, results))
+
+def send_email(domain,key,recipient, subject, body, session=None):
 
     mailgun_key = key
     mailgun_domain = domain
     request_url = 'https://api.mailgun.net/v3/'+mailgun_domain+'/messages'
-    request = requests.post(request_url, auth=('api', mailgun_key), data={
+    request = (session or requests).post(request_url, auth=('api', mailgun_key), data={
         'from': 'trader@resiliant-trader.com',
         'to': recipient,
         'subject': subject,
@@ -264,22 +357,83 @@ def recommendTarget(portfolioValue,spyAllocationPercentage,tltAllocationPercenta
     spyTargetShares =math.floor(tltTargetShares*allocationRatio)
     return spyTargetShares,tltTargetShares
 
-def targetTotalCost(spyTargetShares,tltTargetShares,spyBuyPrice,tltBuyPrice):
-    targetPurchaseCost = (spyTargetShares*spyBuyPrice)+(tltTargetShares*tltBuyPrice)
-    return targetPurchaseCost
+# previous tick kept in memory, written as one unit with percentageMove and tracking
+ticks = TickStore()
 
-def allocationPercentage(shares,cost,totalCost):
-    percentage = (shares*cost)/totalCost
-    return percentage
+# 90 day treasury rate, quandl is only called when the cached rate is hours old
+riskFreeRates = RiskFreeRate(quandl_key)
 
-def allocationLoss(spyTarget,spyAchieved,tltTarget,tltAchieved):
-    loss = math.sqrt((spyTarget-spyAchieved)**2+(tltTarget-tltAchieved)**2)
-    return loss
+# set by `worker.py --warm`, jobs then reuse its connections instead of opening their own
+warmClients = None
 
+# robinhood token shared through redis, credentials are only posted when it is old or rejected
+authTokens = TokenStore(rhuser, rhpass)
 
+def robinhoodLogin(rh):
+    if authTokens.redis is None:
+        try:
+            from worker import conn
+            authTokens.use_redis(conn)
+        except Exception as e:
+            # the token is still reused within this process
+            print('redis connection error ', str(e))
+    return authTokens.login(rh)
+
+# session hours fetched once per day, shared through mongo since rq forks a process per job
+marketCalendar = TradingCalendar()
 
+def marketOpen(rh, clients):
+    if marketCalendar.collection is None:
+        try:
+            marketCalendar.use_collection(clients.mongo().get_database().marketHours)
+        except Exception as e:
+            # hours are still fetched once per process without it
+            print('market calendar mongo error ', str(e))
+    return marketCalendar.is_open(rh)
+
+# rolling median/MAD of recent percentage moves, flags bad quotes as they are saved,
+# seeded only by the warm worker so a forking worker never flags
+outliers = OutlierFilter()
+
+# 5minute bars kept across ticks, calcAlloc only fetches the new ones
+bars = BarStore()
+week = np.timedelta64(7, 'D')
+rollingAllocator = RollingAllocator(week)
+
+# symbols the trader holds, anything else is sold
+universe = ('SPY', 'TLT')
+
+def targetWeights(rh):
+    # both branches are raw inverse volatility weights with no sigmoid, SPY/TLT reuses the
+    # streaming estimator so the trader targets exactly what the gather ticks track
+    if universe == ('SPY', 'TLT'):
+        spyAllocation = calcAlloc(rh, bars)
+        return np.array([spyAllocation, 1-spyAllocation])
+    for symbol in universe:
+        bars.update(rh, symbol)
+    windows = [bars.window(symbol, week) for symbol in universe]
+    length = min(len(window) for window in windows)
+    prices = np.stack([window[len(window)-length:, 4] for window in windows], axis=1)
+    volumes = np.stack([window[len(window)-length:, 5] for window in windows], axis=1)
+    return allocation.inverseVolatilityWeights(prices, volumes)
+
+def streamingAlloc(bars):
+    # streaming estimate over the stored window, O(new bars) per tick
+    for symbol in ['SPY','TLT']:
+        barTimes, barValues = bars.window(symbol, week, timestamps=True)
+        rollingAllocator.sync(symbol, barTimes, barValues)
+    return rollingAllocator.allocation('SPY','TLT')
+
+async def calcAllocAsync(rh, bars):
+    await asyncio.gather(bars.update_async(rh, 'SPY'), bars.update_async(rh, 'TLT'))
+    return streamingAlloc(bars)
+
+def calcAlloc(rh, bars=None):
+    if bars is not None:
+        for symbol in ['SPY','TLT']:
+            bars.update(rh, symbol)
+        return streamingAlloc(bars)
 
-def calcAlloc(rh):
     spyHist = rh.get_historical_quote('SPY','5minute','week')
     tltHist = rh.get_historical_quote('TLT','5minute','week')
 
@@ -311,14 +465,16 @@ def calcAlloc(rh):
 
     return spyAllocation
 
-def run_trader():
+def run_trader(clients=None):
+    clients = clients or warmClients or ClientPool(mongodb_uri)
     try:
         print("running trader at: "+str(datetime.datetime.now()))
         message = "running trader at: "+str(datetime.datetime.now())
         success = True
 
-        rh = Robinhood()
-        success = rh.marketOpenCheck()
+        rh = clients.robinhood()
+        executor = None
+        success = marketOpen(rh, clients)
         if not success:
             print('markets are closed')
             message += '\nmarkets are closed'
@@ -327,7 +483,17 @@ def run_trader():
             message += '\nmarkets are open'
 
         if success:
-            success = rh.login(username=rhuser, password=rhpass)
+            try:
+                client = clients.mongo()
+                rh.instrument_cache.use_collection(client.get_database().instruments)
+                if bars.collection is None:
+                    bars.use_collection(client.get_database().bars)
+            except Exception as e:
+                # the cache only saves lookups, trade without it
+                print('instrument cache error ', str(e))
+
+        if success:
+            success = robinhoodLogin(rh)
 
         if success:
             print('login succesful')
@@ -339,44 +505,30 @@ def run_trader():
 
         if success:
             #exit extra postions
-            openPositions = rh.securities_owned()['results']
+            openPositions = rh.account_snapshot().positions
 
-            sellOrders = {}
+            executor = OrderExecutor(rh)
+
+            extraSells = []
             for position in openPositions:
                 instrumentURL = position['instrument']
-                positionTicker = rh.get_url(instrumentURL)['symbol']
+                positionTicker = rh.instrument_symbol(instrumentURL)
                 positionQuantity = position['quantity']
-                if (positionTicker != 'SPY') and (positionTicker != 'TLT'):
+                if positionTicker not in universe:
                     print('position in ', positionTicker, ' is not needed, selling')
-                    stock_instrument = rh.instruments(positionTicker)[0]
-                    sellOrders[positionTicker] = rh.place_immediate_market_order(instrumentURL,positionTicker,'gfd',positionQuantity,'sell')
-            if sellOrders == {}:
+                    extraSells.append(OrderRequest(positionTicker,instrumentURL,positionQuantity,'sell',None))
+            if extraSells == []:
                 print('no extra positions found to close')
                 message += '\nno extra positions found to close'
             else:
-                print(sellOrders)
-
-            orderOutcome = 'unresolved'
-
-            while orderOutcome != 'resolved':
-                remainingUnresolved = False
-                for order in sellOrders:
-                    orderDetail = sellOrders[order]
-                    orderDetail['status'] = rh.check_order_status(orderDetail['url'])
-                    if orderDetail['status'] == 'unresolved':
-                        remainingUnresolved = True
-                if not remainingUnresolved:
-                    orderOutcome = 'resolved'
-                else:
-                    print('remaining unresolved orders, waiting')
-                    message += '\nremaining unresolved orders, waiting'
-                    time.sleep(60)
-
-
-            for order in sellOrders:
-                orderDetail = sellOrders[order]
-                if orderDetail['status'] == 'failure':
-                    success = False
+                # market sells carry the bid only to estimate proceeds when the fill has no average price
+                try:
+                    extraQuotes = rh.quotes([request.symbol for request in extraSells])
+                    extraSells = [request._replace(price=extraQuotes[request.symbol].bid_price) for request in extraSells]
+                except Exception as e:
+                    print('extra position quote error ', str(e))
+
+            success = executor.rebalance(extraSells,[])[0]
 
         if not success:
             print('unable to sell extra positions correctly')
@@ -384,83 +536,53 @@ def run_trader():
 
         if success:
             #get portfolio current value
-            portfolioValue = rh.equity()
+            if extraSells != []:
+                rh.account_snapshot(refresh=True)
+            portfolioValue = rh.account_snapshot().equity
             print('portfolioValue =', portfolioValue)
             message += '\nportfolioValue = '
             message += str(portfolioValue)
 
-            #allocate portfolio
-            spyAllocationPercentage = calcAlloc(rh)
-            tltAllocationPercentage = 1-spyAllocationPercentage
-            print('spyAllocationPercentage = ', spyAllocationPercentage)
-            message += '\nspyAllocationPercentage = '
-            message += str(spyAllocationPercentage)
-            print('tltAllocationPercentage = ', tltAllocationPercentage)
-            message += '\ntltAllocationPercentage = '
-            message += str(tltAllocationPercentage)
-
-            spyTargetAllocation = spyAllocationPercentage*portfolioValue
-            tltTargetAllocation = tltAllocationPercentage*portfolioValue
-            print('spyTargetAllocation = ', spyTargetAllocation)
-            message += '\nspyTargetAllocation = '
-            message += str(spyTargetAllocation)
-            print('tltTargetAllocation = ', tltTargetAllocation)
-            message += '\ntltTargetAllocation = '
-            message += str(tltTargetAllocation)
+            #allocate portfolio, every array below has one entry per symbol of the universe
+            weights = targetWeights(rh)
 
             #get pricing data
-            spyAskPrice = rh.ask_price('SPY')
-            spyBidPrice = rh.bid_price('SPY')
-            spyAvgCost = (spyAskPrice+spyBidPrice)/2
-            spyBuyPrice = spyAskPrice+(spyAskPrice - spyBidPrice)
-            spySellPrice = spyBidPrice-(spyAskPrice - spyBidPrice)
-            print('spyAskPrice = ', spyAskPrice)
-            message += '\nspyAskPrice = '
-            message += str(spyAskPrice)
-            print('spyBidPrice = ', spyBidPrice)
-            message += '\nspyBidPrice = '
-            message += str(spyBidPrice)
-
-            tltAskPrice = rh.ask_price('TLT')
-            tltBidPrice = rh.bid_price('TLT')
-            tltAvgCost = (tltAskPrice+tltBidPrice)/2
-            tltBuyPrice = tltAskPrice+(tltAskPrice - tltBidPrice)
-            tltSellPrice = tltBidPrice-(tltAskPrice - tltBidPrice)
-            print('tltAskPrice = ', tltAskPrice)
-            message += '\ntltAskPrice = '
-            message += str(tltAskPrice)
-            print('tltBidPrice = ', tltBidPrice)
-            message += '\ntltBidPrice = '
-            message += str(tltBidPrice)
-
-            #recommend position sizes
-            #[spyTargetShares,tltTargetShares] = recommendTarget(portfolioValue,spyAllocationPercentage,tltAllocationPercentage,spyBuyPrice,tltBuyPrice)
-            [spyTargetShares,tltTargetShares] = recommendInitialTarget(portfolioValue,spyAllocationPercentage,tltAllocationPercentage,spyBuyPrice,tltBuyPrice)
-
-            print('spyTargetShares = ', spyTargetShares)
-            message += '\nspyTargetShares = '
-            message += str(spyTargetShares)
-            print('tltTargetShares = ', tltTargetShares)
-            message += '\ntltTargetShares = '
-            message += str(tltTargetShares)
-
-
-            targetPurchaseCost = targetTotalCost(spyTargetShares,tltTargetShares,spyBuyPrice,tltBuyPrice)
-
-
-            spyTargetAllocationPercentage = allocationPercentage(spyTargetShares,spyBuyPrice,targetPurchaseCost)
-            tltTargetAllocationPercentage = allocationPercentage(tltTargetShares,tltBuyPrice,targetPurchaseCost)
-            print('spyTargetAllocationPercentage = ',spyTargetAllocationPercentage)
-            message += '\nspyTargetAllocationPercentage = '
-            message += str(spyTargetAllocationPercentage)
-            print('tltTargetAllocationPercentage = ',tltTargetAllocationPercentage)
-            message += '\ntltTargetAllocationPercentage = '
-            message += str(tltTargetAllocationPercentage)
-
-            targetLoss = allocationLoss(spyTargetAllocationPercentage,spyAllocationPercentage,tltTargetAllocationPercentage,tltAllocationPercentage)
-            print('target loss = ',targetLoss)
-
+            quotes = rh.quotes(list(universe))
+            askPrices = np.array([quotes[symbol].ask_price for symbol in universe])
+            bidPrices = np.array([quotes[symbol].bid_price for symbol in universe])
+            avgCosts = (askPrices+bidPrices)/2
+            buyPrices = askPrices+(askPrices-bidPrices)
+            sellPrices = bidPrices-(askPrices-bidPrices)
+
+            #recommend position sizes, the integer shares closest to the weights
+            targetShares = allocation.recommendShares(portfolioValue, weights, buyPrices)
+            targetAllocations = allocation.allocationPercentages(targetShares, buyPrices)
+            targetLoss = allocation.allocationLoss(weights, targetAllocations)
+            targetPurchaseCost = float((targetShares*buyPrices).sum())
             targetRemainingCash = portfolioValue-targetPurchaseCost
+
+            #detemine required rebalancing
+            positions = np.zeros(len(universe))
+            for position in openPositions:
+                positionTicker = rh.instrument_symbol(position['instrument'])
+                if positionTicker in universe:
+                    positions[universe.index(positionTicker)] = float(position['quantity'])
+            required = targetShares-positions
+
+            for name, values in (
+                    ('AllocationPercentage', weights),
+                    ('TargetAllocation', weights*portfolioValue),
+                    ('AskPrice', askPrices),
+                    ('BidPrice', bidPrices),
+                    ('TargetShares', targetShares),
+                    ('TargetAllocationPercentage', targetAllocations),
+                    ('Required', required)
+                ):
+                for symbol, value in zip(universe, values):
+                    print(symbol.lower()+name+' = ', value)
+                    message += '\n'+symbol.lower()+name+' = '
+                    message += str(value)
+            print('target loss = ',targetLoss)
             print('targetPurchaseCost = ', targetPurchaseCost)
             message += '\ntargetPurchaseCost = '
             message += str(targetPurchaseCost)
@@ -468,157 +590,33 @@ def run_trader():
             message += '\ntargetRemainingCash = '
             message += str(targetRemainingCash)
 
-            #detemine required rebalancing
-            spyRequired = spyTargetShares
-            tltRequired = tltTargetShares
-            for position in openPositions:
-                instrumentURL = position['instrument']
-                positionTicker = rh.get_url(instrumentURL)['symbol']
-                positionQuantity = float(position['quantity'])
-                if (positionTicker == 'SPY'):
-                    spyRequired = spyTargetShares-positionQuantity
-                if (positionTicker == 'TLT'):
-                    tltRequired = tltTargetShares-positionQuantity
-
-            print('spyRequired = ',spyRequired)
-            message += '\nspyRequired = '
-            message += str(spyRequired)
-            print('tltRequired = ',tltRequired)
-            message += '\ntltRequired = '
-            message += str(tltRequired)
-
-            spyInstrumentUrl = (rh.instruments('SPY')[0])['url']
-            tltInstrumentUrl = (rh.instruments('TLT')[0])['url']
-
-        if success:
-            #sell positions
-            if spyRequired < 0.0:
-                print('selling ',-spyRequired,' of SPY')
-                spySellOrder = rh.place_immediate_market_order(spyInstrumentUrl,'SPY','gfd',-spyRequired,'sell')
-                print(spySellOrder)
-
-                orderOutcome = 'unresolved'
-
-                while orderOutcome != 'resolved':
-                    remainingUnresolved = False
-                    orderResponse = rh.check_order_status(spySellOrder['url'])
-                    if orderResponse == 'unresolved':
-                        remainingUnresolved = True
-                    if not remainingUnresolved:
-                        orderOutcome = 'resolved'
-                    else:
-                        print('remaining unresolved spySell, waiting')
-                        message += '\nremaining unresolved spySell, waiting'
-                        time.sleep(60)
-
-
-
-
-                if orderResponse == 'failure':
-                    success = False
-
-        if not success:
-            print('unable to sell required spy')
-            message += '\nunable to sell required spy'
-
         if success:
-            if tltRequired < 0.0:
-                print('selling ',-tltRequired,' of TLT')
-                tltSellOrder = rh.place_immediate_market_order(tltInstrumentUrl,'TLT','gfd',-tltRequired,'sell')
-                print(tltSellOrder)
-
-                orderOutcome = 'unresolved'
-
-                while orderOutcome != 'resolved':
-                    remainingUnresolved = False
-                    orderResponse = rh.check_order_status(tltSellOrder['url'])
-                    if orderResponse == 'unresolved':
-                        remainingUnresolved = True
-                    if not remainingUnresolved:
-                        orderOutcome = 'resolved'
-                    else:
-                        print('remaining unresolved tltSell, waiting')
-                        message += '\nremaining unresolved tltSell, waiting'
-                        time.sleep(60)
-
-
-
-                if orderResponse == 'failure':
-                    success = False
+            #sells go out together, buys are released as their proceeds settle
+            rebalanceSells = []
+            rebalanceBuys = []
+            for index, symbol in enumerate(universe):
+                if required[index] < 0.0:
+                    print('selling ',-required[index],' of ',symbol)
+                    rebalanceSells.append(OrderRequest(symbol,rh.instrument_url(symbol),float(-required[index]),'sell',float(sellPrices[index])))
+                elif required[index] > 0.0:
+                    print('buying ',required[index],' of ',symbol)
+                    rebalanceBuys.append(OrderRequest(symbol,rh.instrument_url(symbol),float(required[index]),'buy',round(float(buyPrices[index]), 3)))
+
+            availableCash = portfolioValue-float((positions*avgCosts).sum())
+            success = executor.rebalance(rebalanceSells,rebalanceBuys,availableCash)[0]
 
         if not success:
-            print('unable to sell required tlt')
-            message += '\nunable to sell required tlt'
-
-
-        #buy positions
-        if success:
-            if spyRequired > 0.0:
-                print('buying ',spyRequired,' of SPY')
-                spyBuyOrder = rh.place_immediate_market_order(spyInstrumentUrl,'SPY','gfd',spyRequired,'buy',round(spyBuyPrice, 3))
-                print(spyBuyOrder)
-
-                orderOutcome = 'unresolved'
-
-                while orderOutcome != 'resolved':
-                    remainingUnresolved = False
-                    orderResponse = rh.check_order_status(spyBuyOrder['url'])
-                    if orderResponse == 'unresolved':
-                        remainingUnresolved = True
-                    if not remainingUnresolved:
-                        orderOutcome = 'resolved'
-                    else:
-                        print('remaining unresolved spyBuy, waiting')
-                        message += '\nremaining unresolved spyBuy, waiting'
-                        time.sleep(60)
-
+            print('unable to rebalance positions')
+            message += '\nunable to rebalance positions'
 
+        if executor is not None:
+            for line in executor.messages:
+                message += '\n'+line
+            executor.shutdown()
 
-                if orderResponse == 'failure':
-                    success = False
-        if not success:
-            print('unable to buy required spy')
-            message += '\nunable to buy required spy'
-
-        if success:
-            if tltRequired > 0.0:
-                print('buying ',tltRequired,' of TLT')
-                tltBuyOrder = rh.place_immediate_market_order(tltInstrumentUrl,'TLT','gfd',tltRequired,'buy',round(tltBuyPrice, 3))
-                print(tltBuyOrder)
-
-                orderOutcome = 'unresolved'
-
-                while orderOutcome != 'resolved':
-                    remainingUnresolved = False
-                    orderResponse = rh.check_order_status(tltBuyOrder['url'])
-                    if orderResponse == 'unresolved':
-                        remainingUnresolved = True
-                    if not remainingUnresolved:
-                        orderOutcome = 'resolved'
-                    else:
-                        print('remaining unresolved tltBuy, waiting')
-                        message += '\nremaining unresolved tltBuy, waiting'
-                        time.sleep(60)
-
-
-
-                if orderResponse == 'failure':
-                    success = False
-
-        if not success:
-            print('unable to buy required tlt')
-            message += '\nunable to buy required tlt'
-
-        if success:
-            success = rh.logout()
-        if not success:
-            print('unable to logout')
-            message += '\nunable to logout'
-        else:
-            print('succesfully logged out')
-            message += '\nsuccesfully logged out'
-        send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader log '+str(datetime.datetime.now())),message)
+        # no logout, it would revoke the token the gather jobs share
+        send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader log '+str(datetime.datetime.now())),message,session=clients.mailgun())
     except Exception as e:
         print("Unexpected error:", str(e))
-        send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader log '+str(datetime.datetime.now())),("Unexpected error: "+str(e)))
+        send_email(mailgun_domain,mailgun_api_key,diag_email_dest,('resiliant-trader log '+str(datetime.datetime.now())),("Unexpected error: "+str(e)),session=clients.mailgun())
         raise
@@ -0,0 +1,427 @@
+import datetime
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import numpy as np
+import pytest
+import requests
+
+import allocation
+import jobGuard
+import jsonTime
+from fakeRobinhood import FakeRobinhood
+from robinhood import Robinhood, Transport, parse_historicals
+from rollingStats import RollingVolatility
+
+class ThreadedServer(ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer is 3.7+, CI runs 3.6
+    daemon_threads = True
+
+class StubServer:
+    """local HTTP server answering each path with a scripted list of (status, delay) responses"""
+
+    def __init__(self, script):
+        self.script = {path: list(responses) for path, responses in script.items()}
+        self.hits = {}
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.respond()
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self.respond()
+
+            def respond(self):
+                stub.hits[self.path] = stub.hits.get(self.path, 0)+1
+                responses = stub.script[self.path]
+                status, delay = responses.pop(0) if len(responses) > 1 else responses[0]
+                time.sleep(delay)
+                body = b'{}'
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client already gave up on a delayed response
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadedServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(script):
+        server = StubServer(script)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+def transport(**options):
+    options.setdefault('backoff', 0.01)
+    return Transport(**options)
+
+def test_transport_read_timeout(stub):
+    server = stub({'/slow': [(200, 0.5)]})
+    session = transport(read_timeout=0.1, max_retries=1)
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        session.get(server.url+'/slow')
+    # a GET is retried once before giving up
+    assert server.hits['/slow'] == 2
+    assert session.latency_stats()['other']['errors'] == 1
+
+def test_transport_retries_get_on_5xx(stub):
+    server = stub({'/flaky': [(503, 0), (502, 0), (200, 0)]})
+    session = transport(max_retries=3)
+    res = session.get(server.url+'/flaky')
+    assert res.status_code == 200
+    assert server.hits['/flaky'] == 3
+    stats = session.latency_stats()['other']
+    assert stats['retries'] == 2
+    assert stats['errors'] == 0
+
+def test_transport_gives_up_after_max_retries(stub):
+    server = stub({'/down': [(500, 0)]})
+    res = transport(max_retries=2).get(server.url+'/down')
+    assert res.status_code == 500
+    assert server.hits['/down'] == 3
+
+def test_transport_does_not_retry_post_on_5xx(stub):
+    server = stub({'/orders/': [(503, 0), (200, 0)]})
+    res = transport(max_retries=3).post(server.url+'/orders/', data={'side': 'buy'})
+    assert res.status_code == 503
+    assert server.hits['/orders/'] == 1
+
+def test_transport_does_not_retry_post_on_read_timeout(stub):
+    server = stub({'/orders/': [(200, 0.5)]})
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        transport(read_timeout=0.1, max_retries=3).post(server.url+'/orders/', data={'side': 'buy'})
+    assert server.hits['/orders/'] == 1
+
+def test_transport_retries_post_on_429(stub):
+    server = stub({'/orders/': [(429, 0), (201, 0)]})
+    res = transport(max_retries=3).post(server.url+'/orders/', data={'side': 'buy'})
+    assert res.status_code == 201
+    assert server.hits['/orders/'] == 2
+
+def test_transport_latency_counts_concurrent_requests():
+    session = transport()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda i: session._record('quotes', time.time(), 1), range(4000)))
+    stats = session.latency_stats()['quotes']
+    assert stats['count'] == 4000
+    assert stats['retries'] == 4000
+
+@pytest.fixture
+def fake():
+    server = FakeRobinhood(require_auth=False)
+    server.start()
+    yield server
+    server.stop()
+
+def test_quotes_are_batched(fake):
+    rh = Robinhood(base_url=fake.base_url)
+    before = fake.requests
+    quotes = rh.quotes(['SPY', 'TLT'])
+    assert fake.requests-before == 1
+    assert set(quotes) == {'SPY', 'TLT'}
+    for quote in quotes.values():
+        assert quote.bid_price < quote.ask_price
+        assert quote.mid_price == pytest.approx((quote.bid_price+quote.ask_price)/2)
+
+def test_parse_historicals():
+    raw = [
+        {'begins_at': '2018-01-02T14:30:00Z', 'open_price': '1.0', 'low_price': '0.5',
+         'high_price': '2.0', 'close_price': '1.5', 'volume': 100},
+        {'begins_at': '2018-01-02T14:35:00Z', 'open_price': '1.5', 'low_price': '1.0',
+         'high_price': '3.0', 'close_price': '2.5', 'volume': 200}
+    ]
+    barTimes, bars = parse_historicals(raw)
+    assert barTimes.dtype == np.dtype('datetime64[s]')
+    assert barTimes[1]-barTimes[0] == np.timedelta64(5*60, 's')
+    assert bars.dtype == np.float64
+    np.testing.assert_array_equal(bars, [
+        [1.0, 0.5, 2.0, 1.5, 1.25, 100.0],
+        [1.5, 1.0, 3.0, 2.5, 2.0, 200.0]
+    ])
+    assert parse_historicals(raw, dtype=np.float32)[1].dtype == np.float32
+
+def test_parse_historicals_empty():
+    barTimes, bars = parse_historicals([])
+    assert barTimes.shape == (0,)
+    assert bars.shape == (0, 6)
+
+def test_rolling_volatility_matches_window():
+    random = np.random.RandomState(0)
+    span = np.timedelta64(60, 'm')
+    times = np.datetime64('2018-01-02T14:30') + np.arange(500)*np.timedelta64(5, 'm')
+    prices = 100+np.cumsum(random.normal(0, 0.5, len(times)))
+    volumes = random.uniform(100, 1000, len(times))
+    # recompute_every past the series length, so only the add/remove updates run
+    estimator = RollingVolatility(span, recompute_every=10**6)
+    for index, (time, price, volume) in enumerate(zip(times, prices, volumes)):
+        estimator.update(time, price, volume)
+        window = times >= time-span
+        window[index+1:] = False
+        vwap = np.average(prices[window], weights=volumes[window])
+        assert estimator.count == window.sum()
+        assert estimator.vwap() == pytest.approx(vwap)
+        assert estimator.volatility() == pytest.approx(np.std(prices[window]/vwap), rel=1e-6, abs=1e-12)
+
+def test_rolling_volatility_replaces_last_bar():
+    estimator = RollingVolatility(np.timedelta64(60, 'm'))
+    start = np.datetime64('2018-01-02T14:30')
+    estimator.update(start, 10.0, 1.0)
+    estimator.update(start+np.timedelta64(5, 'm'), 12.0, 1.0)
+    estimator.update(start+np.timedelta64(5, 'm'), 14.0, 1.0)
+    assert estimator.count == 2
+    assert estimator.volatility() == pytest.approx(np.std([10.0, 14.0])/12.0)
+
+def test_recommend_shares():
+    weights = np.array([0.6, 0.4])
+    buyPrices = np.array([270.0, 120.0])
+    shares = allocation.recommendShares(10000.0, weights, buyPrices)
+    assert shares.dtype == np.int64
+    floor = np.floor(weights*10000.0/buyPrices)
+    assert (shares >= floor).all()
+    assert (shares*buyPrices).sum() <= 10000.0
+    assert allocation.allocationLoss(weights, allocation.allocationPercentages(shares, buyPrices)) <= \
+        allocation.allocationLoss(weights, allocation.allocationPercentages(floor, buyPrices))
+
+def test_recommend_shares_spends_leftover_cash():
+    # the floor buys 5 and 59 with 100 left, one more share of the first asset is closer to the weights
+    shares = allocation.recommendShares(1190.0, [0.5, 0.5], [100.0, 10.0])
+    np.testing.assert_array_equal(shares, [6, 59])
+
+def test_recommend_shares_too_little_cash():
+    np.testing.assert_array_equal(allocation.recommendShares(50.0, [0.5, 0.5], [270.0, 120.0]), [0, 0])
+
+@pytest.fixture
+def redis(monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    conn = fakeredis.FakeStrictRedis()
+    # run_guarded imports the worker's connection
+    monkeypatch.setitem(sys.modules, 'worker', types.SimpleNamespace(conn=conn))
+    return conn
+
+def test_job_guard_releases_lock(redis):
+    lock = jobGuard.key_prefix+'gather_data:lock'
+
+    def job():
+        assert redis.get(lock) is not None
+        return 'ran'
+
+    assert jobGuard.run_guarded('gather_data', job, time.time()+60, 120, {}) == 'ran'
+    assert redis.get(lock) is None
+
+def test_job_guard_releases_lock_on_error(redis):
+    def job():
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        jobGuard.run_guarded('gather_data', job, time.time()+60, 120, {})
+    assert redis.get(jobGuard.key_prefix+'gather_data:lock') is None
+
+def test_job_guard_keeps_a_lock_it_does_not_own(redis):
+    lock = jobGuard.key_prefix+'trader:lock'
+    redis.set(lock, 'other run')
+    assert jobGuard.run_guarded('trader', lambda: 'ran', time.time()+60, 120, {}) is None
+    assert redis.get(lock) == b'other run'
+
+def test_job_guard_skips_late_jobs(redis):
+    assert jobGuard.run_guarded('trader', lambda: 'ran', time.time()-1, 120, {}) is None
+
+def test_job_guard_coalesces_and_clears_failed_enqueue(redis):
+    class Queue:
+        connection = redis
+        fail = False
+
+        def enqueue_call(self, func, args, timeout, ttl):
+            if self.fail:
+                raise ConnectionError('queue down')
+            return args
+
+    queue = Queue()
+    assert jobGuard.enqueue(queue, 'gather_data', print, 60, 120) is not None
+    assert jobGuard.enqueue(queue, 'gather_data', print, 60, 120) is None
+    redis.delete(jobGuard.key_prefix+'gather_data:queued')
+    queue.fail = True
+    with pytest.raises(ConnectionError):
+        jobGuard.enqueue(queue, 'gather_data', print, 60, 120)
+    assert redis.get(jobGuard.key_prefix+'gather_data:queued') is None
+
+@pytest.fixture
+def db():
+    mongomock = pytest.importorskip('mongomock')
+    return mongomock.MongoClient().get_database('trader')
+
+def test_buckets_keep_fields_aligned_when_a_tick_lacks_one(db):
+    from bucketStore import BucketStore
+    from tickStore import tick_fields
+
+    store = BucketStore(db, fields=tick_fields)
+    start = datetime.datetime(2018, 1, 2, 14, 30)
+    ticks = [
+        {'spy': 0.1, 'outlier': False},
+        {'spy': 0.2},
+        {'spy': 0.3, 'outlier': True}
+    ]
+    for minute, tick in enumerate(ticks):
+        store.append('percentageMove', dict(tick, timestamp=start+datetime.timedelta(minutes=minute)))
+
+    timestamps, columns = store.read('percentageMove', fields=['spy', 'outlier'])
+    assert len(timestamps) == 3
+    np.testing.assert_array_equal(columns['spy'], [0.1, 0.2, 0.3])
+    np.testing.assert_array_equal(columns['outlier'], [0.0, np.nan, 1.0])
+    assert [document['outlier'] for document in store.tail('percentageMove', 3)] == [False, None, True]
+
+def test_tick_store_reads_unmigrated_ticks_in_bucket_mode(db):
+    from bucketStore import BucketStore
+    from tickStore import TickStore, tick_fields
+
+    start = datetime.datetime(2018, 1, 2, 14, 30)
+    for minute in range(3):
+        db.rawPrices.insert_one({'timestamp': start+datetime.timedelta(minutes=minute), 'spy': float(minute)})
+    ticks = TickStore()
+    ticks.use_database(db)
+    ticks.use_buckets(BucketStore(db, fields=tick_fields))
+    assert ticks.last()['spy'] == 2.0
+
+    ticks.buckets.append('rawPrices', {'timestamp': start+datetime.timedelta(minutes=3), 'spy': 3.0})
+    assert [document['spy'] for document in ticks.recent('rawPrices', 3)] == [1.0, 2.0, 3.0]
+
+def executor_for(fake, **options):
+    from orderExecution import OrderExecutor
+    rh = Robinhood(base_url=fake.base_url)
+    options.setdefault('initial_interval', 0.05)
+    options.setdefault('max_interval', 0.2)
+    return rh, OrderExecutor(rh, **options)
+
+def test_order_executor_releases_buys_from_sell_proceeds():
+    from orderExecution import OrderRequest
+    fake = FakeRobinhood(require_auth=False, cash=0.0, positions={'SPY': 10}, fill_delay=0.3)
+    fake.start()
+    try:
+        rh, executor = executor_for(fake)
+        sell = OrderRequest('SPY', rh.instrument_url('SPY'), 10, 'sell', None)
+        buy = OrderRequest('TLT', rh.instrument_url('TLT'), 20, 'buy', 125.0)
+        success, orders = executor.rebalance([sell], [buy])
+        executor.shutdown()
+    finally:
+        fake.stop()
+    assert success
+    assert [order['request'].side for order in orders] == ['sell', 'buy']
+    # the buy only went out once the sell had filled and paid for it
+    placed = {order['side']: order for order in fake.orders.values()}
+    assert placed['buy']['created']-placed['sell']['created'] >= 0.3
+    assert fake.positions['TLT'] == 20
+
+def test_order_executor_sell_failure_stops_buys():
+    from orderExecution import OrderRequest
+    fake = FakeRobinhood(require_auth=False, cash=0.0, positions={'SPY': 1})
+    fake.start()
+    try:
+        rh, executor = executor_for(fake)
+        # more than the position, the broker rejects it
+        sell = OrderRequest('SPY', rh.instrument_url('SPY'), 5, 'sell', None)
+        buy = OrderRequest('TLT', rh.instrument_url('TLT'), 1, 'buy', 125.0)
+        success, orders = executor.rebalance([sell], [buy])
+        executor.shutdown()
+    finally:
+        fake.stop()
+    assert not success
+    assert [order['side'] for order in fake.orders.values()] == ['sell']
+    assert 'buy 1 of TLT not placed' in executor.messages
+
+def test_order_executor_tracks_orders_placed_beside_a_failed_one():
+    from orderExecution import OrderRequest
+    fake = FakeRobinhood(require_auth=False, positions={'SPY': 1, 'TLT': 1})
+    fake.start()
+    try:
+        rh, executor = executor_for(fake)
+        place = rh.place_immediate_market_order
+
+        def placeOrFail(instrument, symbol, *args):
+            if symbol == 'TLT':
+                raise requests.exceptions.ConnectionError('connection reset')
+            return place(instrument, symbol, *args)
+
+        rh.place_immediate_market_order = placeOrFail
+        sells = [
+            OrderRequest('SPY', rh.instrument_url('SPY'), 1, 'sell', None),
+            OrderRequest('TLT', rh.instrument_url('TLT'), 1, 'sell', None)
+        ]
+        success, orders = executor.rebalance(sells, [])
+        executor.shutdown()
+    finally:
+        fake.stop()
+    assert not success
+    assert {order['request'].symbol: order['status'] for order in orders} == {'SPY': 'success', 'TLT': 'failure'}
+    assert fake.positions['SPY'] == 0
+
+def test_order_executor_timeout_cancels_orders():
+    from orderExecution import OrderRequest
+    fake = FakeRobinhood(require_auth=False, positions={'SPY': 1}, fill_delay=60)
+    fake.start()
+    try:
+        rh, executor = executor_for(fake, timeout=0.3)
+        sell = OrderRequest('SPY', rh.instrument_url('SPY'), 1, 'sell', None)
+        buy = OrderRequest('TLT', rh.instrument_url('TLT'), 100, 'buy', 125.0)
+        success, orders = executor.rebalance([sell], [buy])
+        executor.shutdown()
+    finally:
+        fake.stop()
+    assert not success
+    assert [order['status'] for order in orders] == ['canceled']
+    assert [order['state'] for order in fake.orders.values()] == ['canceled']
+    assert 'buy 100 of TLT not placed' in executor.messages
+
+def test_redis_serialization_round_trips():
+    import riskFreeRate
+    import tokenStore
+
+    moment = datetime.datetime(2018, 1, 2, 14, 30, 15, 250000)
+    rawData = {'_id': 'mongo id', 'timestamp': moment, 'spy': 270.5}
+    assert jsonTime.deserialize(jsonTime.serialize(rawData, ('timestamp',)), ('timestamp',)) == \
+        {'timestamp': moment, 'spy': 270.5}
+    token = {'token': 'abc', 'issued': moment}
+    assert tokenStore.deserialize(tokenStore.serialize(token)) == token
+    rate = {'rate': 1.25, 'date': datetime.datetime(2018, 1, 2), 'fetched': moment}
+    assert riskFreeRate.deserialize(riskFreeRate.serialize(rate)) == rate
+    # the format already in Redis keeps reading back
+    assert riskFreeRate.deserialize('{"rate": 1.25, "date": "2018-01-02", "fetched": 1514903415.25}') == rate
+
+def test_tick_store_shares_the_last_tick_through_redis(redis):
+    from tickStore import TickStore
+
+    moment = datetime.datetime(2018, 1, 2, 14, 30, 15, 250000)
+    writer = TickStore()
+    writer.use_redis(redis)
+    writer._cache({'timestamp': moment, 'spy': 270.5})
+    # an older tick from a late job doesn't replace it
+    writer._cache({'timestamp': moment-datetime.timedelta(minutes=1), 'spy': 1.0})
+    reader = TickStore()
+    reader.use_redis(redis)
+    assert reader.last() == {'timestamp': moment, 'spy': 270.5}
@@ -0,0 +1,179 @@
+import threading
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, PyMongoError
+from redis.exceptions import RedisError
+
+import jsonTime
+
+tick_collections = ('rawPrices', 'percentageMove', 'tracking')
+
+# every field a gather tick writes, pushed on each tick so the bucket arrays stay aligned
+tick_fields = {
+    'rawPrices': ('spy', 'tlt', 'portfolio', 'annualized90day'),
+    'percentageMove': ('spy', 'tlt', 'portfolio', '90dayTreasury', 'outlier'),
+    'tracking': ('spyActual', 'tltActual', 'spyTarget', 'tltTarget')
+}
+
+# only replace the cached tick with a newer one, so a late job can't roll it back
+set_if_newer = """
+local current = redis.call('GET', KEYS[1])
+if current and cjson.decode(current)['timestamp'] >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1])
+return 1
+"""
+
+class TickStore:
+    """writes a gather tick to rawPrices, percentageMove and tracking as one unit
+
+    The three inserts run in order and any that landed are deleted again if
+    a later one fails, so a tick is either fully written or not written at
+    all. pymongo 3.5 has no sessions, so there is no transaction to use
+    instead. The last written rawPrices document is kept in memory, which
+    only outlives the job in a warm worker, and with `use_redis` also in
+    Redis so it survives across forked jobs and workers. Mongo is only read
+    on a cold start or when Redis is unavailable.
+
+    With `use_buckets` a tick is a single bulk write of three bucket appends,
+    and the per-tick collections are only written too with `legacy` set,
+    while the old collections are being migrated.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.lastRaw = None
+        self.redis = None
+        self.redisKey = None
+        self.buckets = None
+        self.legacy = True
+        self.lock = threading.Lock()
+
+    def use_database(self, db):
+        """write to `db`, its indexes come from `create_indexes`
+        Args:
+            db (:obj:`pymongo.database.Database`): database holding the tick collections
+        """
+        self.db = db
+
+    @staticmethod
+    def create_indexes(db):
+        """the timestamp indexes the reads rely on"""
+        for name in tick_collections:
+            db[name].create_index([('timestamp', ASCENDING)])
+
+    def use_buckets(self, buckets, legacy=False):
+        """write ticks to day buckets
+        Args:
+            buckets (:obj:`bucketStore.BucketStore`): bucketed series store
+            legacy (bool): keep writing the per-tick collections as well,
+                e.g. until `bucketStore.py` has migrated them
+        """
+        self.buckets = buckets
+        self.legacy = legacy
+
+    def use_redis(self, conn, key='resiliant-trader:lastTick'):
+        """cache the previous tick in Redis
+        Args:
+            conn (:obj:`redis.Redis`): connection, e.g. `worker.conn`
+            key (str): key holding the serialized rawPrices document
+        """
+        self.redis = conn
+        self.redisKey = key
+        self.setIfNewer = conn.register_script(set_if_newer)
+
+    def last(self):
+        """the most recent rawPrices document, from Redis, then memory, then Mongo
+        Note:
+            Redis is read first when configured since other workers write it too
+        """
+        with self.lock:
+            if self.redis is not None:
+                try:
+                    cached = self.redis.get(self.redisKey)
+                    if cached is not None:
+                        self.lastRaw = jsonTime.deserialize(cached, ('timestamp',))
+                except RedisError as e:
+                    print('redis last tick error ', str(e))
+            if self.lastRaw is None:
+                recent = self.recent('rawPrices', 1)
+                self.lastRaw = recent[-1] if recent else None
+                self._cache(self.lastRaw)
+            return self.lastRaw
+
+    def recent(self, name, count):
+        """the last `count` documents of a tick series, oldest first, from wherever ticks are written
+        Note:
+            in bucket mode, ticks older than the buckets are read from the
+            per-tick collection, so a store that hasn't been migrated by
+            `bucketStore.py` yet still finds its previous ticks
+        """
+        documents = []
+        query = {}
+        if self.buckets is not None and not self.legacy:
+            documents = self.buckets.tail(name, count)
+            if len(documents) >= count:
+                return documents
+            if documents:
+                query = {'timestamp': {'$lt': documents[0]['timestamp']}}
+        older = self.db[name].find(query, sort=[('timestamp', DESCENDING)], limit=count-len(documents))
+        return list(older)[::-1]+documents
+
+    def remember(self, rawData):
+        """seed the in-memory previous tick, e.g. from another cache"""
+        with self.lock:
+            self.lastRaw = rawData
+
+    def write(self, rawData, percentageData, trackingData):
+        """insert one tick into all three collections
+        Returns:
+            (dict): collection name -> inserted id
+        """
+        documents = dict(zip(tick_collections, (rawData, percentageData, trackingData)))
+        if self.buckets is not None and not self.legacy:
+            ids = self._write_buckets(documents)
+        else:
+            ids = self._write_compensated(documents)
+        self.remember(rawData)
+        self._cache(rawData)
+        return ids
+
+    def _cache(self, rawData):
+        if self.redis is None or rawData is None:
+            return
+        try:
+            serialized = jsonTime.serialize(rawData, ('timestamp',))
+            self.setIfNewer(keys=[self.redisKey], args=[serialized, jsonTime.to_seconds(rawData['timestamp'])])
+        except RedisError as e:
+            # Mongo already has the tick, the next cold read falls back to it
+            print('redis last tick error ', str(e))
+
+    def _write_buckets(self, documents):
+        # one bulk write, the appends that landed are popped again if a later one fails
+        try:
+            self.buckets.append_many(documents.items())
+        except BulkWriteError as e:
+            failed = min(error['index'] for error in e.details['writeErrors'])
+            undo = [self.buckets.undo_operation(name, document) for name, document in list(documents.items())[:failed]]
+            if undo:
+                self.buckets.collection.bulk_write(undo, ordered=False)
+            raise
+        return {name: document['timestamp'] for name, document in documents.items()}
+
+    def _write_compensated(self, documents):
+        ids = {}
+        try:
+            for name, document in documents.items():
+                ids[name] = self.db[name].insert_one(document).inserted_id
+        except PyMongoError:
+            for name, insertedId in ids.items():
+                self.db[name].delete_one({'_id': insertedId})
+            raise
+        if self.buckets is not None:
+            try:
+                self.buckets.append_many(documents.items())
+            except PyMongoError as e:
+                # the tick collections are the source, `bucketStore.py` rebuilds the day
+                print('bucket append error ', str(e))
+        return ids
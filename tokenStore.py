@@ -0,0 +1,179 @@
+import datetime
+import threading
+import time
+
+from redis.exceptions import RedisError
+
+import jsonTime
+
+class TokenStore:
+    """one Robinhood auth token shared by every job instead of a login per tick
+
+    `login` hands a client the cached token and only posts the credentials
+    when there is none, or when it is older than `refresh_after`. The token
+    is kept in memory and, with `use_redis`, in Redis with a `ttl` expiry so
+    every job and worker process reuses it. Only one worker logs in at a
+    time (an NX lock), the others keep using the current token meanwhile.
+    A 401 on any request logs in again and retries it, through
+    `Transport.reauthenticate`.
+    """
+
+    def __init__(self, username, password, ttl=24*60*60, refresh_after=20*60*60, wait=10):
+        """
+        Args:
+            username (str): Robinhood username
+            password (str): Robinhood password
+            ttl (float): seconds a token is kept, it is dropped afterwards
+            refresh_after (float): seconds before a token is replaced by a new login
+            wait (float): seconds to wait for another worker's login before logging in anyway
+        """
+        self.username = username
+        self.password = password
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self.wait = wait
+        self.redis = None
+        self.redisKey = None
+        self.latest = None
+        self.logins = 0
+        self.lock = threading.RLock()
+
+    def use_redis(self, conn, key='resiliant-trader:authToken'):
+        """share the token between jobs and workers
+        Args:
+            conn (:obj:`redis.Redis`): connection, e.g. `worker.conn`
+            key (str): key holding the token
+        """
+        self.redis = conn
+        self.redisKey = key
+
+    def login(self, rh):
+        """authenticate `rh` with the shared token, logging in only when needed
+        Args:
+            rh (:obj:`Robinhood`): client to authenticate
+        Returns:
+            (bool): `rh` has a token
+        Raises:
+            (:obj:`Exception`) the `Robinhood.login` error when the credentials are rejected
+        """
+        rh.session.reauthenticate = lambda: self.reauthenticate(rh)
+        cached = self.cached()
+        if cached is None:
+            cached = self.refresh(rh)
+        elif self.age(cached) > self.refresh_after:
+            try:
+                cached = self.refresh(rh, blocking=False) or cached
+            except Exception as e:
+                # the old token still works until it expires
+                print('auth token refresh error ', str(e))
+        if cached is None:
+            return False
+        rh.use_token(cached['token'])
+        return True
+
+    def reauthenticate(self, rh):
+        """after a 401, use a newer token from another worker or log in again"""
+        rejected = rh.auth_token
+        self.invalidate(rejected)
+        cached = self.cached()
+        if cached is None or cached['token'] == rejected:
+            try:
+                cached = self.refresh(rh)
+            except Exception as e:
+                print('auth token login error ', str(e))
+                return False
+        if cached is None:
+            return False
+        rh.use_token(cached['token'])
+        return True
+
+    def cached(self):
+        """{'token', 'issued'} from Redis or memory, None when there is no live token"""
+        if self.redis is not None:
+            try:
+                serialized = self.redis.get(self.redisKey)
+                if serialized is not None:
+                    self.latest = deserialize(serialized)
+            except RedisError as e:
+                print('redis auth token error ', str(e))
+        if self.latest is not None and self.age(self.latest) > self.ttl:
+            self.latest = None
+        return self.latest
+
+    def refresh(self, rh, blocking=True):
+        """log in and store the new token
+        Args:
+            rh (:obj:`Robinhood`): client used to post the credentials
+            blocking (bool): wait for a login running on another worker
+                rather than returning None
+        Returns:
+            (dict): {'token', 'issued'}, None if not blocking and another worker is logging in
+        """
+        with self.lock:
+            acquired = self.acquire()
+            if not acquired:
+                if not blocking:
+                    return None
+                deadline = time.time()+self.wait
+                while time.time() < deadline:
+                    time.sleep(0.1)
+                    cached = self.cached()
+                    if cached is not None and self.age(cached) < self.refresh_after:
+                        return cached
+            # the login POST itself must not trigger another reauthentication
+            reauthenticate = rh.session.reauthenticate
+            rh.session.reauthenticate = None
+            try:
+                if not rh.login(username=self.username, password=self.password):
+                    return None
+            finally:
+                rh.session.reauthenticate = reauthenticate
+                if acquired:
+                    self.release()
+            self.logins += 1
+            entry = {'token': rh.auth_token, 'issued': datetime.datetime.utcnow()}
+            self.latest = entry
+            if self.redis is not None:
+                try:
+                    self.redis.set(self.redisKey, serialize(entry), ex=int(self.ttl))
+                except RedisError as e:
+                    print('redis auth token error ', str(e))
+            return entry
+
+    def invalidate(self, token):
+        """forget `token`, unless another worker has already replaced it"""
+        if self.latest is not None and self.latest['token'] == token:
+            self.latest = None
+        if self.redis is not None:
+            try:
+                serialized = self.redis.get(self.redisKey)
+                if serialized is not None and deserialize(serialized)['token'] == token:
+                    self.redis.delete(self.redisKey)
+            except RedisError as e:
+                print('redis auth token error ', str(e))
+
+    def acquire(self):
+        if self.redis is None:
+            return True
+        try:
+            return bool(self.redis.set(self.redisKey+':login', 1, nx=True, ex=max(1, int(self.wait))))
+        except RedisError as e:
+            print('redis auth token error ', str(e))
+            return True
+
+    def release(self):
+        if self.redis is not None:
+            try:
+                self.redis.delete(self.redisKey+':login')
+            except RedisError as e:
+                print('redis auth token error ', str(e))
+
+    @staticmethod
+    def age(entry):
+        return (datetime.datetime.utcnow()-entry['issued']).total_seconds()
+
+def serialize(entry):
+    return jsonTime.serialize({'token': entry['token'], 'issued': entry['issued']}, ('issued',))
+
+def deserialize(serialized):
+    return jsonTime.deserialize(serialized, ('issued',))
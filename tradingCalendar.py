@@ -0,0 +1,149 @@
+import datetime
+import os
+import sys
+import threading
+
+from pymongo import ASCENDING, MongoClient, UpdateOne
+
+from robinhood import Robinhood
+
+class TradingCalendar:
+    """market sessions fetched once per day and answered from memory
+
+    `Robinhood.marketOpenCheck` asks the `markets` endpoints on every call.
+    Here each day's combined hours are fetched once with
+    `Robinhood.market_hours`, kept in memory and, with `use_collection`, in
+    Mongo so other processes reuse them. Open checks and the next open/close
+    are then dictionary lookups.
+    """
+
+    def __init__(self, lookahead=10):
+        """
+        Args:
+            lookahead (int): days searched by `next_open` and `next_close`
+        """
+        self.lookahead = lookahead
+        self.sessions = {}
+        self.collection = None
+        self.lock = threading.Lock()
+
+    def use_collection(self, collection):
+        """store sessions in Mongo, one document per date
+        Note:
+            the index is made once by `create_indexes`, not per job
+        Args:
+            collection (:obj:`pymongo.collection.Collection`): e.g. db.marketHours
+        """
+        self.collection = collection
+
+    @staticmethod
+    def create_indexes(collection):
+        """unique date index"""
+        collection.create_index([('date', ASCENDING)], unique=True)
+
+    def session(self, rh, date):
+        """hours for `date` from memory, then Mongo, then Robinhood
+        Args:
+            rh (:obj:`Robinhood`): client used on a miss, None to only read stored sessions
+            date (:obj:`datetime.date`): UTC date
+        Returns:
+            (dict): see `Robinhood.market_hours`
+        Raises:
+            (:obj:`LookupError`) the day isn't stored and `rh` is None
+        """
+        key = midnight(date)
+        with self.lock:
+            hours = self.sessions.get(key)
+        if hours is not None:
+            return hours
+        if self.collection is not None:
+            hours = self.collection.find_one({'date': key}, projection={'_id': False})
+        if hours is None:
+            if rh is None:
+                raise LookupError('no stored market hours for '+str(key.date()))
+            hours = rh.market_hours(key.date())
+            if self.collection is not None:
+                self.collection.update_one({'date': key}, {'$set': hours}, upsert=True)
+        with self.lock:
+            self.sessions[key] = hours
+        return hours
+
+    def load_range(self, rh, start, end):
+        """make sure every date in [start, end] is stored, fetching only missing ones
+        Args:
+            rh (:obj:`Robinhood`): client for missing days
+            start (:obj:`datetime.date`): first date
+            end (:obj:`datetime.date`): last date
+        Returns:
+            (int): days fetched from Robinhood
+        """
+        start = midnight(start)
+        end = midnight(end)
+        if self.collection is not None:
+            stored = self.collection.find({'date': {'$gte': start, '$lte': end}}, projection={'_id': False})
+            with self.lock:
+                for hours in stored:
+                    self.sessions[hours['date']] = hours
+        fetched = []
+        day = start
+        while day <= end:
+            with self.lock:
+                missing = day not in self.sessions
+            if missing:
+                hours = rh.market_hours(day.date())
+                fetched.append(hours)
+                with self.lock:
+                    self.sessions[day] = hours
+            day += datetime.timedelta(days=1)
+        if fetched and self.collection is not None:
+            self.collection.bulk_write([
+                UpdateOne({'date': hours['date']}, {'$set': hours}, upsert=True) for hours in fetched
+            ], ordered=False)
+        return len(fetched)
+
+    def is_open(self, rh=None, now=None):
+        """True between today's open and close
+        Args:
+            rh (:obj:`Robinhood`): client for a day that isn't stored yet
+            now (:obj:`datetime.datetime`): naive UTC time, defaults to now
+        """
+        now = now or datetime.datetime.utcnow()
+        hours = self.session(rh, now.date())
+        return bool(hours['is_open']) and hours['opens_at'] <= now <= hours['closes_at']
+
+    def next_open(self, rh=None, now=None):
+        """start of the next session after `now`, None if none within `lookahead` days"""
+        return self._next('opens_at', rh, now)
+
+    def next_close(self, rh=None, now=None):
+        """end of the current or next session, None if none within `lookahead` days"""
+        return self._next('closes_at', rh, now)
+
+    def _next(self, field, rh, now):
+        now = now or datetime.datetime.utcnow()
+        for offset in range(self.lookahead):
+            hours = self.session(rh, now.date()+datetime.timedelta(days=offset))
+            if hours['is_open'] and hours[field] > now:
+                return hours[field]
+        return None
+
+def midnight(date):
+    return datetime.datetime(date.year, date.month, date.day)
+
+if __name__ == '__main__':
+    # python tradingCalendar.py [days], stores the hours of the next days (default 30) in the marketHours collection
+    try:
+        import config
+        print('using local config file')
+        mongodb_uri = config.mongodb_uri
+    except:
+        print('using environment variable')
+        mongodb_uri = os.getenv('MONGODB_URI')
+
+    calendar = TradingCalendar()
+    collection = MongoClient(mongodb_uri).get_database().marketHours
+    TradingCalendar.create_indexes(collection)
+    calendar.use_collection(collection)
+    start = datetime.datetime.utcnow().date()
+    end = start+datetime.timedelta(days=int(sys.argv[1]) if len(sys.argv) > 1 else 30)
+    print('days fetched:', calendar.load_range(Robinhood(), start, end))
@@ -1,7 +1,8 @@
 import os
+import sys
 
 import redis
-from rq import Worker, Queue, Connection
+from rq import Worker, SimpleWorker, Queue, Connection
 
 try:
     import config
@@ -17,6 +18,24 @@ listen = ['high', 'default', 'low']
 conn = redis.from_url(redis_url)
 
 if __name__ == '__main__':
+ # python worker.py --warm (or WORKER_MODE=warm), the Procfile default, runs every
+ # job in this process with shared clients, so the module level caches in run.py
+ # (bars, ticks, outliers, rates, calendar, token, instruments) persist between
+ # ticks. Jobs run one at a time and without fork isolation: a job that leaks
+ # memory or crashes the interpreter takes the worker with it. Without the flag
+ # the stock forking Worker starts every job cold.
+ warm = '--warm' in sys.argv or os.getenv('WORKER_MODE') == 'warm'
+ import run
+ try:
+     from createIndexes import create_indexes
+     from pymongo import MongoClient
+     create_indexes(MongoClient(run.mongodb_uri).get_database())
+ except Exception as e:
+     # jobs still run, queries are only slower without the indexes
+     print('index creation error ', str(e))
+ if warm:
+     from clientPool import ClientPool
+     run.warmClients = ClientPool(run.mongodb_uri)
  with Connection(conn):
-     worker = Worker(map(Queue, listen))
+     worker = (SimpleWorker if warm else Worker)(map(Queue, listen))
      worker.work()